@@ -15,7 +15,8 @@ with codecs.open(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'READM
 description = 'A tool for atlasing UVs.'
 
 install_requires = [
-    'rectangle-packer'
+    'rectangle-packer',
+    'numpy'
 ]
 
 tests_requires = [
@@ -51,6 +52,13 @@ setup(
         'Topic :: Multimedia :: Graphics :: 3D Modeling',
     ],
     install_requires=install_requires,
+    entry_points={
+        'console_scripts': [
+            'uvpacker-batch = uvpacker.cli:main',
+            'uvpacker-service = uvpacker.service:main',
+            'uvpacker-benchmark = uvpacker.benchmark:main',
+        ],
+    },
     extras_require={
         'tests': tests_requires,
         'dev': dev_requires
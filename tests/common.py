@@ -0,0 +1,50 @@
+import numpy as np
+
+from uvpacker import pipeline
+from uvpacker.plugins.pmemory import MemoryInterface, MemoryScene, generate_mesh
+
+
+def build_scene(meshes=3, shells=12, seed=0):
+    scene = MemoryScene()
+    for index in range(meshes):
+        scene.add_mesh('mesh%d' % index, generate_mesh(shells, (3, 3), seed + index))
+    return scene
+
+
+def processed_uv_data(scene=None):
+    """Extracts and processes every mesh of scene the way the tool does, at unit scale"""
+    dcc = MemoryInterface
+    dcc.scene = scene or build_scene()
+    dcc.set_cache(None)
+    uv_data, _ = dcc.get_uv_data(sorted(dcc.scene.transforms))
+    results = pipeline.process_uv_data(pipeline.NULL_JOB, uv_data, 1.0, 1.0, uv_key=dcc.uv_coords,
+                                       faces_key=dcc.uv_faces, bbox_key=dcc.bbox, mesh_key=dcc.mesh_faces)
+    for xform in results:
+        for shape in results[xform]:
+            uv_data[xform][shape].update(results[xform][shape])
+    return uv_data
+
+
+def random_bboxes(count, seed=0, low=0.01, high=0.2):
+    rng = np.random.RandomState(seed)
+    mins = rng.uniform(0.0, 0.8, size=(count, 2))
+    sizes = rng.uniform(low, high, size=(count, 2))
+    return np.stack([mins, mins + sizes], axis=-1)
+
+
+def placed_boxes(bboxes, scale, offsets):
+    """Returns the (min_x, min_y, max_x, max_y) boxes packed shells end up in"""
+    bboxes = np.asarray(bboxes).reshape(-1, 2, 2)
+    sizes = (bboxes[:, :, 1] - bboxes[:, :, 0]) * np.reshape(scale, (-1, 1))
+    return np.column_stack([offsets, offsets + sizes])
+
+
+def overlapping_pairs(boxes, tolerance=1e-9):
+    """Brute force list of the box pairs overlapping with a positive area"""
+    pairs = []
+    for first in range(len(boxes)):
+        for second in range(first + 1, len(boxes)):
+            a, b = boxes[first], boxes[second]
+            if min(a[2], b[2]) - max(a[0], b[0]) > tolerance and min(a[3], b[3]) - max(a[1], b[1]) > tolerance:
+                pairs.append((first, second))
+    return pairs
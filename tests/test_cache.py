@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from uvpacker import cache, pipeline
+from uvpacker.cache import UVCache
+from uvpacker.plugins.pmemory import MemoryInterface, generate_mesh
+
+from .common import build_scene
+
+
+class CacheKeyTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dcc = MemoryInterface
+        self.dcc.scene = build_scene()
+        self.dcc.set_cache(UVCache(self.directory, 1 << 30))
+        self.checksummed = []
+        checksum = self.dcc.__dict__['get_shape_checksum']
+
+        def counting(cls, shape):
+            self.checksummed.append(shape)
+            return checksum.__func__(cls, shape)
+        self.dcc.get_shape_checksum = classmethod(counting)
+        self.addCleanup(setattr, self.dcc, 'get_shape_checksum', checksum)
+
+    def tearDown(self):
+        self.dcc.set_cache(None)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def extract(self):
+        del self.checksummed[:]
+        uv_data, _ = self.dcc.get_uv_data(sorted(self.dcc.scene.transforms))
+        results = pipeline.process_uv_data(pipeline.NULL_JOB, uv_data, 1.0, 1.0, cache=self.dcc.cache,
+                                           uv_key=self.dcc.uv_coords, faces_key=self.dcc.uv_faces,
+                                           bbox_key=self.dcc.bbox, mesh_key=self.dcc.mesh_faces)
+        return dict((shape, uv_data[xform][shape]) for xform in results for shape in results[xform])
+
+    def test_hits_skip_the_checksum(self):
+        first = self.extract()
+        self.assertEqual(sorted(self.checksummed), sorted(first))
+        second = self.extract()
+        self.assertEqual(self.checksummed, [])
+        for shape in second:
+            self.assertTrue(second[shape].get(pipeline.CACHED))
+            self.assertEqual(second[shape][pipeline.CACHE_KEY], first[shape][pipeline.CACHE_KEY])
+
+    def test_edits_change_the_key(self):
+        first = self.extract()
+        shape = sorted(first)[0]
+        self.dcc.scene.set_uvs(shape, self.dcc.scene.meshes[shape].uvs * 0.5)
+        second = self.extract()
+        self.assertEqual(self.checksummed, [shape])
+        self.assertNotEqual(second[shape][pipeline.CACHE_KEY], first[shape][pipeline.CACHE_KEY])
+        self.assertFalse(second[shape].get(pipeline.CACHED))
+
+    def test_replaced_meshes_change_the_key(self):
+        first = self.extract()
+        shape = sorted(first)[0]
+        self.dcc.scene.meshes[shape] = generate_mesh(12, (3, 3), seed=42)
+        second = self.extract()
+        self.assertEqual(self.checksummed, [shape])
+        self.assertNotEqual(second[shape][pipeline.CACHE_KEY], first[shape][pipeline.CACHE_KEY])
+
+
+class EvictionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = UVCache(self.directory, 1 << 30)
+        for index in range(3):
+            self.cache.put('entry%d' % index, {'values': np.zeros(1000)})
+            os.utime(os.path.join(self.cache.entry_path('entry%d' % index), cache.META_FILE), (index, index))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def entry_sizes(self):
+        return dict((key, UVCache.directory_size(self.cache.entry_path(key))) for key in self.cache.keys())
+
+    def test_evicts_least_recently_used(self):
+        sizes = self.entry_sizes()
+        self.cache.max_bytes = sizes['entry1'] + sizes['entry2']
+        self.cache.evict()
+        self.assertEqual(sorted(self.cache.keys()), ['entry1', 'entry2'])
+        self.assertEqual(self.cache.size, sizes['entry1'] + sizes['entry2'])
+
+    def test_keeps_counting_entries_it_cannot_remove(self):
+        sizes = self.entry_sizes()
+        self.cache.max_bytes = sizes['entry0'] + sizes['entry2']
+        rmtree = shutil.rmtree
+        cache.shutil.rmtree = lambda path, ignore_errors=False: None if path.endswith('entry0') else rmtree(path)
+        try:
+            self.cache.evict()
+        finally:
+            cache.shutil.rmtree = rmtree
+        self.assertEqual(sorted(self.cache.keys()), ['entry0', 'entry2'])
+        self.assertEqual(self.cache.size, sizes['entry0'] + sizes['entry2'])
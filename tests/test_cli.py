@@ -0,0 +1,30 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from uvpacker import cli
+
+
+class ParseArgsTest(unittest.TestCase):
+    def test_incremental_rejects_options_it_cannot_honour(self):
+        for option in (['--dedupe', 'stack'], ['--texel-density']):
+            with self.assertRaises(SystemExit):
+                cli.parse_args(['mesh.obj', '--layout', 'mesh.uvl', '--incremental'] + option)
+        args = cli.parse_args(['mesh.obj', '--layout', 'mesh.uvl', '--incremental'])
+        self.assertTrue(args.incremental)
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.limits = []
+        self.addCleanup(setattr, cli, 'limit_memory', cli.limit_memory)
+        cli.limit_memory = self.limits.append
+
+    def test_single_process_runs_are_memory_limited(self):
+        path = os.path.join(self.directory, 'empty.obj')
+        open(path, 'w').close()
+        cli.main([path, '-j', '4', '--max-memory', '512', '-o', self.directory])
+        self.assertEqual(self.limits, [512])
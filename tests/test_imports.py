@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEADLESS_MODULES = ['uvpacker', 'uvpacker.cli', 'uvpacker.pipeline', 'uvpacker.overlap', 'uvpacker.layout',
+                    'uvpacker.cache', 'uvpacker.incremental', 'uvpacker.service', 'uvpacker.benchmark']
+DCC_MODULES = ('PySide2', 'shiboken2', 'maya')
+
+# Runs in a fresh interpreter where importing any DCC module fails, as it would in a bare mayapy
+SCRIPT = '''
+import sys
+for name in %(blocked)r:
+    sys.modules[name] = None
+for name in %(modules)r:
+    __import__(name)
+from uvpacker import plugins
+loaded = sorted(plugins._loaded)
+plugins.get('memory')
+print(repr((loaded, sorted(plugins._loaded),
+            sorted(name for name in sys.modules if name.split('.')[0] in %(blocked)r and sys.modules[name]))))
+'''
+
+
+class HeadlessImportTest(unittest.TestCase):
+    def run_script(self, modules):
+        output = subprocess.check_output(
+            [sys.executable, '-c', SCRIPT % {'blocked': DCC_MODULES, 'modules': modules}], cwd=ROOT,
+            env=dict(os.environ, PYTHONPATH=ROOT))
+        return eval(output.decode('ascii').strip().splitlines()[-1])
+
+    def test_imports_without_a_dcc(self):
+        loaded, after_get, dcc_modules = self.run_script(HEADLESS_MODULES)
+        self.assertEqual(loaded, [])
+        self.assertEqual(after_get, ['memory'])
+        self.assertEqual(dcc_modules, [])
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from uvpacker import pipeline
+from uvpacker.layout import Layout, LayoutError
+
+from .common import processed_uv_data
+
+
+class LayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.uv_data = processed_uv_data()
+        self.shapes, bboxes = pipeline.collect_shell_bboxes(self.uv_data)
+        self.scale, self.offsets, _ = pipeline.pack_collected(pipeline.NULL_JOB, self.uv_data, self.shapes, bboxes)
+        self.layout = Layout.from_pack(self.uv_data, self.shapes, self.scale, self.offsets, padding=0.005)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_save_load_round_trip(self):
+        path = self.layout.save(os.path.join(self.directory, 'packed.uvl'))
+        self.assertTrue(os.path.isfile(path + '.json'))
+        loaded = Layout.load(path)
+        self.assertEqual(loaded.shapes, self.layout.shapes)
+        self.assertEqual(loaded.meta['padding'], 0.005)
+        for field in loaded.shells.dtype.names:
+            np.testing.assert_array_equal(loaded.shells[field], self.layout.shells[field])
+
+    def test_apply_matches_the_pack(self):
+        path = self.layout.save(os.path.join(self.directory, 'packed.uvl'), sidecar=False)
+        self.assert_applies_the_pack(Layout.load(path), self.uv_data)
+
+    def assert_applies_the_pack(self, layout, uv_data):
+        applied = layout.apply(uv_data)
+        packed = pipeline.apply_packed_layout(self.uv_data, self.shapes, self.scale, self.offsets)
+        for xform, shape in self.shapes:
+            np.testing.assert_allclose(applied[xform][shape][0], packed[xform][shape][0])
+            np.testing.assert_allclose(applied[xform][shape][1], packed[xform][shape][1])
+
+    def edited_shape(self, index=0):
+        """Copies uv_data with the given shape's entries copied too, so they can be edited"""
+        xform, shape = self.shapes[index]
+        uv_data = dict((x, dict(shapes)) for x, shapes in self.uv_data.items())
+        uv_data[xform][shape] = dict(uv_data[xform][shape])
+        return uv_data, uv_data[xform][shape]
+
+    def test_apply_follows_recorded_shell_ids(self):
+        shells = self.layout.shape_shells()[0]
+        records = np.array(self.layout.shells)
+        records[shells] = records[shells][::-1]
+        self.assert_applies_the_pack(Layout(self.layout.shapes, records), self.uv_data)
+
+    def test_apply_pairs_reordered_shells_by_bbox(self):
+        uv_data, shape_uv_data = self.edited_shape()
+        count = len(shape_uv_data[pipeline.SHELL_BBOXES])
+        renumber = np.roll(np.arange(count), 1)
+        shape_uv_data[pipeline.SHELL_IDS] = renumber[shape_uv_data[pipeline.SHELL_IDS]]
+        bboxes = np.empty_like(shape_uv_data[pipeline.SHELL_BBOXES])
+        bboxes[renumber] = shape_uv_data[pipeline.SHELL_BBOXES]
+        shape_uv_data[pipeline.SHELL_BBOXES] = bboxes
+        self.assert_applies_the_pack(self.layout, uv_data)
+
+    def test_apply_rejects_other_shells(self):
+        uv_data, shape_uv_data = self.edited_shape()
+        bboxes = np.array(shape_uv_data[pipeline.SHELL_BBOXES])
+        bboxes[0] += 0.5
+        shape_uv_data[pipeline.SHELL_BBOXES] = bboxes
+        with self.assertRaises(LayoutError):
+            self.layout.apply(uv_data)
+
+        uv_data, shape_uv_data = self.edited_shape()
+        shape_uv_data[pipeline.SHELL_BBOXES] = shape_uv_data[pipeline.SHELL_BBOXES][:-1]
+        with self.assertRaises(LayoutError):
+            self.layout.apply(uv_data)
+
+    def test_rejects_other_files(self):
+        path = os.path.join(self.directory, 'bogus.uvl')
+        with open(path, 'wb') as f:
+            f.write(b'not a layout at all, just some bytes')
+        with self.assertRaises(LayoutError):
+            Layout.load(path)
@@ -0,0 +1,73 @@
+import unittest
+
+import numpy as np
+
+from uvpacker import overlap, pipeline
+from uvpacker.plugins.pmemory import MemoryInterface, MemoryScene, generate_mesh
+
+from .common import overlapping_pairs, processed_uv_data
+
+
+def brute_force(uv_data, min_area=1e-10):
+    """Clips every triangle of every shell against every triangle of every other shell"""
+    shapes, bboxes = pipeline.collect_shell_bboxes(uv_data)
+    triangles, shells = overlap.shell_triangles(uv_data, shapes, np.ones(len(bboxes), dtype=bool),
+                                                MemoryInterface.uv_coords, MemoryInterface.uv_faces)
+    first, second = np.triu_indices(len(triangles), 1)
+    first, second = first[shells[first] != shells[second]], second[shells[first] != shells[second]]
+    areas = overlap.triangle_overlap_areas(triangles[first], triangles[second])
+    totals = {}
+    for a, b, area in zip(shells[first], shells[second], areas):
+        key = (min(a, b), max(a, b))
+        totals[key] = totals.get(key, 0.0) + area
+    return dict((key, area) for key, area in totals.items() if area > min_area)
+
+
+def mixed_scene(shells=10):
+    """Rectangular shells filling their bbox next to sheared ones that do not"""
+    scene = MemoryScene()
+    for index, shear in enumerate((0.0, 0.4, 0.0, -0.3)):
+        scene.add_mesh('mesh%d' % index, generate_mesh(shells, (2, 2), index, shear=shear))
+    return scene
+
+
+class FindOverlapsTest(unittest.TestCase):
+    def assert_matches(self, uv_data, **kwargs):
+        _, _, pairs, areas = overlap.find_overlaps(pipeline.NULL_JOB, uv_data, MemoryInterface.uv_coords,
+                                                   MemoryInterface.uv_faces, **kwargs)
+        expected = brute_force(uv_data)
+        found = dict(zip(map(tuple, pairs.tolist()), areas))
+        self.assertEqual(sorted(found), sorted(expected))
+        for key in expected:
+            self.assertAlmostEqual(found[key], expected[key], places=12)
+
+    def test_matches_brute_force(self):
+        self.assert_matches(processed_uv_data(mixed_scene()))
+
+    def test_small_batches(self):
+        self.assert_matches(processed_uv_data(mixed_scene()), batch_size=7)
+
+    def test_grid_layout(self):
+        scene = MemoryScene()
+        scene.add_mesh('mesh', generate_mesh(36, (2, 2), 3, overlap=0.3, shear=0.2))
+        self.assert_matches(processed_uv_data(scene))
+
+    def test_no_overlaps(self):
+        scene = MemoryScene()
+        scene.add_mesh('mesh', generate_mesh(25, (2, 2), 0, overlap=0.0))
+        _, bboxes, pairs, areas = overlap.find_overlaps(pipeline.NULL_JOB, processed_uv_data(scene),
+                                                        MemoryInterface.uv_coords, MemoryInterface.uv_faces)
+        self.assertEqual(len(bboxes), 25)
+        self.assertEqual(pairs.shape, (0, 2))
+        self.assertEqual(len(areas), 0)
+
+
+class SweepAndPruneTest(unittest.TestCase):
+    def test_matches_brute_force(self):
+        rng = np.random.RandomState(4)
+        mins = rng.uniform(0.0, 1.0, size=(300, 2))
+        boxes = np.column_stack([mins, mins + rng.uniform(0.001, 0.1, size=(300, 2))])
+        expected = overlapping_pairs(boxes, tolerance=0.0)
+        for batch_size in (overlap.PAIR_BATCH_SIZE, 5):
+            pairs = overlap.sweep_and_prune(boxes, batch_size)
+            self.assertEqual(sorted(map(tuple, pairs.tolist())), expected)
@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+
+from uvpacker import pipeline
+from uvpacker.packing import OutOfSpaceError
+
+from .common import overlapping_pairs, placed_boxes, processed_uv_data, random_bboxes
+
+
+class PackShellsTest(unittest.TestCase):
+    def assert_valid_pack(self, bboxes, scale, offsets, padding=0.0):
+        boxes = placed_boxes(bboxes, scale, offsets)
+        self.assertTrue((boxes[:, :2] >= -1e-9).all())
+        self.assertTrue((boxes[:, 2:] <= 1.0 + 1e-9).all())
+        self.assertEqual(overlapping_pairs(boxes, tolerance=1e-9 - padding), [])
+
+    def test_in_bounds_without_overlaps(self):
+        bboxes = random_bboxes(60)
+        scale, offsets = pipeline.pack_shells(pipeline.NULL_JOB, bboxes, padding=0.005)
+        self.assertGreater(scale, 0.0)
+        self.assertEqual(offsets.shape, (60, 2))
+        self.assert_valid_pack(bboxes, scale, offsets, padding=0.005)
+
+    def test_empty(self):
+        scale, offsets = pipeline.pack_shells(pipeline.NULL_JOB, np.zeros((0, 2, 2)))
+        self.assertEqual(scale, 1.0)
+        self.assertEqual(offsets.shape, (0, 2))
+
+    def test_out_of_space(self):
+        bboxes = np.tile([[0.0, 1.0], [0.0, 1.0]], (3, 1, 1))
+        with self.assertRaises(OutOfSpaceError):
+            pipeline.pack_shells(pipeline.NULL_JOB, bboxes, fill=1.0, max_attempts=1)
+
+    def test_pack_uv_data_keeps_shells_apart(self):
+        uv_data = processed_uv_data()
+        shapes, bboxes = pipeline.collect_shell_bboxes(uv_data)
+        scale, offsets, turns = pipeline.pack_collected(pipeline.NULL_JOB, uv_data, shapes, bboxes)
+        self.assertIsNone(turns)
+        self.assert_valid_pack(bboxes, scale, offsets)
+
+        packed = pipeline.apply_packed_layout(uv_data, shapes, scale, offsets)
+        for xform, shape in shapes:
+            us, vs = packed[xform][shape]
+            shell_ids = uv_data[xform][shape][pipeline.SHELL_IDS]
+            count = uv_data[xform][shape][pipeline.SHELL_COUNT]
+            moved = pipeline.shell_bboxes(us, vs, shell_ids, count)
+            self.assertTrue((moved >= -1e-9).all() and (moved <= 1.0 + 1e-9).all())
+            self.assertEqual(moved.shape, (count, 2, 2))
+
+
+class ShellDetectionTest(unittest.TestCase):
+    def test_generated_shells_are_found(self):
+        uv_data = processed_uv_data()
+        for xform in uv_data:
+            for shape in uv_data[xform]:
+                self.assertEqual(uv_data[xform][shape][pipeline.SHELL_COUNT], 12)
+
+
+class RecordingJob(pipeline.NullJob):
+    def __init__(self):
+        self.partials = []
+
+    def report_partial(self, value):
+        self.partials.append(value)
+
+
+class PreviewPartialsTest(unittest.TestCase):
+    def test_partials_convert_to_rects(self):
+        job = RecordingJob()
+        uv_data = processed_uv_data()
+        result = pipeline.preview_pack(job, uv_data, partial_every=5)
+        self.assertTrue(job.partials)
+        for bboxes, scale, offsets, indices in job.partials:
+            rects = pipeline.layout_rects(bboxes, scale, offsets, 30.0, 300.0)
+            self.assertEqual(rects.shape, (len(indices), 4))
+            self.assertTrue(np.isfinite(rects).all())
+        bboxes, scale, offsets = result[:3]
+        self.assertEqual(pipeline.layout_rects(bboxes, scale, offsets, 30.0, 300.0).shape, (len(bboxes), 4))
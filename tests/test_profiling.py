@@ -0,0 +1,59 @@
+import time
+import unittest
+
+from uvpacker.profiling import Profiler
+
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.profiler = Profiler(enabled=True)
+
+    def test_times_calls(self):
+        square = self.profiler.wrap(lambda value: value * value, 'square')
+        self.assertEqual([square(value) for value in range(3)], [0, 1, 4])
+        self.assertEqual(self.profiler.snapshot()['square']['count'], 3)
+
+    def test_times_every_generator_step(self):
+        def chunks(count, delay):
+            for index in range(count):
+                time.sleep(delay)
+                yield index
+
+        wrapped = self.profiler.wrap(chunks, 'chunks')
+        iterator = wrapped(3, 0.01)
+        self.assertNotIn('chunks', self.profiler.snapshot())
+        self.assertEqual(list(iterator), [0, 1, 2])
+        stat = self.profiler.snapshot()['chunks']
+        # One record per item plus the step that exhausts the generator
+        self.assertEqual(stat['count'], 4)
+        self.assertGreaterEqual(stat['total'], 0.03)
+
+    def test_disabled_generator(self):
+        self.profiler.enable(False)
+        wrapped = self.profiler.wrap(lambda: (yield 1), 'lazy')
+        self.assertEqual(list(wrapped()), [1])
+        self.assertEqual(self.profiler.snapshot(), {})
+
+    def test_generator_forwards_send_throw_and_close(self):
+        closed = []
+
+        def running_total():
+            total = 0
+            try:
+                while True:
+                    try:
+                        total += yield total
+                    except ValueError:
+                        total = 0
+            finally:
+                closed.append(total)
+
+        iterator = self.profiler.wrap(running_total, 'total')()
+        self.assertEqual(next(iterator), 0)
+        self.assertEqual(iterator.send(2), 2)
+        self.assertEqual(iterator.send(3), 5)
+        self.assertEqual(iterator.throw(ValueError()), 0)
+        self.assertEqual(iterator.send(4), 4)
+        iterator.close()
+        self.assertEqual(closed, [4])
+        self.assertEqual(self.profiler.snapshot()['total']['count'], 5)
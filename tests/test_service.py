@@ -0,0 +1,176 @@
+import concurrent.futures
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from uvpacker import pipeline, service
+from uvpacker.packing import OutOfSpaceError
+
+from .common import random_bboxes
+
+
+class ServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.server = service.serve_in_process()
+        self.client = service.PackClient(self.server.address, self.server.authkey)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_ping(self):
+        self.assertTrue(self.client.ping())
+
+    def test_rejects_other_keys(self):
+        with self.assertRaises(service.ServiceError):
+            service.PackClient(self.server.address, b'not the key')
+        self.assertTrue(self.client.ping())
+        other = service.PackClient(self.server.address, self.server.authkey)
+        self.assertTrue(other.ping())
+        other.close()
+
+    def test_pack_shells_matches_local_pack(self):
+        bboxes = random_bboxes(40)
+        scale, offsets = self.client.pack_shells(pipeline.NULL_JOB, bboxes, padding=0.005)
+        local_scale, local_offsets = pipeline.pack_shells(pipeline.NULL_JOB, bboxes, padding=0.005)
+        self.assertAlmostEqual(scale, local_scale)
+        np.testing.assert_array_equal(offsets, local_offsets)
+
+    def test_errors_reach_the_client(self):
+        bboxes = np.tile([[0.0, 1.0], [0.0, 1.0]], (3, 1, 1))
+        with self.assertRaises(OutOfSpaceError):
+            self.client.pack_shells(pipeline.NULL_JOB, bboxes, fill=1.0, max_attempts=1)
+
+    def test_concurrent_requests(self):
+        futures = [self.client.submit('pack_shells', bboxes=random_bboxes(20, seed)) for seed in range(4)]
+        for seed, future in enumerate(futures):
+            scale, offsets = future.result(30.0)
+            self.assertAlmostEqual(scale, pipeline.pack_shells(pipeline.NULL_JOB, random_bboxes(20, seed))[0])
+
+
+
+class WorkerDeathTest(unittest.TestCase):
+    def setUp(self):
+        self.server = service.PackServer(service.temporary_address(), processes=1, authkey=os.urandom(32)).start()
+        self.client = service.PackClient(self.server.address, self.server.authkey)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def worker_processes(self):
+        return list(self.server.executor._processes.values())
+
+    @unittest.skipUnless(hasattr(signal, 'SIGKILL'), 'needs SIGKILL')
+    def test_crashed_worker_fails_the_request_and_is_replaced(self):
+        future = self.client.submit('pack_shells', bboxes=random_bboxes(20000, low=0.001, high=0.01))
+        deadline = time.time() + 30.0
+        while not self.worker_processes() and time.time() < deadline:
+            time.sleep(0.01)
+        for process in self.worker_processes():
+            os.kill(process.pid, signal.SIGKILL)
+        with self.assertRaises(service.ServiceError) as raised:
+            future.result(30.0)
+        self.assertIn('worker failed', str(raised.exception))
+
+        scale, offsets = self.client.pack_shells(pipeline.NULL_JOB, random_bboxes(10))
+        self.assertEqual(offsets.shape, (10, 2))
+
+
+class AuthkeyTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'keys', 'service.key')
+        self.environ = os.environ.pop(service.AUTHKEY_ENV_VAR, None)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.environ.pop(service.AUTHKEY_ENV_VAR, None)
+        if self.environ is not None:
+            os.environ[service.AUTHKEY_ENV_VAR] = self.environ
+
+    def test_key_file_is_generated_once(self):
+        key = service.default_authkey(self.path)
+        self.assertGreaterEqual(len(key), 32)
+        self.assertEqual(service.default_authkey(self.path), key)
+        if os.name == 'posix':
+            self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_environment_wins(self):
+        os.environ[service.AUTHKEY_ENV_VAR] = 'secret'
+        self.assertEqual(service.default_authkey(self.path), b'secret')
+        self.assertFalse(os.path.exists(self.path))
+
+    @unittest.skipUnless(os.name == 'posix', 'POSIX permissions')
+    def test_refuses_shared_key_files(self):
+        service.default_authkey(self.path)
+        os.chmod(self.path, 0o644)
+        with self.assertRaises(service.ServiceError):
+            service.default_authkey(self.path)
+
+
+class Superseded(Exception):
+    pass
+
+
+class SupersededJob(pipeline.NullJob):
+    def __init__(self, after):
+        self.deadline = time.time() + after
+
+    def check_cancelled(self):
+        if time.time() > self.deadline:
+            raise Superseded()
+
+
+class CancelTest(unittest.TestCase):
+    def setUp(self):
+        self.server = service.PackServer(service.temporary_address(), processes=1, authkey=os.urandom(32)).start()
+        self.client = service.PackClient(self.server.address, self.server.authkey)
+        self.slow_bboxes = random_bboxes(20000, low=0.001, high=0.01)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def assert_pool_free(self, timeout=10.0):
+        start = time.time()
+        scale, offsets = self.client.submit('pack_shells', bboxes=random_bboxes(10)).result(timeout)
+        self.assertEqual(offsets.shape, (10, 2))
+        self.assertLess(time.time() - start, timeout)
+
+    def test_cancel_running_request(self):
+        future = self.client.submit('pack_shells', bboxes=self.slow_bboxes)
+        time.sleep(0.5)
+        future.cancel()
+        with self.assertRaises(service.ServiceError):
+            future.result(10.0)
+        self.assert_pool_free()
+
+    def test_cancel_queued_requests(self):
+        futures = [self.client.submit('pack_shells', bboxes=self.slow_bboxes) for _ in range(3)]
+        for future in futures:
+            future.cancel()
+        for future in futures:
+            with self.assertRaises(service.ServiceError):
+                future.result(10.0)
+        self.assert_pool_free()
+
+    def test_cancelled_job_cancels_the_request(self):
+        with self.assertRaises(Superseded):
+            self.client.pack_shells(SupersededJob(0.3), self.slow_bboxes)
+        self.assert_pool_free()
+
+    def test_cancel_after_completion_leaves_no_marker(self):
+        # The request finished between cancel failing and the marker being written
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+        future.set_result(None)
+        marker = os.path.join(tempfile.mkdtemp(), 'cancel')
+        self.addCleanup(shutil.rmtree, os.path.dirname(marker))
+        self.server.cancel((future, marker))
+        self.assertFalse(os.path.exists(marker))
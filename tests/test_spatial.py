@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+from uvpacker.spatial import GridIndex
+
+
+def brute_force(rects, query, margin=0.0):
+    x, y, width, height = query
+    x0, y0, x1, y1 = x - margin, y - margin, x + width + margin, y + height + margin
+    return sorted(key for key, (rx, ry, rw, rh) in rects.items()
+                  if rx <= x1 and rx + rw >= x0 and ry <= y1 and ry + rh >= y0)
+
+
+class GridIndexTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.index = GridIndex(7.5, max_cells=16)
+        self.rects = {}
+        for key in range(300):
+            size = rng.uniform(0.1, 40.0 if key % 25 == 0 else 6.0, size=2)
+            self.rects[key] = tuple(rng.uniform(-20.0, 300.0, size=2)) + tuple(size)
+            self.index.insert(key, self.rects[key])
+        self.queries = [tuple(rng.uniform(-30.0, 300.0, size=2)) + tuple(rng.uniform(0.0, 60.0, size=2))
+                        for _ in range(100)]
+
+    def assert_matches(self):
+        self.assertEqual(len(self.index), len(self.rects))
+        for query in self.queries:
+            self.assertEqual(sorted(self.index.query(query)), brute_force(self.rects, query))
+            self.assertEqual(sorted(self.index.query(query, 2.5)), brute_force(self.rects, query, 2.5))
+        point = self.queries[0][:2]
+        self.assertEqual(sorted(self.index.query_point(point[0], point[1], 1.0)),
+                         brute_force(self.rects, point + (0.0, 0.0), 1.0))
+
+    def assert_extents(self):
+        x0 = min(rect[0] for rect in self.rects.values())
+        y0 = min(rect[1] for rect in self.rects.values())
+        x1 = max(rect[0] + rect[2] for rect in self.rects.values())
+        y1 = max(rect[1] + rect[3] for rect in self.rects.values())
+        np.testing.assert_allclose(self.index.extents(), (x0, y0, x1 - x0, y1 - y0))
+
+    def test_queries(self):
+        self.assert_matches()
+        self.assert_extents()
+
+    def test_moves_and_removals(self):
+        rng = np.random.RandomState(2)
+        for key in range(0, 300, 3):
+            self.rects[key] = tuple(rng.uniform(0.0, 200.0, size=2)) + tuple(rng.uniform(0.1, 5.0, size=2))
+            self.index.insert(key, self.rects[key])
+        for key in range(1, 300, 4):
+            del self.rects[key]
+            self.index.remove(key)
+        self.assert_matches()
+        self.assert_extents()
+
+    def test_empty(self):
+        index = GridIndex(1.0)
+        self.assertIsNone(index.extents())
+        self.assertEqual(index.query((0.0, 0.0, 10.0, 10.0)), [])
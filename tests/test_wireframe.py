@@ -0,0 +1,96 @@
+import unittest
+
+import numpy as np
+
+from uvpacker import pipeline
+from uvpacker.plugins.pmemory import MemoryInterface
+
+from .common import build_scene
+
+try:
+    from PySide2 import QtCore, QtGui, QtWidgets
+except ImportError:
+    QtCore = None
+
+
+class RecordingPainter(object):
+    """Stands in for QPainter, keeping what paint drew"""
+
+    def __init__(self):
+        self.lines = []
+        self.rects = []
+
+    def worldTransform(self):
+        return QtGui.QTransform()
+
+    def setPen(self, pen):
+        pass
+
+    def setBrush(self, brush):
+        pass
+
+    def drawLines(self, lines):
+        self.lines.append(lines)
+
+    def drawRects(self, rects):
+        self.rects.append(rects)
+
+
+@unittest.skipIf(QtCore is None, 'PySide2 is not installed')
+class WireframeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+    def setUp(self):
+        from uvpacker.ui.settings import Settings
+        from uvpacker.ui.widgets import QUVWireframe
+        self.settings = Settings
+        dcc = MemoryInterface
+        dcc.scene = build_scene(meshes=4, shells=20)
+        dcc.set_cache(None)
+        uv_data, _ = dcc.get_uv_data(sorted(dcc.scene.transforms))
+        results = pipeline.process_uv_data(pipeline.NULL_JOB, uv_data, Settings.WIDTH, Settings.TOTAL_HEIGHT,
+                                           uv_key=dcc.uv_coords, faces_key=dcc.uv_faces, bbox_key=dcc.bbox)
+        self.shapes = dict((shape, (derived[pipeline.WIREFRAME], derived[pipeline.SHELL_BBOXES]))
+                           for xform in results for shape, derived in results[xform].items())
+        self.item = QUVWireframe()
+        self.item.set_shapes(self.shapes)
+
+    def paint(self, rect):
+        option = QtWidgets.QStyleOptionGraphicsItem()
+        option.exposedRect = rect
+        painter = RecordingPainter()
+        self.item.paint(painter, option)
+        return painter
+
+    def expected_lines(self, rect):
+        segments = np.concatenate([wireframe['segments'] for wireframe, _ in self.shapes.values()])
+        min_length = self.settings.WIREFRAME_MIN_PIXELS
+        return sorted(map(tuple, self.item.cull_segments(segments, rect, min_length).tolist()))
+
+    def test_matches_a_full_scan(self):
+        bounds = self.item.boundingRect()
+        for rect in (bounds, QtCore.QRectF(bounds.center(), bounds.bottomRight()),
+                     QtCore.QRectF(bounds.x(), bounds.y(), bounds.width() / 3, bounds.height() / 5)):
+            painter = self.paint(rect)
+            self.assertEqual(len(painter.lines), 1)
+            drawn = sorted((line.x1(), line.y1(), line.x2(), line.y2()) for line in painter.lines[0])
+            self.assertEqual(drawn, self.expected_lines(rect))
+
+    def test_reuses_culled_lines(self):
+        rect = self.item.boundingRect()
+        first = self.paint(rect).lines[0]
+        self.assertIs(self.paint(rect).lines[0], first)
+        self.item.set_shapes({})
+        self.item.set_shapes(self.shapes)
+        self.assertIsNot(self.paint(rect).lines[0], first)
+
+    def test_draws_bboxes_over_the_line_budget(self):
+        max_lines = self.settings.WIREFRAME_MAX_LINES
+        self.settings.WIREFRAME_MAX_LINES = 0
+        self.addCleanup(setattr, self.settings, 'WIREFRAME_MAX_LINES', max_lines)
+        painter = self.paint(self.item.boundingRect())
+        self.assertEqual(painter.lines, [])
+        self.assertEqual(len(painter.rects), 1)
+        self.assertEqual(len(painter.rects[0]), sum(len(bboxes) for _, bboxes in self.shapes.values()))
@@ -0,0 +1,72 @@
+import threading
+import unittest
+
+try:
+    from PySide2 import QtCore
+except ImportError:
+    QtCore = None
+
+
+@unittest.skipIf(QtCore is None, 'PySide2 is not installed')
+class WorkerPoolTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+    def setUp(self):
+        from uvpacker.ui.workers import WorkerPool
+        self.pool = WorkerPool(max_threads=2)
+        self.busy = []
+        self.results = []
+        self.pool.busy.connect(self.busy.append)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def drain(self):
+        """Waits for every job and delivers the signals they queued on the main thread"""
+        self.release.set()
+        self.pool.wait()
+        while self.pool.running:
+            self.app.processEvents()
+
+    def blocking(self, job, value):
+        while not self.release.wait(0.01):
+            job.check_cancelled()
+        return value
+
+    def test_newer_job_supersedes(self):
+        self.pool.submit('shells', self.blocking, args=('old',), callback=self.results.append)
+        self.pool.submit('shells', lambda job: 'new', callback=self.results.append)
+        self.drain()
+        self.assertEqual(self.results, ['new'])
+        self.assertEqual(self.busy, [True, False])
+
+    def test_cancel_drops_the_result(self):
+        cancelled = []
+        worker = self.pool.submit('pack', self.blocking, args=('packed',), callback=self.results.append)
+        worker.signals.cancelled.connect(lambda: cancelled.append(True))
+        self.pool.cancel('pack')
+        self.assertFalse(self.pool.is_busy)
+        self.drain()
+        self.assertEqual(self.results, [])
+        self.assertEqual(cancelled, [True])
+        self.assertEqual(self.busy, [True, False])
+
+    def test_keys_are_independent(self):
+        self.pool.submit('shells', self.blocking, args=('shells',), callback=self.results.append)
+        self.pool.submit('pack', self.blocking, args=('pack',), callback=self.results.append)
+        self.pool.cancel('shells')
+        self.assertTrue(self.pool.is_busy)
+        self.drain()
+        self.assertEqual(self.results, ['pack'])
+        self.assertEqual(self.busy, [True, False])
+
+    def test_group_is_pending_until_its_last_job_ends(self):
+        self.pool.submit('process.1', lambda job: 1, callback=self.results.append)
+        self.pool.submit('process.2', self.blocking, args=(2,), callback=self.results.append)
+        self.pool.submit('pack', self.blocking, args=('pack',))
+        self.assertTrue(self.pool.has_group('process.'))
+        self.pool.cancel('process.2')
+        self.drain()
+        self.assertFalse(self.pool.has_group('process.'))
+        self.assertEqual(self.results, [1])
@@ -1,4 +1,3 @@
-from .ui.ui import UVPackerUI
-
-global window_instance
-window_instance = UVPackerUI.create()
+def show():
+    from .ui.ui import UVPackerUI
+    return UVPackerUI.create()
@@ -0,0 +1,310 @@
+"""End-to-end benchmark of the UV pipeline on synthetic scenes
+
+Every scene is generated on the in-memory backend and pushed through the
+same stages as the tool: extraction, shell detection, overlap detection,
+packing, applying the layout and, when PySide2 is importable, drawing into a GridScene and
+rendering it on the offscreen Qt platform. Each scene runs in its own pool
+process so the RSS high-water mark recorded after every stage belongs to
+that scene alone. Timings, memory and (with --trace-memory) the peak traced
+allocations of every stage are saved as JSON tagged with the git commit,
+and a previous results file can be passed to --compare against it."""
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+
+import numpy as np
+
+from . import pipeline, plugins
+from .overlap import find_overlaps
+from .plugins.pmemory import MemoryInterface, MemoryScene, generate_mesh
+from .profiling import clock
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# name, meshes, UVs, quads per shell side, overlap: None scatters every mesh's shells
+# over 0-1, otherwise they are laid out one per grid cell in a UV tile per mesh
+# with that fraction shifted onto their neighbour. Packing the 100k shells of
+# the overlaps scene in Python takes minutes, run it with --skip pack.
+SCENES = [('tiny', 10, 1000, 4, None),
+          ('small', 100, 50000, 4, None),
+          ('medium', 1000, 500000, 7, None),
+          ('dense', 10, 1000000, 31, None),
+          ('large', 10000, 5000000, 15, None),
+          ('overlaps', 100, 900000, 2, 0.05)]
+DEFAULT_SCENES = ['tiny', 'small', 'medium']
+STAGES = ['build', 'extract', 'shells', 'overlaps', 'pack', 'apply', 'draw', 'render']
+RENDER_SIZE = 1024
+TILES_PER_ROW = 10
+# Laid out shells are skewed so overlaps get clipped rather than measured as bboxes
+LAYOUT_SHEAR = 0.25
+
+
+def parse_scene(value):
+    """Resolves a preset name or a MESHESxUVS[xQUADS] spec to a (name, meshes, uvs, quads, overlap) tuple"""
+    for scene in SCENES:
+        if scene[0] == value:
+            return scene
+    try:
+        numbers = [int(number) for number in value.lower().split('x')]
+    except ValueError:
+        numbers = []
+    if len(numbers) not in (2, 3) or min(numbers) < 1:
+        raise argparse.ArgumentTypeError('expected one of %s or MESHESxUVS[xQUADS], got %s' %
+                                         (', '.join(scene[0] for scene in SCENES), value))
+    return (value, numbers[0], numbers[1], numbers[2] if len(numbers) == 3 else 4, None)
+
+
+def build_scene(meshes, uvs, quads=4, seed=0, overlap=None):
+    """Generates a MemoryScene of meshes quad grid meshes holding about uvs UVs in total
+
+    quads: Quads per side of every shell, i.e. (quads + 1) ** 2 UVs per shell
+    overlap: Lays the shells of every mesh out in a UV tile of its own when not
+             None, see generate_mesh"""
+    scene = MemoryScene()
+    num_shells = max(meshes, int(round(uvs / float((quads + 1) ** 2))))
+    for index, count in enumerate(np.diff(np.linspace(0, num_shells, meshes + 1).astype(np.int64))):
+        if overlap is None:
+            mesh = generate_mesh(max(int(count), 1), (quads, quads), seed + index)
+        else:
+            mesh = generate_mesh(max(int(count), 1), (quads, quads), seed + index, overlap, LAYOUT_SHEAR)
+            mesh.uvs += (index % TILES_PER_ROW, index // TILES_PER_ROW)
+        scene.add_mesh('mesh%d' % index, mesh)
+    return scene
+
+
+def qt_application():
+    """Returns a QApplication on the offscreen platform, or None when PySide2 is missing"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PySide2 import QtWidgets
+    except ImportError:
+        return None
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+
+class StageRecorder(object):
+    """Times stages and records the RSS high-water mark after each one
+
+    trace_memory: Also records the peak allocations traced with tracemalloc
+                  while each stage ran, NumPy array buffers included. Pure
+                  Python stages like packing run several times slower."""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self.stages = {}
+
+    def run(self, stage, fn, *args, **kwargs):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = clock()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            record = self.stages[stage] = {'seconds': clock() - start, 'max_rss_mb': max_rss_mb()}
+            if self.trace_memory:
+                record['peak_mb'] = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+                tracemalloc.stop()
+
+
+def merge_results(uv_data, results):
+    for xform in results:
+        for shape in results[xform]:
+            uv_data[xform][shape].update(results[xform][shape])
+
+
+def render_scene(grid_scene, size=RENDER_SIZE):
+    from PySide2 import QtCore, QtGui
+    image = QtGui.QImage(size, size, QtGui.QImage.Format_ARGB32_Premultiplied)
+    image.fill(QtCore.Qt.black)
+    painter = QtGui.QPainter(image)
+    try:
+        grid_scene.render(painter, QtCore.QRectF(image.rect()), grid_scene.focus_rect())
+    finally:
+        painter.end()
+    return image
+
+
+def run_scene(scene, skip=(), trace_memory=False, seed=0):
+    """Runs every stage not in skip on one synthetic scene
+
+    Returns a result dict holding the scene's size and per stage records"""
+    name, meshes, uvs, quads, overlap = scene
+    result = {'scene': name, 'meshes': meshes, 'quads': quads, 'uvs': 0, 'shells': 0, 'error': None}
+    recorder = StageRecorder(trace_memory)
+    result['stages'] = recorder.stages
+    # The UI modules resolve Settings.PLUGIN, which has to be the backend the scene lives in
+    os.environ[plugins.ENV_VAR] = MemoryInterface.name
+    from .ui.settings import Settings
+
+    try:
+        dcc = MemoryInterface
+        dcc.set_cache(None)
+        dcc.scene = recorder.run('build', build_scene, meshes, uvs, quads, seed, overlap)
+        xforms = sorted(dcc.scene.transforms)
+
+        uv_data, result['uvs'] = recorder.run('extract', dcc.get_uv_data, xforms)
+        if 'shells' in skip:
+            return result
+        merge_results(uv_data, recorder.run('shells', pipeline.process_uv_data, pipeline.NULL_JOB, uv_data,
+                                            Settings.WIDTH, Settings.TOTAL_HEIGHT, uv_key=dcc.uv_coords,
+                                            faces_key=dcc.uv_faces, bbox_key=dcc.bbox, mesh_key=dcc.mesh_faces))
+        shapes, bboxes = pipeline.collect_shell_bboxes(uv_data)
+        result['shells'] = len(bboxes)
+        if 'overlaps' not in skip:
+            result['overlapping_pairs'] = len(recorder.run('overlaps', find_overlaps, pipeline.NULL_JOB, uv_data,
+                                                           dcc.uv_coords, dcc.uv_faces)[2])
+
+        if 'pack' not in skip:
+            scale, offsets, turns = recorder.run('pack', pipeline.pack_collected, pipeline.NULL_JOB, uv_data, shapes,
+                                                 bboxes, uv_key=dcc.uv_coords, faces_key=dcc.uv_faces)
+            if 'apply' not in skip:
+                recorder.run('apply', pipeline.apply_packed_layout, uv_data, shapes, scale, offsets, dcc.uv_coords,
+                             turns)
+
+        if 'draw' not in skip and qt_application() is not None:
+            from .ui.widgets import GridScene
+            grid_scene = GridScene()
+            recorder.run('draw', grid_scene.draw_uv_bboxes, uv_data)
+            if 'render' not in skip:
+                recorder.run('render', render_scene, grid_scene)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    finally:
+        result['max_rss_mb'] = max_rss_mb()
+    return result
+
+
+def _run_scene_star(args):
+    return run_scene(*args)
+
+
+def git_commit():
+    """Returns (commit, dirty) of the checkout this module lives in, (None, None) outside of git"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=directory, stderr=subprocess.STDOUT)
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=directory,
+                                         stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.decode('ascii').strip(), bool(status.strip())
+
+
+def environment():
+    commit, dirty = git_commit()
+    return {'commit': commit,
+            'dirty': dirty,
+            'created': time.time(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': multiprocessing.cpu_count()}
+
+
+def format_results(results, baseline=None):
+    """Tabulates seconds per stage, followed by the ratio to the baseline results when given"""
+    previous = dict((result['scene'], result) for result in (baseline or {}).get('scenes', []))
+    header = ['scene', 'meshes', 'uvs', 'shells'] + STAGES + ['max rss', 'status']
+    rows = [header]
+    for result in results:
+        old = previous.get(result['scene'], {}).get('stages', {})
+        cells = []
+        for stage in STAGES:
+            record = result['stages'].get(stage)
+            if record is None:
+                cells.append('-')
+            elif stage in old and old[stage]['seconds'] > 0:
+                cells.append('%.3f (%.2fx)' % (record['seconds'], record['seconds'] / old[stage]['seconds']))
+            else:
+                cells.append('%.3f' % record['seconds'])
+        rss = result.get('max_rss_mb')
+        rows.append([result['scene'], str(result['meshes']), str(result['uvs']), str(result['shells'])] + cells +
+                    ['%.0fMB' % rss if rss is not None else '-', 'failed' if result['error'] else 'ok'])
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='uvpacker-benchmark', description=__doc__.splitlines()[0])
+    parser.add_argument('scenes', nargs='*', type=parse_scene, metavar='SCENE',
+                        help='Preset (%s) or MESHESxUVS[xQUADS], defaults to %s' %
+                        (', '.join(scene[0] for scene in SCENES), ' '.join(DEFAULT_SCENES)))
+    parser.add_argument('-o', '--output', help='Results JSON path, defaults to uvpacker-benchmark-<commit>.json')
+    parser.add_argument('--compare', metavar='RESULTS', help='Previous results JSON to show timing ratios against')
+    parser.add_argument('--skip', action='append', choices=STAGES[2:], default=[],
+                        help='Stage to leave out along with the stages depending on it, repeatable')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Record peak allocations per stage with tracemalloc, slowing Python heavy stages down')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated meshes')
+    parser.add_argument('--in-process', action='store_true',
+                        help='Run every scene in this process, e.g. under a profiler; max RSS then accumulates')
+    args = parser.parse_args(argv)
+    args.scenes = args.scenes or [parse_scene(name) for name in DEFAULT_SCENES]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    tasks = [(scene, args.skip, args.trace_memory, args.seed) for scene in args.scenes]
+    if args.in_process:
+        results = [run_scene(*task) for task in tasks]
+    else:
+        results = []
+        for task in tasks:
+            pool = multiprocessing.Pool(1, maxtasksperchild=1)
+            try:
+                results.append(pool.apply(_run_scene_star, (task,)))
+            finally:
+                pool.close()
+                pool.join()
+
+    report = environment()
+    report.update({'trace_memory': args.trace_memory and tracemalloc is not None, 'skip': args.skip,
+                   'scenes': results})
+    output = args.output or 'uvpacker-benchmark-%s.json' % (report['commit'] or 'unknown')[:10]
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        print('Compared to %s (%s)' % (args.compare, (baseline.get('commit') or 'unknown commit')[:10]))
+        if baseline.get('trace_memory') != report['trace_memory']:
+            print('Only one of the runs traced memory, timings are not comparable', file=sys.stderr)
+    print(format_results(results, baseline))
+    failures = [result for result in results if result['error']]
+    for result in failures:
+        print('\n%s failed:\n%s' % (result['scene'], result['error']), file=sys.stderr)
+    print('\nResults written to %s' % output)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
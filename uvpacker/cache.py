@@ -0,0 +1,157 @@
+"""Persistent on-disk cache of extracted UV arrays and shell tables
+
+Every entry is a directory of .npy files plus a small meta.json, named
+after a hash of the node's UUID and a checksum of its topology and UVs, so
+an entry can never be stale: edited meshes simply hash to a new entry.
+Arrays are loaded memory-mapped and read-only, so reopening a heavy scene
+costs page cache reads rather than copies. The least recently used entries
+are evicted once the cache grows past its size limit."""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+
+FORMAT_VERSION = 2
+META_FILE = 'meta.json'
+
+
+def checksum(*arrays):
+    """Hex digest of the dtype, shape and contents of every array"""
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(('%s%s' % (array.dtype.str, array.shape)).encode('ascii'))
+        digest.update(array.view(np.uint8).reshape(-1) if array.size else b'')
+    return digest.hexdigest()
+
+
+class UVCache(object):
+    """Size bounded directory of memory-mapped array entries
+
+    directory: Where entries are stored, created on first write
+    max_bytes: Total size entries may take before the oldest are evicted"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.sizes = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(node_uuid, node_checksum):
+        return hashlib.sha1(('%d:%s:%s' % (FORMAT_VERSION, node_uuid, node_checksum)).encode('utf-8')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.isfile(os.path.join(self.entry_path(key), META_FILE))
+
+    def get(self, key):
+        """Returns (arrays, meta) for key with arrays memory-mapped read-only, or None on a miss"""
+        path = self.entry_path(key)
+        try:
+            with open(os.path.join(path, META_FILE)) as f:
+                meta = json.load(f)
+            arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                      for name in meta['arrays']}
+            os.utime(os.path.join(path, META_FILE), None)
+        except (IOError, OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays, meta['meta']
+
+    def put(self, key, arrays, meta=None):
+        """Stores {name: array} and a JSON serializable meta dict under key
+
+        The entry is written to a temporary directory and renamed into place
+        so concurrent readers and writers never see a partial entry."""
+        path = self.entry_path(key)
+        if os.path.isdir(path):
+            return
+        staging = os.path.join(self.directory, '.%s.%s' % (key, uuid.uuid4().hex))
+        os.makedirs(staging)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(staging, name + '.npy'), np.ascontiguousarray(array))
+            with open(os.path.join(staging, META_FILE), 'w') as f:
+                json.dump({'version': FORMAT_VERSION, 'created': time.time(),
+                           'arrays': sorted(arrays), 'meta': meta or {}}, f)
+            size = self.directory_size(staging)
+            try:
+                os.rename(staging, path)
+            except OSError:
+                return
+        finally:
+            if os.path.isdir(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+
+        with self.lock:
+            sizes = self.load_sizes()
+            sizes[key] = size
+            if sum(sizes.values()) > self.max_bytes:
+                self.evict()
+
+    def load_sizes(self):
+        if self.sizes is None:
+            self.sizes = {}
+            for key in self.keys():
+                self.sizes[key] = self.directory_size(self.entry_path(key))
+        return self.sizes
+
+    def keys(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [name for name in os.listdir(self.directory)
+                if not name.startswith('.') and os.path.isdir(self.entry_path(name))]
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_bytes
+
+        An entry that cannot be removed, e.g. because another process still
+        maps its arrays on Windows, keeps counting with whatever is left of it."""
+        sizes = self.load_sizes()
+        total = sum(sizes.values())
+        for key in sorted(sizes, key=self.last_used):
+            if total <= self.max_bytes:
+                break
+            path = self.entry_path(key)
+            shutil.rmtree(path, ignore_errors=True)
+            remaining = self.directory_size(path) if os.path.isdir(path) else 0
+            total -= sizes[key] - remaining
+            if remaining:
+                sizes[key] = remaining
+            else:
+                del sizes[key]
+
+    def last_used(self, key):
+        try:
+            return os.path.getmtime(os.path.join(self.entry_path(key), META_FILE))
+        except OSError:
+            return 0.0
+
+    def clear(self):
+        with self.lock:
+            for key in self.keys():
+                shutil.rmtree(self.entry_path(key), ignore_errors=True)
+            self.sizes = {}
+
+    @property
+    def size(self):
+        with self.lock:
+            return sum(self.load_sizes().values())
+
+    @staticmethod
+    def directory_size(path):
+        try:
+            return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        except OSError:
+            return 0
@@ -0,0 +1,262 @@
+"""Headless batch entry point packing the UVs of many mesh files in parallel
+
+Every file goes through the same stages as the UI (extraction, shell
+detection, packing) on the in-memory backend, in its own pool process.
+Workers are recycled after each file so memory stays bounded."""
+from __future__ import print_function
+
+import argparse
+import fnmatch
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from functools import partial
+
+from . import incremental, pipeline
+from .cache import UVCache
+from .layout import EXTENSION as LAYOUT_EXTENSION, Layout
+from .packing import OutOfSpaceError
+from .profiling import PROFILER
+from .plugins.pmemory import MemoryInterface, MemoryScene
+
+STAGES = ['load', 'extract', 'shells', 'pack', 'write']
+
+
+def expand_paths(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        paths.extend(match for match in matches if match not in paths)
+    return paths
+
+
+def output_path(path, output_dir=None, suffix='_packed'):
+    directory, filename = os.path.split(path)
+    name, extension = os.path.splitext(filename)
+    return os.path.join(output_dir or directory, name + suffix + extension)
+
+
+def limit_memory(max_memory_mb):
+    if not max_memory_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = int(max_memory_mb) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def match_weight(patterns, xform, shape):
+    """Returns the weight of the last (pattern, weight) pair matching the shape or transform name"""
+    weight = 1.0
+    for pattern, value in patterns or []:
+        if fnmatch.fnmatchcase(shape, pattern) or fnmatch.fnmatchcase(xform, pattern):
+            weight = value
+    return weight
+
+
+def texel_weight(value):
+    pattern, _, weight = value.rpartition('=')
+    try:
+        return pattern, float(weight)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected PATTERN=WEIGHT, got %s' % value)
+
+
+def pack_file(path, destination, padding=0.005, fill=0.8, cache_dir=None, cache_mb=2048,
+              layout_path=None, save_layout=False, dedupe=None, rotations=False, texel_density=False,
+              texel_weights=None, incremental_layout=False, service_address=None):
+    """Runs the full pipeline on a single file
+
+    cache_dir: UVCache directory shells are loaded from and stored in
+    layout_path: Saved layout applied instead of packing
+    save_layout: Writes the packed layout next to the destination
+    dedupe: pipeline.pack_instances mode identical shells are packed once with
+    rotations: Also match identical shells turned by quarter turns
+    texel_density: Scales shells to a common texel density before packing
+    texel_weights: (name pattern, density multiplier) pairs matched against shape and transform names
+    incremental_layout: Treats layout_path as the committed layout of the file and only repacks
+                        the shells that moved away from it, falling back to a full pack
+    service_address: Address of a packing service the packing is sent to
+
+    Returns a summary dict holding per stage timings in seconds"""
+    summary = {'file': path, 'output': destination, 'meshes': 0, 'uvs': 0, 'shells': 0, 'cached': 0, 'error': None}
+    timings = summary['timings'] = {}
+    start = time.time()
+    client = None
+
+    def lap(stage):
+        timings[stage] = time.time() - start - sum(timings.values())
+
+    try:
+        dcc = MemoryInterface
+        dcc.scene = MemoryScene()
+        dcc.set_cache(UVCache(cache_dir, cache_mb * 1024 * 1024) if cache_dir else None)
+        xforms = dcc.scene.load_obj(path)
+        lap('load')
+
+        uv_data, summary['uvs'] = dcc.get_uv_data(xforms)
+        lap('extract')
+
+        summary['cached'] = sum(1 for xform in uv_data for shape in uv_data[xform]
+                                if uv_data[xform][shape].get(pipeline.CACHED))
+        results = pipeline.process_uv_data(pipeline.NULL_JOB, uv_data, 1.0, 1.0, cache=dcc.cache,
+                                           uv_key=dcc.uv_coords, faces_key=dcc.uv_faces, bbox_key=dcc.bbox,
+                                           mesh_key=dcc.mesh_faces)
+        for xform in results:
+            for shape in results[xform]:
+                uv_data[xform][shape].update(results[xform][shape])
+                summary['meshes'] += 1
+                summary['shells'] += uv_data[xform][shape].get(pipeline.SHELL_COUNT, 0)
+        lap('shells')
+
+        if layout_path and not incremental_layout:
+            dcc.import_layout(layout_path, uv_data)
+            lap('pack')
+        else:
+            shapes, bboxes = pipeline.collect_shell_bboxes(uv_data)
+            scale, turns = None, None
+            if layout_path:
+                try:
+                    previous = Layout.load(layout_path)
+                    offsets, changed = incremental.incremental_pack(pipeline.NULL_JOB, uv_data, previous, padding)[2:4]
+                except OutOfSpaceError:
+                    pass
+                else:
+                    scale = 1.0 if not changed.all() else None
+            if scale is None:
+                weights = {shape: match_weight(texel_weights, xform, shape) for xform, shape in shapes}
+                pack = partial(pipeline.pack_collected, pipeline.NULL_JOB, uv_data, shapes, bboxes, dedupe,
+                               rotations=rotations, texel_density=texel_density, weights=weights,
+                               uv_key=dcc.uv_coords, faces_key=dcc.uv_faces, padding=padding, fill=fill)
+                if not service_address:
+                    scale, offsets, turns = pack()
+                else:
+                    # Imported here as only --service runs pay for the transport modules
+                    from . import service
+                    try:
+                        client = service.PackClient(service_address)
+                        scale, offsets, turns = pack(pack_fn=client.pack_shells)
+                    except service.ServiceError as e:
+                        # The service went away or its worker died, the file still gets packed here
+                        summary['service_error'] = str(e)
+                        scale, offsets, turns = pack()
+            packed = pipeline.apply_packed_layout(uv_data, shapes, scale, offsets, dcc.uv_coords, turns)
+            lap('pack')
+            dcc.set_uv_data({shape: packed[xform][shape] for xform in packed for shape in packed[xform]})
+            if save_layout:
+                dcc.export_layout(os.path.splitext(destination)[0] + LAYOUT_EXTENSION,
+                                  Layout.from_pack(uv_data, shapes, scale, offsets, turns=turns,
+                                                   source=path, padding=padding, dedupe=dedupe))
+        dcc.scene.save_obj(destination, xforms)
+        lap('write')
+    except Exception:
+        summary['error'] = traceback.format_exc()
+    finally:
+        if client is not None:
+            client.close()
+    summary['total'] = time.time() - start
+    return summary
+
+
+def _pack_file_star(args):
+    return pack_file(*args)
+
+
+def format_summary(summaries):
+    header = ['file', 'meshes', 'cached', 'uvs', 'shells'] + STAGES + ['total', 'status']
+    rows = [header]
+    for summary in summaries:
+        timings = summary['timings']
+        rows.append([os.path.basename(summary['file']),
+                     str(summary['meshes']), str(summary['cached']), str(summary['uvs']), str(summary['shells'])] +
+                    ['%.3f' % timings[stage] if stage in timings else '-' for stage in STAGES] +
+                    ['%.3f' % summary['total'], 'failed' if summary['error'] else 'ok'])
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='uvpacker-batch', description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='+', help='Mesh files or glob patterns (OBJ)')
+    parser.add_argument('-o', '--output-dir', help='Directory for the packed files, defaults to next to the inputs')
+    parser.add_argument('-s', '--suffix', default='_packed', help='Suffix appended to packed file names')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of worker processes')
+    parser.add_argument('--padding', type=float, default=0.005, help='UV space kept around every shell')
+    parser.add_argument('--fill', type=float, default=0.8, help='Initial coverage guess for the packer')
+    parser.add_argument('--max-memory', type=int, default=0,
+                        help='Address space limit per packing process in MB')
+    parser.add_argument('--cache', help='Directory of the persistent UV cache, disabled when omitted')
+    parser.add_argument('--cache-mb', type=int, default=2048, help='Size limit of the UV cache in MB')
+    parser.add_argument('--layout', help='Apply this saved layout instead of packing')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Keep the placements recorded in --layout and only repack shells that changed since')
+    parser.add_argument('--save-layout', action='store_true', help='Write a %s layout next to every packed file'
+                        % LAYOUT_EXTENSION)
+    parser.add_argument('--dedupe', choices=['stack', 'block'],
+                        help='Pack identical shells once, stacked on top of each other or as one block')
+    parser.add_argument('--dedupe-rotations', action='store_true',
+                        help='Also treat shells turned by multiples of 90 degrees as identical')
+    parser.add_argument('--texel-density', action='store_true',
+                        help='Scale shells to a common texel density before packing')
+    parser.add_argument('--texel-weight', type=texel_weight, action='append', metavar='PATTERN=WEIGHT',
+                        help='Texel density multiplier for meshes whose name matches the glob pattern, repeatable')
+    parser.add_argument('--service', metavar='ADDRESS',
+                        help='Send packing to the packing service listening on ADDRESS (see uvpacker-service)')
+    parser.add_argument('--profile', help='Run in a single process and write call timings as JSON to this path')
+    args = parser.parse_args(argv)
+    if args.incremental and (args.dedupe or args.texel_density):
+        # Kept shells stay where the layout put them, so nothing could be stacked or rescaled
+        parser.error('--incremental cannot be combined with --dedupe or --texel-density')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = expand_paths(args.files)
+    if not paths:
+        print('No files matched %s' % ' '.join(args.files), file=sys.stderr)
+        return 1
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    if args.profile:
+        PROFILER.enable()
+        args.jobs = 1
+    tasks = [(path, output_path(path, args.output_dir, args.suffix), args.padding, args.fill,
+              args.cache, args.cache_mb, args.layout, args.save_layout, args.dedupe, args.dedupe_rotations,
+              args.texel_density, args.texel_weight, args.incremental, args.service)
+             for path in paths]
+    start = time.time()
+    if args.jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(tasks)), initializer=limit_memory,
+                                    initargs=(args.max_memory,), maxtasksperchild=1)
+        try:
+            summaries = pool.map(_pack_file_star, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        limit_memory(args.max_memory)
+        summaries = [pack_file(*task) for task in tasks]
+
+    print(format_summary(summaries))
+    failures = [summary for summary in summaries if summary['error']]
+    for summary in failures:
+        print('\n%s failed:\n%s' % (summary['file'], summary['error']), file=sys.stderr)
+    for summary in summaries:
+        if summary.get('service_error'):
+            print('%s was packed in process: %s' % (summary['file'], summary['service_error']), file=sys.stderr)
+    print('\nPacked %d/%d files in %.3fs' % (len(summaries) - len(failures), len(summaries), time.time() - start))
+    if args.profile:
+        print('Profile written to %s' % PROFILER.dump(args.profile))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
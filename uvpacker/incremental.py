@@ -0,0 +1,206 @@
+"""Incremental repacking of a committed layout after a few shells changed
+
+The layout a pack was committed with is the packer state: every shell whose
+bbox still sits exactly where that layout put it keeps its place, and only
+shells that were resized, moved, or are new get re-inserted. Each goes back
+to its old slot when it still fits there, otherwise into the free space of
+a window around it that grows until a FreeSpacePacker finds a gap; when no
+gap is big enough the shells inside the window are repacked together with
+it. Windows stop growing once they hold MAX_WINDOW_SHELLS, after which the
+shell goes on top of the silhouette of the fixed shells. Work is
+proportional to the changed shells and the windows they search, not to the
+size of the layout."""
+import numpy as np
+
+from . import pipeline
+from .layout import recorded_order
+from .packing import CygonRectanglePacker, FreeSpacePacker, OutOfSpaceError, Point
+
+EPSILON = 1e-9
+MAX_WINDOW_SHELLS = 48
+
+
+def previous_bboxes(layout, uv_data, shapes):
+    """Looks up where layout placed every shell of collect_shell_bboxes output
+
+    Shells of shapes the layout does not know, or whose shell count or ids
+    changed, get NaN bboxes.
+
+    Returns a (num_shells, 2, 2) array"""
+    counts = [len(uv_data[xform][shape][pipeline.SHELL_BBOXES]) for xform, shape in shapes]
+    placed = np.full((sum(counts), 2, 2), np.nan, dtype=np.float64)
+    layout_bboxes = layout.placed_bboxes()
+    shape_shells = layout.shape_shells()
+    matches = layout.match(shapes)
+    start = 0
+    for pair, count in zip(shapes, counts):
+        if pair in matches:
+            shells = shape_shells[matches[pair]]
+            order = recorded_order(layout.shells[shells])
+            if order is not None and len(order) == count:
+                placed[start:start + count] = layout_bboxes[shells][order]
+        start += count
+    return placed
+
+
+def changed_shells(bboxes, placed, tolerance=1e-6):
+    """Flags the shells whose bbox differs from where they were placed"""
+    difference = np.abs(np.asarray(bboxes) - np.asarray(placed)).reshape(len(bboxes), -1)
+    return ~(difference <= tolerance).all(axis=1)
+
+
+def slot_boxes(bboxes, padding):
+    """Converts bboxes to padded (min_x, min_y, max_x, max_y) slots"""
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 2, 2)
+    half = padding * 0.5
+    return np.column_stack([bboxes[:, 0, 0] - half, bboxes[:, 1, 0] - half,
+                            bboxes[:, 0, 1] + half, bboxes[:, 1, 1] + half])
+
+
+def intersecting(boxes, box):
+    return ((boxes[:, 0] < box[2] - EPSILON) & (boxes[:, 2] > box[0] + EPSILON) &
+            (boxes[:, 1] < box[3] - EPSILON) & (boxes[:, 3] > box[1] + EPSILON))
+
+
+def window_packer(window, boxes, obstacles):
+    """FreeSpacePacker over window with the obstacle boxes marked as taken"""
+    packer = FreeSpacePacker(window[2] - window[0], window[3] - window[1])
+    for box in boxes[obstacles]:
+        left, bottom = max(box[0], window[0]), max(box[1], window[1])
+        packer.occupy(left - window[0], bottom - window[1],
+                      min(box[2], window[2]) - left, min(box[3], window[3]) - bottom)
+    return packer
+
+
+def skyline_packer(boxes):
+    """CygonRectanglePacker whose height slices lie on top of every box"""
+    boxes = np.clip(boxes, 0.0, 1.0)
+    edges = np.unique(np.concatenate([[0.0], boxes[:, 0], boxes[:, 2]]))
+    heights = np.zeros(len(edges), dtype=np.float64)
+    starts = np.searchsorted(edges, boxes[:, 0])
+    stops = np.searchsorted(edges, boxes[:, 2])
+    # Higher boxes are written last so every slice ends up at its highest top
+    for index in np.argsort(boxes[:, 3], kind='mergesort'):
+        heights[starts[index]:stops[index]] = boxes[index, 3]
+    keep = np.concatenate([[True], heights[1:] != heights[:-1]]) & (edges < 1.0)
+    packer = CygonRectanglePacker(1.0, 1.0)
+    packer.height_slices = [Point(float(x), float(y)) for x, y in zip(edges[keep], heights[keep])]
+    return packer
+
+
+def repack_changed(job, bboxes, placed, changed, padding=0.005, grow=2.0, max_window_shells=MAX_WINDOW_SHELLS):
+    """Worker stage re-inserting the changed shells around the fixed ones at scale 1
+
+    bboxes: Current (num_shells, 2, 2) shell bboxes
+    placed: Where the layout put every shell, NaN for new shells
+    changed: Boolean mask of the shells to re-insert, the others stay fixed
+    grow: Factor the search window grows by after every miss
+    max_window_shells: Fixed shells a window may hold before the shell is
+                       placed on top of the layout instead
+
+    Returns (offsets, moved) where moved flags every shell that got a new
+    placement, including neighbours moved by a local repack. Raises
+    OutOfSpaceError when a shell does not fit even after repacking the whole
+    0-1 square around it."""
+    boxes = slot_boxes(bboxes, padding)
+    sizes = boxes[:, 2:] - boxes[:, :2]
+    old = slot_boxes(placed, padding)
+    fixed = ~np.asarray(changed, dtype=bool)
+    moved = np.zeros(len(boxes), dtype=bool)
+    order = np.flatnonzero(~fixed)
+    order = order[np.argsort(-sizes[order, 0] * sizes[order, 1], kind='mergesort')]
+    skyline = None
+
+    for count, index in enumerate(order):
+        job.check_cancelled()
+        width, height = sizes[index]
+        if width > 1.0 + EPSILON or height > 1.0 + EPSILON:
+            raise OutOfSpaceError('Shell %d is larger than the 0-1 UV range' % index)
+
+        # Back into the old slot when nothing took its place
+        if not np.isnan(old[index]).any():
+            slot = np.array([old[index, 0], old[index, 1], old[index, 0] + width, old[index, 1] + height])
+            if slot[2] <= 1.0 + EPSILON and slot[3] <= 1.0 + EPSILON and not intersecting(boxes[fixed], slot).any():
+                boxes[index] = slot
+                fixed[index] = moved[index] = True
+                continue
+
+        anchor = (old[index, :2] + old[index, 2:]) * 0.5 if not np.isnan(old[index]).any() else None
+        radius = max(width, height)
+        while anchor is not None:
+            window = np.concatenate([np.maximum(anchor - radius, 0.0), np.minimum(anchor + radius, 1.0)])
+            neighbours = fixed & intersecting(boxes, window)
+            if np.count_nonzero(neighbours) > max_window_shells:
+                break
+            point = window_packer(window, boxes, neighbours).try_pack(width, height)
+            if point:
+                boxes[index] = [window[0] + point.x, window[1] + point.y,
+                                window[0] + point.x + width, window[1] + point.y + height]
+                fixed[index] = moved[index] = True
+                skyline = None
+                break
+
+            # Repack the shells fully inside the window around the ones crossing its border
+            inside = neighbours & (boxes[:, 0] >= window[0] - EPSILON) & (boxes[:, 1] >= window[1] - EPSILON) & \
+                (boxes[:, 2] <= window[2] + EPSILON) & (boxes[:, 3] <= window[3] + EPSILON)
+            packer = window_packer(window, boxes, neighbours & ~inside)
+            members = np.append(np.flatnonzero(inside), index)
+            members = members[np.argsort(-sizes[members, 1], kind='mergesort')]
+            points = []
+            for member in members:
+                point = packer.try_pack(*sizes[member])
+                if not point:
+                    break
+                points.append(point)
+            if len(points) == len(members):
+                for member, point in zip(members, points):
+                    boxes[member] = [window[0] + point.x, window[1] + point.y,
+                                     window[0] + point.x + sizes[member, 0], window[1] + point.y + sizes[member, 1]]
+                fixed[members] = moved[members] = True
+                skyline = None
+                break
+
+            if window[0] <= 0.0 and window[1] <= 0.0 and window[2] >= 1.0 and window[3] >= 1.0:
+                break
+            radius *= grow
+
+        if not fixed[index]:
+            if skyline is None:
+                skyline = skyline_packer(boxes[fixed])
+            point = skyline.try_pack(width, height)
+            if not point:
+                raise OutOfSpaceError('Shell %d does not fit around the fixed shells' % index)
+            boxes[index] = [point.x, point.y, point.x + width, point.y + height]
+            fixed[index] = moved[index] = True
+        job.report_progress(count + 1, len(order))
+    return boxes[:, :2] + padding * 0.5, moved
+
+
+def incremental_pack(job, uv_data, layout, padding=0.005, tolerance=1e-6, grow=2.0):
+    """Worker stage repacking only the shells of processed uv_data that moved away from layout
+
+    Returns (shapes, bboxes, offsets, changed, moved) where offsets apply at
+    a scale of 1, i.e. unchanged shells stay exactly where they are"""
+    shapes, bboxes = pipeline.collect_shell_bboxes(uv_data)
+    placed = previous_bboxes(layout, uv_data, shapes)
+    changed = changed_shells(bboxes, placed, tolerance)
+    offsets, moved = repack_changed(job, bboxes, placed, changed, padding, grow)
+    return shapes, bboxes, offsets, changed, moved
+
+
+def preview_pack(job, uv_data, layout=None, uv_key='uv_coords', padding=0.005, **kwargs):
+    """pipeline.preview_pack keeping the placements of layout when it still describes uv_data
+
+    Falls back to a full pack without a layout, when every shell changed, or
+    when the changed shells do not fit around the fixed ones.
+
+    Returns the same tuple as pipeline.preview_pack"""
+    if layout is not None:
+        try:
+            shapes, bboxes, offsets, changed, moved = incremental_pack(job, uv_data, layout, padding)
+        except OutOfSpaceError:
+            changed = None
+        if changed is not None and not changed.all():
+            return (bboxes, 1.0, offsets, pipeline.apply_packed_layout(uv_data, shapes, 1.0, offsets, uv_key),
+                    shapes, None)
+    return pipeline.preview_pack(job, uv_data, uv_key=uv_key, padding=padding, **kwargs)
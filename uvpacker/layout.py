@@ -0,0 +1,251 @@
+"""Versioned binary file format for packed UV layouts
+
+A layout records where every shell of every shape went, so it can be
+re-applied to the same meshes (or LODs sharing their shell structure)
+without packing again. Shells are told apart by their recorded id and
+source bbox, so a shape whose shells no longer match is refused rather than
+scrambled. The binary file is self contained:
+
+    header   struct HEADER: magic, version, reserved, shape count, shell count, names size
+    names    utf-8 JSON of the shape records and meta, padded to 8 bytes
+    shells   SHELL_DTYPE records, read back memory-mapped
+
+A JSON sidecar next to it repeats the shape records and summary values for
+inspection; readers never need it."""
+import json
+import struct
+import time
+
+import numpy as np
+
+from . import pipeline
+
+MAGIC = b'UVLY'
+VERSION = 1
+EXTENSION = '.uvl'
+SIDECAR_EXTENSION = '.json'
+HEADER = struct.Struct('<4sHHIIQ')
+SHELL_DTYPE = np.dtype([('shape', '<u4'),
+                        ('shell', '<u4'),
+                        ('bbox', '<f8', (2, 2)),
+                        ('offset', '<f8', (2,)),
+                        ('scale', '<f8'),
+                        ('rotated', 'u1'),  # counter-clockwise quarter turns
+                        ('udim', '<u2')])
+# Largest bbox difference relative to the recorded shell size that still matches, leaving room for LODs
+MATCH_TOLERANCE = 0.05
+MATCH_BATCH_SIZE = 1 << 20
+
+
+class LayoutError(ValueError):
+    pass
+
+
+def udim_tile(udim):
+    """Returns the (u, v) tile offset of a UDIM number"""
+    return (udim - 1001) % 10, (udim - 1001) // 10
+
+
+class Layout(object):
+    """Shell placements of a pack
+
+    shapes: List of shape record dicts holding at least 'name' and 'shells'
+    shells: SHELL_DTYPE record array, grouped by shape in shapes order
+    meta: JSON serializable values describing how the layout was made"""
+
+    def __init__(self, shapes, shells, meta=None):
+        self.shapes = shapes
+        self.shells = shells
+        self.meta = meta or {}
+
+    def __len__(self):
+        return len(self.shells)
+
+    @classmethod
+    def from_pack(cls, uv_data, shapes, scale, offsets, udim=1001, turns=None, **meta):
+        """Builds a layout from a pack_collected result over collect_shell_bboxes(uv_data)"""
+        counts = [len(uv_data[xform][shape][pipeline.SHELL_BBOXES]) for xform, shape in shapes]
+        shells = np.zeros(sum(counts), dtype=SHELL_DTYPE)
+        shells['shape'] = np.repeat(np.arange(len(shapes)), counts)
+        shells['shell'] = np.concatenate([np.arange(count) for count in counts]) if counts else []
+        if counts:
+            shells['bbox'] = np.concatenate([uv_data[xform][shape][pipeline.SHELL_BBOXES] for xform, shape in shapes])
+        shells['offset'] = offsets
+        shells['scale'] = scale
+        shells['udim'] = udim
+        if turns is not None:
+            shells['rotated'] = turns
+        records = [{'xform': xform, 'name': shape, 'shells': count} for (xform, shape), count in zip(shapes, counts)]
+        meta.setdefault('created', time.time())
+        return cls(records, shells, meta)
+
+    def shape_shells(self):
+        """Returns {shape index: slice of shells}"""
+        starts = np.concatenate([[0], np.cumsum([record['shells'] for record in self.shapes])])
+        return {index: slice(int(starts[index]), int(starts[index + 1])) for index in range(len(self.shapes))}
+
+    def placed_bboxes(self):
+        """Returns the (num_shells, 2, 2) bboxes the shells were moved to, laid out like pipeline.shell_bboxes"""
+        shells = self.shells
+        sizes = (shells['bbox'][:, :, 1] - shells['bbox'][:, :, 0]) * shells['scale'][:, None]
+        odd = shells['rotated'] % 2 == 1
+        sizes[odd] = sizes[odd, ::-1]
+        tile_u, tile_v = udim_tile(shells['udim'].astype(np.int64))
+        mins = shells['offset'] + np.column_stack([tile_u, tile_v])
+        return np.stack([mins, mins + sizes], axis=-1)
+
+    def save(self, path, sidecar=True):
+        names = json.dumps({'shapes': self.shapes, 'meta': self.meta}).encode('utf-8')
+        names += b' ' * (-(HEADER.size + len(names)) % 8)
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, len(self.shapes), len(self.shells), len(names)))
+            f.write(names)
+            f.write(np.ascontiguousarray(self.shells, dtype=SHELL_DTYPE).tobytes())
+        if sidecar:
+            self.save_sidecar(path + SIDECAR_EXTENSION)
+        return path
+
+    def save_sidecar(self, path):
+        shells = self.shells
+        summary = {'version': VERSION,
+                   'shells': len(shells),
+                   'udims': sorted(int(udim) for udim in np.unique(shells['udim'])),
+                   'rotated': int(np.count_nonzero(shells['rotated'])),
+                   'scale': [float(shells['scale'].min()), float(shells['scale'].max())] if len(shells) else None}
+        with open(path, 'w') as f:
+            json.dump({'summary': summary, 'meta': self.meta, 'shapes': self.shapes}, f, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a layout with its shell records memory-mapped read-only"""
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise LayoutError('%s is not a layout file' % path)
+            magic, version, _, num_shapes, num_shells, names_size = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise LayoutError('%s is not a layout file' % path)
+            if version > VERSION:
+                raise LayoutError('%s was written by a newer version (%d > %d)' % (path, version, VERSION))
+            names = json.loads(f.read(names_size).decode('utf-8'))
+        if len(names['shapes']) != num_shapes:
+            raise LayoutError('%s is corrupted: expected %d shapes' % (path, num_shapes))
+        if num_shells:
+            shells = np.memmap(path, dtype=SHELL_DTYPE, mode='r', offset=HEADER.size + names_size, shape=(num_shells,))
+        else:
+            shells = np.zeros(0, dtype=SHELL_DTYPE)
+        return cls(names['shapes'], shells, names.get('meta'))
+
+    def match(self, shapes, uuids=None):
+        """Pairs (xform, shape) pairs with the layout's shape records
+
+        Records are matched on uuid when uuids ({shape: uuid}) are given, then
+        on name, then by position for the shapes left over, which is what lets
+        a layout be reused on LODs.
+
+        Returns {(xform, shape): shape index}"""
+        matches = {}
+        used = set()
+        for key, values in (('uuid', uuids or {}), ('name', {shape: shape for _, shape in shapes})):
+            lookup = {record.get(key): index for index, record in enumerate(self.shapes)
+                      if record.get(key) and index not in used}
+            for xform, shape in shapes:
+                index = lookup.pop(values.get(shape), None)
+                if (xform, shape) not in matches and index is not None:
+                    matches[(xform, shape)] = index
+                    used.add(index)
+        leftover = [index for index in range(len(self.shapes)) if index not in used]
+        for pair, index in zip([pair for pair in shapes if pair not in matches], leftover):
+            matches[pair] = index
+        return matches
+
+    def apply(self, uv_data, uv_key='uv_coords', uuids=None, tolerance=MATCH_TOLERANCE):
+        """Moves the shells of processed uv_data to their recorded placements
+
+        Every shell is paired with its record through match_shells; a shape
+        whose shells cannot all be paired raises a LayoutError.
+
+        Returns {xform: {shape: (us, vs)}} like pipeline.apply_packed_layout"""
+        shape_shells = self.shape_shells()
+        shapes = [(xform, shape) for xform in uv_data for shape in uv_data[xform]]
+        results = {}
+        for (xform, shape), index in self.match(shapes, uuids).items():
+            shape_uv_data = uv_data[xform][shape]
+            shells = self.shells[shape_shells[index]]
+            bboxes = shape_uv_data.get(pipeline.SHELL_BBOXES)
+            if bboxes is None or len(bboxes) != len(shells):
+                raise LayoutError('%s has %s shells, the layout recorded %d for %s' % (
+                    shape, 'no' if bboxes is None else len(bboxes), len(shells), self.shapes[index]['name']))
+            order = match_shells(shells, bboxes, tolerance)
+            if order is None:
+                raise LayoutError('the shells of %s do not match the ones the layout recorded for %s' % (
+                    shape, self.shapes[index]['name']))
+            us, vs = shape_uv_data[uv_key]
+            results.setdefault(xform, {})[shape] = apply_shells(us, vs, shape_uv_data[pipeline.SHELL_IDS],
+                                                                bboxes, shells[order])
+        return results
+
+
+def recorded_order(shells):
+    """Returns the record index of every shell id of a shape, or None when the ids are not 0 to n - 1"""
+    order = np.full(len(shells), -1, dtype=np.int64)
+    ids = shells['shell'].astype(np.int64)
+    if len(ids) and ids.max() >= len(ids):
+        return None
+    order[ids] = np.arange(len(ids))
+    return order if (order >= 0).all() else None
+
+
+def bbox_distances(recorded, bboxes):
+    """Largest corner difference between recorded and current (..., 2, 2) bboxes, relative to the recorded size"""
+    sizes = (recorded[..., 1] - recorded[..., 0]).max(axis=-1)
+    return np.abs(bboxes - recorded).max(axis=(-2, -1)) / np.maximum(sizes, 1e-12)
+
+
+def match_shells(shells, bboxes, tolerance=MATCH_TOLERANCE):
+    """Pairs the current shells of a shape with its shell records
+
+    Shells pair with the record of their id when every bbox still agrees with
+    its record within tolerance. Otherwise, e.g. when shells were detected in
+    another order, each one pairs with the record of the closest bbox, which
+    has to be within tolerance and claimed by no other shell.
+
+    shells: SHELL_DTYPE records of the shape
+    bboxes: (num_shells, 2, 2) current shell bboxes
+
+    Returns the record index of every shell, or None when they cannot be paired"""
+    bboxes = np.asarray(bboxes, dtype=np.float64)
+    count = len(bboxes)
+    if len(shells) != count:
+        return None
+    recorded = np.asarray(shells['bbox'], dtype=np.float64)
+    order = recorded_order(shells)
+    if order is not None and (bbox_distances(recorded[order], bboxes) <= tolerance).all():
+        return order
+
+    order = np.zeros(count, dtype=np.int64)
+    rows = max(1, MATCH_BATCH_SIZE // max(count, 1))
+    for start in range(0, count, rows):
+        distances = bbox_distances(recorded[None], bboxes[start:start + rows, None])
+        order[start:start + rows] = closest = distances.argmin(axis=1)
+        if (distances[np.arange(len(closest)), closest] > tolerance).any():
+            return None
+    return order if len(np.unique(order)) == count else None
+
+
+def apply_shells(us, vs, shell_ids, bboxes, shells):
+    """Places every UV with its shell, honouring per shell scale, quarter turns and UDIM tile"""
+    us = np.asarray(us, dtype=np.float64)
+    vs = np.asarray(vs, dtype=np.float64)
+    bboxes = np.asarray(bboxes, dtype=np.float64)
+    scale = shells['scale'][shell_ids]
+    local_u = us - bboxes[:, 0, 0][shell_ids]
+    local_v = vs - bboxes[:, 1, 0][shell_ids]
+    turns = shells['rotated'][shell_ids]
+    if turns.any():
+        sizes = (bboxes[:, :, 1] - bboxes[:, :, 0])[shell_ids]
+        local_u, local_v = pipeline.rotate_local(local_u, local_v, sizes[:, 0], sizes[:, 1], turns)
+    tile_u, tile_v = udim_tile(shells['udim'].astype(np.int64))
+    offsets = shells['offset']
+    return (local_u * scale + offsets[:, 0][shell_ids] + tile_u[shell_ids],
+            local_v * scale + offsets[:, 1][shell_ids] + tile_v[shell_ids])
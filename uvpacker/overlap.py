@@ -0,0 +1,309 @@
+"""Vectorized UV overlap detection between shells
+
+Shell bboxes go through a sweep-and-prune pass first and pairs whose bboxes
+barely touch are dropped. Per remaining pair, the triangles reaching into the
+intersection of both bboxes are clipped against each other exactly to measure
+the overlapping area, while shells filling their bbox count as the bbox
+itself. Everything runs on flat NumPy arrays in bounded batches, so it is
+safe on worker threads."""
+import numpy as np
+
+from . import pipeline
+
+PAIR_BATCH_SIZE = 1 << 20
+CLIP_BATCH_SIZE = 1 << 18
+FILL_TOLERANCE = 1e-9
+MAX_CLIP_VERTICES = 8
+
+
+def sweep_and_prune(boxes, batch_size=PAIR_BATCH_SIZE, max_bands=1 << 16):
+    """Finds every pair of (min_x, min_y, max_x, max_y) boxes overlapping with a positive area
+
+    Returns an (m, 2) array of box index pairs, lower index first"""
+    pairs = list(iter_sweep_and_prune(boxes, batch_size, max_bands))
+    return np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+
+
+def iter_sweep_and_prune(boxes, batch_size=PAIR_BATCH_SIZE, max_bands=1 << 16):
+    """Yields the pairs of sweep_and_prune in chunks of at most batch_size candidates each
+
+    Boxes are swept along the axis they overlap least on, inside bands about
+    one box tall cut across the other axis, so tightly packed rows and
+    columns (i.e. packed layouts) do not degrade into quadratic candidate
+    lists. A box spanning several bands is swept in each of them and a pair
+    is only reported in the band holding the higher of its two minimums.
+
+    Yields (m, 2) arrays of box index pairs, lower index first"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    count = len(boxes)
+    if count < 2:
+        return
+
+    lows, highs = boxes[:, :2].min(axis=0), boxes[:, 2:].max(axis=0)
+    extent = np.maximum(highs - lows, 1e-12)
+    spans = boxes[:, 2:] - boxes[:, :2]
+    axis = int(np.argmin(spans.mean(axis=0) / extent))
+    other = 1 - axis
+
+    band_size = max(float(spans[:, other].mean()), extent[other] / max_bands, 1e-12)
+    first_band = np.floor((boxes[:, other] - lows[other]) / band_size).astype(np.int64)
+    band_counts = np.floor((boxes[:, other + 2] - lows[other]) / band_size).astype(np.int64) - first_band + 1
+    entries = np.repeat(np.arange(count), band_counts)
+    bands = np.repeat(first_band, band_counts) + np.arange(len(entries)) - np.repeat(
+        np.cumsum(band_counts) - band_counts, band_counts)
+
+    # Band index in the integer part, position along the sweep axis in [0, 1]
+    starts = bands * 2 + (boxes[entries, axis] - lows[axis]) / extent[axis]
+    stops = bands * 2 + (boxes[entries, axis + 2] - lows[axis]) / extent[axis]
+    order = np.argsort(starts, kind='mergesort')
+    entries, bands, starts, stops = entries[order], bands[order], starts[order], stops[order]
+    size = len(entries)
+    counts = np.maximum(np.searchsorted(starts, stops, side='left') - np.arange(size) - 1, 0)
+
+    for batch in pair_batches(counts, batch_size):
+        rows = np.arange(batch.start, batch.stop)
+        batch_counts = counts[rows]
+        first = np.repeat(rows, batch_counts)
+        second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(batch_counts) - batch_counts, batch_counts)
+        a, b = boxes[entries[first]], boxes[entries[second]]
+        reference = np.floor((np.maximum(a[:, other], b[:, other]) - lows[other]) / band_size).astype(np.int64)
+        hit = ((a[:, axis] < b[:, axis + 2]) & (b[:, axis] < a[:, axis + 2]) &
+               (a[:, other] < b[:, other + 2]) & (b[:, other] < a[:, other + 2]) & (reference == bands[first]))
+        yield np.sort(np.column_stack([entries[first[hit]], entries[second[hit]]]), axis=1)
+
+
+def triangulate(uv_counts, uv_ids):
+    """Fan triangulates faces from their per face UV counts and flattened UV ids
+
+    Returns a (num_triangles, 3) array of UV ids"""
+    uv_counts = np.asarray(uv_counts, dtype=np.int64)
+    uv_ids = np.asarray(uv_ids, dtype=np.int64)
+    starts = np.cumsum(uv_counts) - uv_counts
+    fans = np.maximum(uv_counts - 2, 0)
+    face_starts = np.repeat(starts, fans)
+    steps = np.arange(int(fans.sum())) - np.repeat(np.cumsum(fans) - fans, fans)
+    return np.column_stack([uv_ids[face_starts], uv_ids[face_starts + steps + 1], uv_ids[face_starts + steps + 2]])
+
+
+def counter_clockwise(triangles):
+    triangles = np.array(triangles, dtype=np.float64)
+    edges = triangles[:, 1:] - triangles[:, :1]
+    flipped = edges[:, 0, 0] * edges[:, 1, 1] - edges[:, 0, 1] * edges[:, 1, 0] < 0
+    triangles[flipped, 1:] = triangles[flipped, :0:-1]
+    return triangles
+
+
+def triangle_overlap_areas(first, second):
+    """Area of the intersection of every pair of (n, 3, 2) triangles
+
+    The first triangles are clipped against the three edges of the second
+    with a fixed size Sutherland-Hodgman pass vectorized over all pairs.
+    Polygons are stored vertex major so every step works on contiguous rows."""
+    first = counter_clockwise(first)
+    second = counter_clockwise(second)
+    count = len(first)
+    rows = np.arange(count)
+    xs = np.zeros((MAX_CLIP_VERTICES, count), dtype=np.float64)
+    ys = np.zeros((MAX_CLIP_VERTICES, count), dtype=np.float64)
+    xs[:3], ys[:3] = first[:, :, 0].T, first[:, :, 1].T
+    sizes = np.full(count, 3, dtype=np.int64)
+
+    for edge in range(3):
+        origin_x, origin_y = second[:, edge, 0], second[:, edge, 1]
+        edge_x = second[:, (edge + 1) % 3, 0] - origin_x
+        edge_y = second[:, (edge + 1) % 3, 1] - origin_y
+        limit = int(sizes.max()) if count else 0
+        sides = edge_x * (ys[:limit] - origin_y) - edge_y * (xs[:limit] - origin_x)
+        clipped_xs, clipped_ys = np.zeros_like(xs), np.zeros_like(ys)
+        flat_xs, flat_ys = clipped_xs.reshape(-1), clipped_ys.reshape(-1)
+        clipped_sizes = np.zeros(count, dtype=np.int64)
+        last = np.maximum(sizes, 1) - 1
+        for index in range(limit):
+            valid = index < sizes
+            if index:
+                previous_side, previous_x, previous_y = sides[index - 1], xs[index - 1], ys[index - 1]
+            else:
+                previous_side, previous_x, previous_y = sides[last, rows], xs[last, rows], ys[last, rows]
+            current_side = sides[index]
+            current_inside = current_side >= 0
+            crossing = valid & (current_inside != (previous_side >= 0))
+            # Every row writes at its next free slot; the slot is only claimed where a vertex is emitted
+            t = previous_side / np.where(crossing, previous_side - current_side, 1.0)
+            slots = clipped_sizes * count + rows
+            flat_xs[slots] = previous_x + t * (xs[index] - previous_x)
+            flat_ys[slots] = previous_y + t * (ys[index] - previous_y)
+            clipped_sizes += crossing
+            slots += crossing * count
+            flat_xs[slots] = xs[index]
+            flat_ys[slots] = ys[index]
+            clipped_sizes += valid & current_inside
+        xs, ys, sizes = clipped_xs, clipped_ys, clipped_sizes
+
+    following = (np.arange(MAX_CLIP_VERTICES)[:, None] + 1) % np.maximum(sizes, 1)
+    terms = xs * ys[following, rows] - ys * xs[following, rows]
+    terms[np.arange(MAX_CLIP_VERTICES)[:, None] >= sizes] = 0.0
+    return np.abs(terms.sum(axis=0)) * 0.5
+
+
+def shell_triangles(uv_data, shapes, candidates, uv_key='uv_coords', faces_key='uv_faces'):
+    """Collects the UV space triangles of the candidate shells
+
+    shapes: (xform, shape) pairs in collect_shell_bboxes order
+    candidates: Boolean mask over the concatenated shells
+
+    Returns (num_triangles, 3, 2) triangle points and their global shell indices"""
+    points, shells = [], []
+    first_shell = 0
+    for xform, shape in shapes:
+        shape_uv_data = uv_data[xform][shape]
+        shell_count = len(shape_uv_data[pipeline.SHELL_BBOXES])
+        shape_candidates = candidates[first_shell:first_shell + shell_count]
+        if shape_candidates.any():
+            triangles = triangulate(*shape_uv_data[faces_key])
+            triangle_shells = np.asarray(shape_uv_data[pipeline.SHELL_IDS])[triangles[:, 0]]
+            keep = shape_candidates[triangle_shells]
+            us, vs = (np.asarray(values, dtype=np.float64) for values in shape_uv_data[uv_key])
+            triangles = triangles[keep]
+            points.append(np.stack([us[triangles], vs[triangles]], axis=-1))
+            shells.append(triangle_shells[keep] + first_shell)
+        first_shell += shell_count
+    if not points:
+        return np.zeros((0, 3, 2), dtype=np.float64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(points), np.concatenate(shells)
+
+
+def pair_batches(costs, batch_size=PAIR_BATCH_SIZE):
+    """Splits consecutive items into slices whose summed costs stay within batch_size
+
+    An item costing more than batch_size on its own gets a slice to itself"""
+    totals = np.cumsum(costs)
+    start, size = 0, len(costs)
+    while start < size:
+        stop = max(int(np.searchsorted(totals, totals[start] - costs[start] + batch_size, side='right')), start + 1)
+        yield slice(start, stop)
+        start = stop
+
+
+def region_triangles(shells, regions, starts, counts, mins, maxs):
+    """Finds the triangles of shells[i] reaching into regions[i] for every i
+
+    starts, counts: First triangle and triangle count of every shell
+    mins, maxs: Per triangle bbox corners
+
+    Returns (items, triangles) index arrays, grouped by item"""
+    shell_counts = counts[shells]
+    items = np.repeat(np.arange(len(shells)), shell_counts)
+    triangles = np.repeat(starts[shells], shell_counts) + np.arange(len(items)) - np.repeat(
+        np.cumsum(shell_counts) - shell_counts, shell_counts)
+    box = regions[items]
+    keep = ((mins[triangles, 0] < box[:, 2]) & (box[:, 0] < maxs[triangles, 0]) &
+            (mins[triangles, 1] < box[:, 3]) & (box[:, 1] < maxs[triangles, 1]))
+    return items[keep], triangles[keep]
+
+
+def rectangle_overlap_areas(triangles, boxes):
+    """Area of the intersection of (n, 3, 2) triangles with their (n, 4) boxes"""
+    x0, y0, x1, y1 = boxes.T
+    lower = np.stack([np.column_stack([x0, y0]), np.column_stack([x1, y0]), np.column_stack([x1, y1])], axis=1)
+    upper = np.stack([np.column_stack([x0, y0]), np.column_stack([x1, y1]), np.column_stack([x0, y1])], axis=1)
+    return triangle_overlap_areas(triangles, lower) + triangle_overlap_areas(triangles, upper)
+
+
+def pair_overlap_areas(pairs, regions, fills, triangles, starts, counts, mins, maxs):
+    """Overlapping area of every shell pair, clipped within its bbox intersection region
+
+    A pair where both shells fill their bbox overlaps by the region itself and
+    one filled shell is replaced by the region, so only the other shell's
+    triangles get clipped. Every other pair clips the triangles of its first
+    shell reaching into the region against those of its second."""
+    areas = np.zeros(len(pairs), dtype=np.float64)
+    region_areas = (regions[:, 2] - regions[:, 0]) * (regions[:, 3] - regions[:, 1])
+    filled = fills[pairs]
+    both = filled.all(axis=1)
+    areas[both] = region_areas[both]
+
+    one = np.flatnonzero(filled.any(axis=1) & ~both)
+    if len(one):
+        items, first = region_triangles(pairs[one, filled[one, 0].astype(np.int64)], regions[one], starts, counts,
+                                        mins, maxs)
+        boxes = regions[one][items]
+        clipped = np.zeros(len(items), dtype=np.float64)
+        for start in range(0, len(items), CLIP_BATCH_SIZE):
+            stop = start + CLIP_BATCH_SIZE
+            clipped[start:stop] = rectangle_overlap_areas(triangles[first[start:stop]], boxes[start:stop])
+        areas[one] = np.bincount(items, weights=clipped, minlength=len(one))
+
+    neither = np.flatnonzero(~filled.any(axis=1))
+    if len(neither):
+        first_items, first = region_triangles(pairs[neither, 0], regions[neither], starts, counts, mins, maxs)
+        second_items, second = region_triangles(pairs[neither, 1], regions[neither], starts, counts, mins, maxs)
+        second_counts = np.bincount(second_items, minlength=len(neither))
+        repeats = second_counts[first_items]
+        items = np.repeat(first_items, repeats)
+        first = np.repeat(first, repeats)
+        second = second[np.repeat(np.cumsum(second_counts)[first_items] - repeats, repeats) + np.arange(len(items)) -
+                        np.repeat(np.cumsum(repeats) - repeats, repeats)]
+        touching = ((mins[first, 0] < maxs[second, 0]) & (mins[second, 0] < maxs[first, 0]) &
+                    (mins[first, 1] < maxs[second, 1]) & (mins[second, 1] < maxs[first, 1]))
+        items, first, second = items[touching], first[touching], second[touching]
+        clipped = np.zeros(len(items), dtype=np.float64)
+        for start in range(0, len(items), CLIP_BATCH_SIZE):
+            stop = start + CLIP_BATCH_SIZE
+            clipped[start:stop] = triangle_overlap_areas(triangles[first[start:stop]], triangles[second[start:stop]])
+        areas[neither] = np.bincount(items, weights=clipped, minlength=len(neither))
+    return areas
+
+
+def find_overlaps(job, uv_data, uv_key='uv_coords', faces_key='uv_faces', min_area=1e-10,
+                  batch_size=PAIR_BATCH_SIZE):
+    """Worker stage finding the overlapping shells within and across the shapes of processed uv_data
+
+    Shell pairs whose bboxes intersect by no more than min_area are dropped
+    before any triangle is clipped. The rest stream out of the sweep and are
+    measured in batches of about batch_size candidate triangle pairs, so
+    beyond the input only the overlapping pairs found are held in memory.
+
+    Returns a (shapes, bboxes, pairs, areas) tuple: shapes and bboxes as
+    returned by collect_shell_bboxes, an (m, 2) array of overlapping global
+    shell index pairs and the UV area each pair overlaps by"""
+    shapes, bboxes = pipeline.collect_shell_bboxes(uv_data)
+    pairs, areas = [np.zeros((0, 2), dtype=np.int64)], [np.zeros(0, dtype=np.float64)]
+    boxes = np.column_stack([bboxes[:, 0, 0], bboxes[:, 1, 0], bboxes[:, 0, 1], bboxes[:, 1, 1]])
+    triangles, triangle_shells = shell_triangles(uv_data, shapes, np.ones(len(bboxes), dtype=bool), uv_key, faces_key)
+    order = np.argsort(triangle_shells, kind='mergesort')
+    triangles, triangle_shells = triangles[order], triangle_shells[order]
+    counts = np.bincount(triangle_shells, minlength=len(bboxes))
+    starts = np.cumsum(counts) - counts
+    first, second, third = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    mins = np.minimum(np.minimum(first, second), third)
+    maxs = np.maximum(np.maximum(first, second), third)
+    cross = ((second[:, 0] - first[:, 0]) * (third[:, 1] - first[:, 1]) -
+             (second[:, 1] - first[:, 1]) * (third[:, 0] - first[:, 0]))
+    shell_areas = np.bincount(triangle_shells, weights=np.abs(cross) * 0.5, minlength=len(bboxes))
+    bbox_areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    # Faces of a shell never overlap each other, so a shell covering its bbox area is its bbox
+    fills = np.abs(shell_areas - bbox_areas) <= FILL_TOLERANCE * bbox_areas
+    job.report_progress(1, 3)
+
+    for candidates in iter_sweep_and_prune(boxes, batch_size):
+        regions = np.column_stack([np.maximum(boxes[candidates[:, 0], :2], boxes[candidates[:, 1], :2]),
+                                   np.minimum(boxes[candidates[:, 0], 2:], boxes[candidates[:, 1], 2:])])
+        # No two shells overlap by more than their bboxes do
+        keep = (regions[:, 2] - regions[:, 0]) * (regions[:, 3] - regions[:, 1]) > min_area
+        candidates, regions = candidates[keep], regions[keep]
+        filled = fills[candidates]
+        costs = np.where(filled.any(axis=1), counts[candidates].max(axis=1),
+                         counts[candidates[:, 0]] * counts[candidates[:, 1]])
+        costs[filled.all(axis=1)] = 1
+        for batch in pair_batches(costs, batch_size):
+            job.check_cancelled()
+            batch_areas = pair_overlap_areas(candidates[batch], regions[batch], fills, triangles, starts, counts,
+                                             mins, maxs)
+            overlapping = batch_areas > min_area
+            pairs.append(candidates[batch][overlapping])
+            areas.append(batch_areas[overlapping])
+    job.report_progress(2, 3)
+
+    pairs, areas = np.concatenate(pairs), np.concatenate(areas)
+    job.report_progress(3, 3)
+    return shapes, bboxes, pairs, areas
@@ -45,6 +45,9 @@ class Point(object):
         """Compares the starting position of height slices"""
         return self.x - other.x
 
+    def __lt__(self, other):
+        return self.x < other.x
+
 
 class RectanglePacker(object):
     """Base class for rectangle packing algorithms
@@ -254,12 +257,10 @@ class CygonRectanglePacker(RectanglePacker):
                                     start_slice, len(self.height_slices))
 
             # Another direct hit on the final slice's end?
-            if end_slice > 0:
+            if end_slice < len(self.height_slices) and \
+                    self.height_slices[end_slice].x == right:
                 del self.height_slices[start_slice:end_slice]
             else:  # No direct hit, rectangle ends inside another slice
-                # Make index from negative bisect_left() result
-                end_slice = ~end_slice
-
                 # Find out to which height we need to return at the right end of
                 # the rectangle
                 if end_slice == start_slice:
@@ -274,3 +275,81 @@ class CygonRectanglePacker(RectanglePacker):
                 if right < self.packing_area_width:
                     self.height_slices.insert(
                         start_slice, Point(right, return_height))
+
+
+@merge_inherited_docstrings
+class FreeSpacePacker(RectanglePacker):
+    """
+    Packer tracking the maximal free rectangles of the packing area
+
+    Unlike the silhouette of the Cygon packer, the free rectangle list can
+    describe holes, so areas can be marked as taken up front (e.g. by shells
+    that must not move) and new rectangles still find the gaps between them.
+    Placements go as low, then as far left, as possible. Splitting is
+    quadratic in the number of free rectangles, so it is meant for local
+    regions holding a few dozen rectangles."""
+
+    def __init__(self, width, height, epsilon=1e-9):
+        super(FreeSpacePacker, self).__init__(width, height)
+        self.epsilon = epsilon
+
+        # Free rectangles as (left, bottom, right, top), none contains another
+        self.free_rects = [(0, 0, width, height)]
+
+    def occupy(self, left, bottom, width, height):
+        """Marks a region of the packing area as taken
+
+        left: Position of the region's left side
+        bottom: Position of the region's lower side
+        width: Width of the region
+        height: Height of the region"""
+        right = left + width
+        top = bottom + height
+        epsilon = self.epsilon
+        split = []
+        for free in self.free_rects:
+            free_left, free_bottom, free_right, free_top = free
+            if (left >= free_right - epsilon or right <= free_left + epsilon or
+                    bottom >= free_top - epsilon or top <= free_bottom + epsilon):
+                split.append(free)
+                continue
+
+            # Keep the parts of the free rectangle on each side of the region
+            if left > free_left + epsilon:
+                split.append((free_left, free_bottom, left, free_top))
+            if right < free_right - epsilon:
+                split.append((right, free_bottom, free_right, free_top))
+            if bottom > free_bottom + epsilon:
+                split.append((free_left, free_bottom, free_right, bottom))
+            if top < free_top - epsilon:
+                split.append((free_left, top, free_right, free_top))
+        self.free_rects = self.prune(split)
+
+    def prune(self, rects):
+        """Drops every free rectangle contained in another one"""
+        epsilon = self.epsilon
+        rects = sorted(set(rects), key=lambda rect: (rect[2] - rect[0]) * (rect[3] - rect[1]), reverse=True)
+        kept = []
+        for rect in rects:
+            contained = False
+            for other in kept:
+                if (rect[0] >= other[0] - epsilon and rect[1] >= other[1] - epsilon and
+                        rect[2] <= other[2] + epsilon and rect[3] <= other[3] + epsilon):
+                    contained = True
+                    break
+            if not contained:
+                kept.append(rect)
+        return kept
+
+    def try_pack(self, rect_width, rect_height):
+        best = None
+        for left, bottom, right, top in self.free_rects:
+            if rect_width <= right - left + self.epsilon and rect_height <= top - bottom + self.epsilon:
+                if best is None or (bottom, left) < best:
+                    best = (bottom, left)
+
+        if best is None:
+            return None
+
+        self.occupy(best[1], best[0], rect_width, rect_height)
+        return Point(best[1], best[0])
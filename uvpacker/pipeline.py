@@ -0,0 +1,621 @@
+"""Pure-Python/NumPy processing stages for extracted UV data
+
+Nothing in here may touch the DCC or Qt: every stage works on plain arrays
+that were read on the main thread, so it is safe to run on worker threads.
+Stages take a job handle as their first argument which they poll for
+cancellation and report progress through."""
+import numpy as np
+
+from .packing import CygonRectanglePacker, OutOfSpaceError
+
+SHELL_IDS = 'shell_ids'
+SHELL_COUNT = 'shell_count'
+SHELL_BBOXES = 'shell_bboxes'
+SHELL_AREAS = 'shell_areas'
+RECT_VALUES = 'rect_values'
+WIREFRAME = 'wireframe'
+CACHE_KEY = 'cache_key'
+CACHED = 'cached'
+
+
+class NullJob(object):
+    """Job handle for running a stage synchronously on the calling thread"""
+    cancelled = False
+
+    def check_cancelled(self):
+        pass
+
+    def report_progress(self, value, maximum):
+        pass
+
+    def report_partial(self, value):
+        pass
+
+
+NULL_JOB = NullJob()
+
+
+def bbox_to_rect(bbox, unit_size, total_height):
+    """Converts a ((min_x, max_x), (min_y, max_y)) UV bbox to scene coordinates
+
+    unit_size: Scene size of one UV unit
+    total_height: Scene height used to flip the V axis
+
+    Returns an (x, y, width, height) tuple"""
+    (min_x, max_x), (min_y, max_y) = bbox
+    return (min_x * unit_size,
+            total_height - max_y * unit_size,
+            (max_x - min_x) * unit_size,
+            (max_y - min_y) * unit_size)
+
+
+def face_uv_edges(uv_counts, uv_ids):
+    """Links every face-vertex UV to the first UV of its face
+
+    uv_counts: Number of UVs assigned to each face
+    uv_ids: Flattened UV ids per face-vertex
+
+    Returns two index arrays of equal length describing UV connectivity"""
+    uv_counts = np.asarray(uv_counts, dtype=np.int64)
+    uv_ids = np.asarray(uv_ids, dtype=np.int64)
+    starts = np.cumsum(uv_counts) - uv_counts
+    mapped = uv_counts > 0
+    first = np.repeat(uv_ids[starts[mapped]], uv_counts[mapped])
+    return first, uv_ids
+
+
+def detect_shells(uv_counts, uv_ids, num_uvs):
+    """Labels connected UV shells with label propagation and pointer jumping
+
+    Returns a (shell_ids, shell_count) tuple where shell_ids maps every UV to
+    a dense shell index"""
+    labels = np.arange(num_uvs, dtype=np.int64)
+    if not num_uvs:
+        return labels, 0
+
+    a, b = face_uv_edges(uv_counts, uv_ids)
+    while True:
+        lowest = np.minimum(labels[a], labels[b])
+        previous = labels.copy()
+        np.minimum.at(labels, a, lowest)
+        np.minimum.at(labels, b, lowest)
+        jumped = labels[labels]
+        while not np.array_equal(jumped, labels):
+            labels = jumped
+            jumped = labels[labels]
+        if np.array_equal(labels, previous):
+            break
+
+    unique_labels, shell_ids = np.unique(labels, return_inverse=True)
+    return shell_ids, len(unique_labels)
+
+
+def shell_bboxes(us, vs, shell_ids, shell_count):
+    """Computes the UV bounding box of every shell in one vectorized pass
+
+    Returns an array of shape (shell_count, 2, 2) laid out like the DCC
+    bboxes: ((min_x, max_x), (min_y, max_y))"""
+    us = np.asarray(us, dtype=np.float64)
+    vs = np.asarray(vs, dtype=np.float64)
+    bboxes = np.empty((shell_count, 2, 2), dtype=np.float64)
+    bboxes[:, :, 0] = np.inf
+    bboxes[:, :, 1] = -np.inf
+    np.minimum.at(bboxes[:, 0, 0], shell_ids, us)
+    np.maximum.at(bboxes[:, 0, 1], shell_ids, us)
+    np.minimum.at(bboxes[:, 1, 0], shell_ids, vs)
+    np.maximum.at(bboxes[:, 1, 1], shell_ids, vs)
+    return bboxes
+
+
+def face_uv_edge_ids(uv_counts, uv_ids):
+    """Lists every UV edge once, in both directions collapsed
+
+    Returns an (num_edges, 2) array of UV id pairs and a boolean array flagging
+    the edges used by a single face, i.e. the shell outlines"""
+    uv_counts = np.asarray(uv_counts, dtype=np.int64)
+    uv_ids = np.asarray(uv_ids, dtype=np.int64)
+    if not len(uv_ids):
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(0, dtype=bool)
+    starts = np.cumsum(uv_counts) - uv_counts
+    mapped = uv_counts > 0
+    following = np.arange(1, len(uv_ids) + 1)
+    following[(starts + uv_counts - 1)[mapped]] = starts[mapped]
+
+    pairs = np.sort(np.column_stack([uv_ids, uv_ids[following]]), axis=1)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    stride = int(uv_ids.max()) + 1
+    keys, uses = np.unique(pairs[:, 0] * stride + pairs[:, 1], return_counts=True)
+    return np.column_stack([keys // stride, keys % stride]), uses == 1
+
+
+def polygon_areas(points, counts, ids):
+    """Area of every polygon in one batched pass over the flattened face-vertex arrays
+
+    points: (num_points, 2) or (num_points, 3) coordinates
+    counts: Number of vertices per face
+    ids: Flattened point ids per face-vertex
+
+    Uses the length of Newell's vector area, exact for planar faces and the
+    projected area of non planar ones, so flipped UV faces count positive."""
+    points = np.asarray(points, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.int64)
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return np.zeros(len(counts), dtype=np.float64)
+    starts = np.cumsum(counts) - counts
+    mapped = counts > 0
+    following = np.arange(1, len(ids) + 1)
+    following[(starts + counts - 1)[mapped]] = starts[mapped]
+    faces = np.repeat(np.arange(len(counts)), counts)
+    current = [np.ascontiguousarray(points[:, axis])[ids] for axis in range(points.shape[1])]
+    after = [values[following] for values in current]
+    axes = [(0, 1)] if len(current) == 2 else [(1, 2), (2, 0), (0, 1)]
+    squared = np.zeros(len(counts), dtype=np.float64)
+    for first, second in axes:
+        component = np.bincount(faces, weights=current[first] * after[second] - current[second] * after[first],
+                                minlength=len(counts))
+        squared += component * component
+    return np.sqrt(squared) * 0.5
+
+
+def shell_areas(us, vs, uv_counts, uv_ids, shell_ids, shell_count, points, face_counts, face_vertex_ids):
+    """Sums the surface and UV area of every shell's faces
+
+    The mesh faces must be listed in the same order as the UV faces.
+
+    Returns a (shell_count, 2) array of (surface area, UV area)"""
+    uv_counts = np.asarray(uv_counts, dtype=np.int64)
+    uv_ids = np.asarray(uv_ids, dtype=np.int64)
+    if len(face_counts) != len(uv_counts):
+        raise ValueError('Mesh has %d faces but %d UV faces' % (len(face_counts), len(uv_counts)))
+    mapped = uv_counts > 0
+    face_shells = np.asarray(shell_ids)[uv_ids[(np.cumsum(uv_counts) - uv_counts)[mapped]]]
+    surface = polygon_areas(points, face_counts, face_vertex_ids)[mapped]
+    uv = polygon_areas(np.column_stack([us, vs]), uv_counts, uv_ids)[mapped]
+    return np.column_stack([np.bincount(face_shells, weights=surface, minlength=shell_count),
+                            np.bincount(face_shells, weights=uv, minlength=shell_count)])
+
+
+def texel_density_scales(areas, weights=None):
+    """Linear per shell scales bringing every shell to the same texel density
+
+    areas: (num_shells, 2) surface and UV areas as returned by shell_areas
+    weights: Optional per shell multipliers of the resulting density
+
+    The target is the density of all measured shells together, so normalizing
+    keeps the total UV area. Shells without surface or UV area keep their size."""
+    areas = np.asarray(areas, dtype=np.float64).reshape(-1, 2)
+    surface, uv = areas[:, 0], areas[:, 1]
+    measured = (surface > 0) & (uv > 0)
+    scales = np.ones(len(areas), dtype=np.float64)
+    if measured.any():
+        target = np.sqrt(uv[measured].sum() / surface[measured].sum())
+        scales[measured] = np.sqrt(surface[measured] / uv[measured]) * target
+    if weights is not None:
+        scales *= weights
+    return scales
+
+
+def wireframe_segments(us, vs, uv_counts, uv_ids, shell_ids, unit_size, total_height):
+    """Builds scene space line segments for drawing a shape's UV wireframe
+
+    Returns a dict with float32 'segments' (x1, y1, x2, y2) rows and their
+    'shells', plus the 'outline' subset of boundary edges and its 'outline_shells'"""
+    edges, boundary = face_uv_edge_ids(uv_counts, uv_ids)
+    xs = np.asarray(us, dtype=np.float32) * unit_size
+    ys = total_height - np.asarray(vs, dtype=np.float32) * unit_size
+    segments = np.column_stack([xs[edges[:, 0]], ys[edges[:, 0]], xs[edges[:, 1]], ys[edges[:, 1]]])
+    shells = np.asarray(shell_ids)[edges[:, 0]]
+    return {'segments': segments, 'shells': shells,
+            'outline': segments[boundary], 'outline_shells': shells[boundary]}
+
+
+def process_shape(shape_data, unit_size, total_height, uv_key='uv_coords', faces_key='uv_faces', bbox_key='bbox',
+                  mesh_key='mesh_faces'):
+    """Runs shell detection, bbox and area math for a single shape's extracted data
+
+    mesh_key: Optional (points, face counts, face vertex ids) entry shell
+              surface areas are measured from
+
+    Returns a dict of derived values to merge back into the shape's data"""
+    result = {}
+    bbox = shape_data.get(bbox_key)
+    if bbox:
+        result[RECT_VALUES] = bbox_to_rect(bbox, unit_size, total_height)
+
+    coords = shape_data.get(uv_key)
+    faces = shape_data.get(faces_key)
+    if coords is not None and faces is not None:
+        us, vs = coords
+        shell_ids = shape_data.get(SHELL_IDS)
+        if shell_ids is None:
+            shell_ids, shell_count = detect_shells(faces[0], faces[1], len(us))
+            result[SHELL_IDS] = shell_ids
+            result[SHELL_COUNT] = shell_count
+            result[SHELL_BBOXES] = shell_bboxes(us, vs, shell_ids, shell_count)
+        mesh = shape_data.get(mesh_key)
+        if mesh is not None and shape_data.get(SHELL_AREAS) is None:
+            shell_count = result.get(SHELL_COUNT, shape_data.get(SHELL_COUNT))
+            result[SHELL_AREAS] = shell_areas(us, vs, faces[0], faces[1], shell_ids, shell_count, *mesh)
+        result[WIREFRAME] = wireframe_segments(us, vs, faces[0], faces[1], shell_ids, unit_size, total_height)
+    return result
+
+
+def process_uv_data(job, uv_data, unit_size, total_height, cache=None, **keys):
+    """Worker stage running process_shape over a snapshot of uv_data
+
+    cache: UVCache freshly extracted shapes tagged with a CACHE_KEY are stored in
+
+    Returns {xform: {shape: derived values}}"""
+    shapes = [(xform, shape) for xform in uv_data for shape in uv_data[xform]]
+    results = {}
+    for index, (xform, shape) in enumerate(shapes):
+        job.check_cancelled()
+        shape_data = uv_data[xform][shape]
+        result = results.setdefault(xform, {})[shape] = process_shape(shape_data, unit_size, total_height, **keys)
+        if cache is not None and shape_data.get(CACHE_KEY) and not shape_data.get(CACHED) and SHELL_IDS in result:
+            merged = dict(shape_data)
+            merged.update(result)
+            cache.put(shape_data[CACHE_KEY], *shape_cache_entry(merged, **keys))
+        job.report_progress(index + 1, len(shapes))
+    return results
+
+
+def shape_cache_entry(shape_data, uv_key='uv_coords', faces_key='uv_faces', bbox_key='bbox', **keys):
+    """Splits a processed shape's data into the (arrays, meta) pair stored in a UVCache"""
+    us, vs = shape_data[uv_key]
+    uv_counts, uv_ids = shape_data[faces_key]
+    arrays = {'us': np.asarray(us), 'vs': np.asarray(vs),
+              'uv_counts': np.asarray(uv_counts), 'uv_ids': np.asarray(uv_ids),
+              SHELL_IDS: shape_data[SHELL_IDS], SHELL_BBOXES: shape_data[SHELL_BBOXES]}
+    if shape_data.get(SHELL_AREAS) is not None:
+        arrays[SHELL_AREAS] = shape_data[SHELL_AREAS]
+    bbox = shape_data.get(bbox_key)
+    meta = {SHELL_COUNT: int(shape_data[SHELL_COUNT]),
+            bbox_key: [[float(value) for value in axis] for axis in bbox] if bbox else None}
+    return arrays, meta
+
+
+def shape_from_cache_entry(arrays, meta, uv_key='uv_coords', faces_key='uv_faces', bbox_key='bbox'):
+    """Rebuilds shape data from a UVCache entry, the inverse of shape_cache_entry"""
+    return {uv_key: (arrays['us'], arrays['vs']),
+            faces_key: (arrays['uv_counts'], arrays['uv_ids']),
+            bbox_key: meta.get(bbox_key),
+            SHELL_IDS: arrays[SHELL_IDS],
+            SHELL_COUNT: meta[SHELL_COUNT],
+            SHELL_BBOXES: arrays[SHELL_BBOXES],
+            SHELL_AREAS: arrays.get(SHELL_AREAS),
+            CACHED: True}
+
+
+def pack_rects(job, sizes, width, height, packer_class=CygonRectanglePacker):
+    """Worker stage packing (width, height) sizes largest first
+
+    Returns a list of (x, y) placements in input order, None for rectangles
+    that did not fit"""
+    packer = packer_class(width, height)
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i][0] * sizes[i][1], reverse=True)
+    placements = [None] * len(sizes)
+    for count, index in enumerate(order):
+        job.check_cancelled()
+        point = packer.try_pack(*sizes[index])
+        if point:
+            placements[index] = (point.x, point.y)
+        job.report_progress(count + 1, len(order))
+    return placements
+
+
+def pack_shells(job, bboxes, padding=0.005, fill=0.8, shrink=0.95, max_attempts=40, partial_every=0,
+                tiles=None, packer_class=CygonRectanglePacker):
+    """Worker stage packing shell bboxes into the 0-1 UV square at a uniform scale
+
+    bboxes: (num_shells, 2, 2) array as returned by shell_bboxes
+    padding: UV space kept free around every shell
+    fill: Initial guess of the fraction of the square the shells will cover
+    shrink: Factor the scale is reduced by every time a pack attempt overflows
+    partial_every: When set, the intermediate layout is sent through
+                   job.report_partial as (bboxes, scale, offsets, indices)
+                   of the shells placed so far every this many placements
+    tiles: Optional (num_shells, 2) column and row counts packing every bbox
+           as a block of that many padded copies
+
+    Returns a (scale, offsets) tuple where offsets is a (num_shells, 2) array of
+    the new lower left corner of every shell"""
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 2, 2)
+    sizes = bboxes[:, :, 1] - bboxes[:, :, 0]
+    tiles = np.ones_like(sizes) if tiles is None else np.asarray(tiles, dtype=np.float64).reshape(-1, 2)
+    offsets = np.zeros((len(bboxes), 2), dtype=np.float64)
+    area = float((sizes[:, 0] * sizes[:, 1] * tiles[:, 0] * tiles[:, 1]).sum())
+    if not len(bboxes) or area <= 0:
+        return 1.0, offsets
+
+    scale = min(np.sqrt(fill / area), 1.0 / max(float((sizes * tiles).max()), 1e-12))
+    order = np.argsort(-sizes[:, 1] * tiles[:, 1], kind='mergesort')
+    for attempt in range(max_attempts):
+        packer = packer_class(1.0, 1.0)
+        for count, index in enumerate(order):
+            job.check_cancelled()
+            width, height = (sizes[index] * scale + padding) * tiles[index]
+            point = packer.try_pack(width, height)
+            if not point:
+                break
+            offsets[index] = point.x + padding * 0.5, point.y + padding * 0.5
+            if partial_every and not (count + 1) % partial_every:
+                placed = order[:count + 1]
+                job.report_partial((bboxes[placed], scale, offsets[placed], placed))
+        else:
+            return scale, offsets
+        job.report_progress(attempt + 1, max_attempts)
+        scale *= shrink
+    raise OutOfSpaceError('Shells do not fit in the 0-1 UV range after %d attempts' % max_attempts)
+
+
+def rotate_local(us, vs, widths, heights, turns):
+    """Turns shell local coordinates by counter-clockwise quarter turns inside their width x height box
+
+    Returns the new (us, vs), with the turned box's lower left corner still at the origin"""
+    turns = np.broadcast_to(np.asarray(turns) % 4, np.shape(us))
+    conditions = [turns == 1, turns == 2, turns == 3]
+    return (np.select(conditions, [heights - vs, widths - us, vs], us),
+            np.select(conditions, [us, heights - vs, widths - us], vs))
+
+
+def turned_bboxes(bboxes, turns):
+    """Swaps the width and height of the bboxes turned by an odd number of quarter turns"""
+    bboxes = np.array(bboxes, dtype=np.float64).reshape(-1, 2, 2)
+    if turns is None:
+        return bboxes
+    odd = np.asarray(turns) % 2 == 1
+    sizes = bboxes[odd, :, 1] - bboxes[odd, :, 0]
+    bboxes[odd, :, 1] = bboxes[odd, :, 0] + sizes[:, ::-1]
+    return bboxes
+
+
+def apply_shell_layout(us, vs, shell_ids, bboxes, scale, offsets, turns=None):
+    """Moves every UV along with its shell to the packed placement
+
+    scale: Uniform scale or per shell scales
+    turns: Optional per shell counter-clockwise quarter turns applied first
+
+    Returns the new (us, vs) arrays"""
+    us = np.asarray(us, dtype=np.float64)
+    vs = np.asarray(vs, dtype=np.float64)
+    bboxes = np.asarray(bboxes, dtype=np.float64)
+    if np.ndim(scale):
+        scale = np.asarray(scale)[shell_ids]
+    mins = bboxes[:, :, 0][shell_ids]
+    placed = np.asarray(offsets)[shell_ids]
+    local_us, local_vs = us - mins[:, 0], vs - mins[:, 1]
+    if turns is not None and np.any(turns):
+        sizes = (bboxes[:, :, 1] - bboxes[:, :, 0])[shell_ids]
+        local_us, local_vs = rotate_local(local_us, local_vs, sizes[:, 0], sizes[:, 1], np.asarray(turns)[shell_ids])
+    return local_us * scale + placed[:, 0], local_vs * scale + placed[:, 1]
+
+
+def mix64(values):
+    """splitmix64 finalizer spreading integer keys over all 64 bits"""
+    z = np.asarray(values).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def fingerprint_shells(us, vs, uv_counts, uv_ids, shell_ids, bboxes, tolerance=1e-5, rotations=False):
+    """Hashes the geometry of every shell relative to its bbox corner
+
+    UVs and UV edges are quantized to tolerance and summed per shell as
+    mixed 64 bit hashes, so the fingerprint ignores UV order and position.
+    With rotations every quarter turn is hashed and the smallest kept.
+
+    Returns an (num_shells, 5) int64 fingerprint array (UV count, quantized
+    width and height, UV hash, edge hash) and the quarter turns that bring
+    every shell into its fingerprinted orientation"""
+    us = np.asarray(us, dtype=np.float64)
+    vs = np.asarray(vs, dtype=np.float64)
+    shell_ids = np.asarray(shell_ids, dtype=np.int64)
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 2, 2)
+    count = len(bboxes)
+    sizes = bboxes[:, :, 1] - bboxes[:, :, 0]
+    local_us = us - bboxes[shell_ids, 0, 0]
+    local_vs = vs - bboxes[shell_ids, 1, 0]
+    edges, _ = face_uv_edge_ids(uv_counts, uv_ids)
+    uv_totals = np.bincount(shell_ids, minlength=count)
+
+    best, canonical = None, np.zeros(count, dtype=np.int64)
+    for turns in range(4 if rotations else 1):
+        turned_us, turned_vs = rotate_local(local_us, local_vs, sizes[shell_ids, 0], sizes[shell_ids, 1], turns)
+        point_hashes = mix64(mix64(np.round(turned_us / tolerance).astype(np.int64)) ^
+                             np.round(turned_vs / tolerance).astype(np.int64).astype(np.uint64))
+        point_sums = np.zeros(count, dtype=np.uint64)
+        np.add.at(point_sums, shell_ids, point_hashes)
+        edge_sums = np.zeros(count, dtype=np.uint64)
+        np.add.at(edge_sums, shell_ids[edges[:, 0]], mix64(point_hashes[edges[:, 0]] + point_hashes[edges[:, 1]]))
+        turned_sizes = np.round((sizes[:, ::-1] if turns % 2 else sizes) / tolerance).astype(np.int64)
+        candidate = np.column_stack([uv_totals, turned_sizes, point_sums.view(np.int64), edge_sums.view(np.int64)])
+        if best is None:
+            best = candidate
+            continue
+        differs = candidate != best
+        first = differs.argmax(axis=1)
+        rows = np.arange(count)
+        smaller = differs.any(axis=1) & (candidate[rows, first] < best[rows, first])
+        best[smaller] = candidate[smaller]
+        canonical[smaller] = turns
+    return best, canonical
+
+
+def group_identical_shells(uv_data, shapes, uv_key='uv_coords', faces_key='uv_faces', tolerance=1e-5,
+                           rotations=False):
+    """Groups the shells of collect_shell_bboxes output by fingerprint
+
+    Returns (groups, representatives, turns): the group index of every shell,
+    the first shell of every group, and the quarter turns that lay every shell
+    over its group's representative"""
+    fingerprints, canonical = [], []
+    for xform, shape in shapes:
+        shape_uv_data = uv_data[xform][shape]
+        us, vs = shape_uv_data[uv_key]
+        uv_counts, uv_ids = shape_uv_data[faces_key]
+        shape_fingerprints, shape_canonical = fingerprint_shells(
+            us, vs, uv_counts, uv_ids, shape_uv_data[SHELL_IDS], shape_uv_data[SHELL_BBOXES], tolerance, rotations)
+        fingerprints.append(shape_fingerprints)
+        canonical.append(shape_canonical)
+    if not fingerprints:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    fingerprints, canonical = np.concatenate(fingerprints), np.concatenate(canonical)
+    _, representatives, groups = np.unique(fingerprints, axis=0, return_index=True, return_inverse=True)
+    groups = groups.reshape(-1)
+    return groups, representatives, (canonical - canonical[representatives][groups]) % 4
+
+
+def pack_instances(job, bboxes, groups, representatives, mode='stack', padding=0.005, pack_fn=pack_shells, **kwargs):
+    """Worker stage packing one representative per group of identical shells
+
+    mode: 'stack' places every instance on top of its representative,
+          'block' lays a group's instances out in a grid packed as one rectangle
+    pack_fn: pack_shells compatible callable the representatives are packed with
+
+    Returns a (scale, offsets) tuple covering every shell"""
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 2, 2)
+    group_sizes = np.bincount(groups, minlength=len(representatives))
+    if mode == 'stack':
+        tiles = None
+    elif mode == 'block':
+        columns = np.ceil(np.sqrt(group_sizes)).astype(np.int64)
+        tiles = np.column_stack([columns, -(-group_sizes // np.maximum(columns, 1))])
+    else:
+        raise ValueError('Unknown instance packing mode %s' % mode)
+
+    scale, representative_offsets = pack_fn(job, bboxes[representatives], padding=padding, tiles=tiles, **kwargs)
+    offsets = representative_offsets[groups]
+    if tiles is not None:
+        order = np.argsort(groups, kind='mergesort')
+        ranks = np.empty(len(groups), dtype=np.int64)
+        ranks[order] = np.arange(len(groups)) - (np.cumsum(group_sizes) - group_sizes)[groups[order]]
+        steps = (bboxes[representatives, :, 1] - bboxes[representatives, :, 0]) * scale + padding
+        cells = np.column_stack([ranks % tiles[groups, 0], ranks // tiles[groups, 0]])
+        offsets = offsets + cells * steps[groups]
+    return scale, offsets
+
+
+def collect_texel_scales(uv_data, shapes, weights=None):
+    """Runs texel_density_scales over every shell of collect_shell_bboxes output
+
+    weights: Optional {shape: density multiplier}, shapes default to 1
+
+    Shapes processed without mesh data keep their shells' size."""
+    areas, shell_weights = [], []
+    for xform, shape in shapes:
+        shape_uv_data = uv_data[xform][shape]
+        count = len(shape_uv_data[SHELL_BBOXES])
+        shape_areas = shape_uv_data.get(SHELL_AREAS)
+        areas.append(np.zeros((count, 2)) if shape_areas is None else shape_areas)
+        shell_weights.append(np.full(count, (weights or {}).get(shape, 1.0), dtype=np.float64))
+    if not areas:
+        return np.ones(0, dtype=np.float64)
+    return texel_density_scales(np.concatenate(areas), np.concatenate(shell_weights))
+
+
+def scale_bboxes(bboxes, scales):
+    """Scales every bbox about its lower left corner"""
+    bboxes = np.array(bboxes, dtype=np.float64).reshape(-1, 2, 2)
+    bboxes[:, :, 1] = bboxes[:, :, 0] + (bboxes[:, :, 1] - bboxes[:, :, 0]) * np.reshape(scales, (-1, 1))
+    return bboxes
+
+
+def pack_collected(job, uv_data, shapes, bboxes, dedupe=None, tolerance=1e-5, rotations=False,
+                   texel_density=False, weights=None, uv_key='uv_coords', faces_key='uv_faces', pack_fn=pack_shells,
+                   **kwargs):
+    """Packs collect_shell_bboxes output, optionally placing identical shells once
+
+    dedupe: None to pack every shell, otherwise a pack_instances mode
+    texel_density: Scales every shell to a common texel density first
+    weights: {shape: texel density multiplier} used with texel_density
+    pack_fn: pack_shells compatible callable doing the packing, e.g. a
+             service.PackClient's pack_shells to pack out of process
+
+    Returns (scale, offsets, turns) where scale holds per shell scales with
+    texel_density and turns is None without dedupe"""
+    shell_scales = collect_texel_scales(uv_data, shapes, weights) if texel_density else None
+    turns = None
+    if dedupe:
+        groups, representatives, turns = group_identical_shells(uv_data, shapes, uv_key, faces_key, tolerance,
+                                                                rotations)
+        job.check_cancelled()
+        if shell_scales is not None:
+            # Stacked and blocked instances share their representative's size
+            shell_scales = shell_scales[representatives][groups]
+    packed_bboxes = bboxes if shell_scales is None else scale_bboxes(bboxes, shell_scales)
+    if dedupe:
+        scale, offsets = pack_instances(job, packed_bboxes, groups, representatives, dedupe, pack_fn=pack_fn, **kwargs)
+    else:
+        scale, offsets = pack_fn(job, packed_bboxes, **kwargs)
+    if shell_scales is not None:
+        scale = scale * shell_scales
+    return scale, offsets, turns
+
+
+def collect_shell_bboxes(uv_data):
+    """Concatenates the shell bboxes of every processed shape in uv_data
+
+    Returns the list of (xform, shape) pairs in concatenation order and the
+    (num_shells, 2, 2) bbox array"""
+    shapes = [(xform, shape) for xform in uv_data for shape in uv_data[xform]
+              if uv_data[xform][shape].get(SHELL_BBOXES) is not None]
+    if not shapes:
+        return shapes, np.zeros((0, 2, 2), dtype=np.float64)
+    return shapes, np.concatenate([uv_data[xform][shape][SHELL_BBOXES] for xform, shape in shapes])
+
+
+def apply_packed_layout(uv_data, shapes, scale, offsets, uv_key='uv_coords', turns=None):
+    """Applies a layout computed over collect_shell_bboxes output to the UVs
+
+    Returns {xform: {shape: (us, vs)}} with the packed coordinates"""
+    results = {}
+    start = 0
+    for xform, shape in shapes:
+        shape_uv_data = uv_data[xform][shape]
+        bboxes = shape_uv_data[SHELL_BBOXES]
+        end = start + len(bboxes)
+        us, vs = shape_uv_data[uv_key]
+        results.setdefault(xform, {})[shape] = apply_shell_layout(
+            us, vs, shape_uv_data[SHELL_IDS], bboxes, scale if np.ndim(scale) == 0 else scale[start:end],
+            offsets[start:end], None if turns is None else turns[start:end])
+        start = end
+    return results
+
+
+def pack_uv_data(job, uv_data, uv_key='uv_coords', **kwargs):
+    """Worker stage packing the shells of every shape in uv_data into one atlas
+
+    uv_data must already hold the values derived by process_shape. Extra
+    keyword arguments go to pack_collected.
+
+    Returns {xform: {shape: (us, vs)}} with the packed coordinates"""
+    shapes, bboxes = collect_shell_bboxes(uv_data)
+    if not shapes:
+        return {}
+    scale, offsets, turns = pack_collected(job, uv_data, shapes, bboxes, uv_key=uv_key, **kwargs)
+    return apply_packed_layout(uv_data, shapes, scale, offsets, uv_key, turns)
+
+
+def preview_pack(job, uv_data, uv_key='uv_coords', **kwargs):
+    """Worker stage for live previews, streaming partial layouts through the job
+
+    Returns a (turned bboxes, scale, offsets, packed uv_data, shapes, turns) tuple"""
+    shapes, bboxes = collect_shell_bboxes(uv_data)
+    kwargs.setdefault('partial_every', max(len(bboxes) // 20, 1))
+    scale, offsets, turns = pack_collected(job, uv_data, shapes, bboxes, uv_key=uv_key, **kwargs)
+    return (turned_bboxes(bboxes, turns), scale, offsets,
+            apply_packed_layout(uv_data, shapes, scale, offsets, uv_key, turns), shapes, turns)
+
+
+def layout_rects(bboxes, scale, offsets, unit_size, total_height):
+    """Converts packed shell placements to (n, 4) scene space x/y/w/h rects"""
+    bboxes = np.asarray(bboxes).reshape(-1, 2, 2)
+    offsets = np.asarray(offsets).reshape(-1, 2)
+    sizes = (bboxes[:, :, 1] - bboxes[:, :, 0]) * np.reshape(scale, (-1, 1)) * unit_size
+    return np.column_stack([offsets[:, 0] * unit_size,
+                            total_height - offsets[:, 1] * unit_size - sizes[:, 1],
+                            sizes[:, 0], sizes[:, 1]])
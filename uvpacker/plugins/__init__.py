@@ -0,0 +1,94 @@
+"""Lazy registry of UVInterface implementations
+
+Plugins are registered as 'module.path:ClassName' strings and only imported
+the first time they are requested, so DCC modules (maya.cmds, OpenMaya,
+PySide2...) are never pulled in by code that just wants the pure-Python parts
+of uvpacker. Third party packages can add plugins through the
+'uvpacker.plugins' entry point group."""
+import os
+import time
+from importlib import import_module
+
+ENTRY_POINT_GROUP = 'uvpacker.plugins'
+ENV_VAR = 'UVPACKER_PLUGIN'
+DEFAULT_PLUGIN = 'maya'
+
+_registry = {
+    'maya': 'uvpacker.plugins.pmaya:MayaInterface',
+    'memory': 'uvpacker.plugins.pmemory:MemoryInterface',
+}
+_loaded = {}
+load_times = {}
+
+
+def register(name, target):
+    """Registers a plugin under name
+
+    target: Either a UVInterface subclass or a 'module.path:ClassName' string"""
+    _registry[name] = target
+    _loaded.pop(name, None)
+
+
+def available():
+    names = set(_registry)
+    names.update(entry_point.name for entry_point in _iter_entry_points())
+    return sorted(names)
+
+
+def default_name():
+    return os.environ.get(ENV_VAR, DEFAULT_PLUGIN)
+
+
+def get(name=None):
+    """Returns the UVInterface class registered under name, importing it on first use"""
+    name = name or default_name()
+    try:
+        return _loaded[name]
+    except KeyError:
+        pass
+
+    start = time.time()
+    target = _registry.get(name)
+    if target is None:
+        target = _resolve_entry_point(name)
+    if isinstance(target, str):
+        module_path, class_name = target.split(':')
+        target = getattr(import_module(module_path), class_name)
+
+    load_times[name] = time.time() - start
+    _loaded[name] = target
+    return target
+
+
+def _iter_entry_points():
+    try:
+        import pkg_resources
+    except ImportError:
+        return []
+    return pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)
+
+
+def _resolve_entry_point(name):
+    for entry_point in _iter_entry_points():
+        if entry_point.name == name:
+            return entry_point.load()
+    raise KeyError('No uvpacker plugin named %s, available plugins: %s' % (name, ', '.join(available())))
+
+
+class LazyPlugin(object):
+    """Stand-in for a plugin instance that resolves it on first attribute access"""
+
+    def __init__(self, name=None):
+        self._name = name
+        self._plugin = None
+
+    @property
+    def plugin(self):
+        if self._plugin is None:
+            self._plugin = get(self._name)()
+        return self._plugin
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.plugin, attr)
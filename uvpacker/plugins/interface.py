@@ -2,6 +2,10 @@ from functools import wraps
 from contextlib import contextmanager
 from itertools import chain
 
+from .. import pipeline
+from ..layout import Layout
+from ..profiling import instrument
+
 
 class UVInterface(object):
     name = None
@@ -9,9 +13,17 @@ class UVInterface(object):
     shape = None
     uv = 'uv'
     bbox = 'bbox'
+    uv_coords = 'uv_coords'
+    uv_faces = 'uv_faces'
+    mesh_faces = 'mesh_faces'
     dirty_callback = None
     delete_callback = None
     remove_callbacks = None
+    cache = None
+    # {uuid: (signature, checksum)}, {uuid: dirty callback count} and {uuid: callback id} since set_cache
+    checksums = None
+    dirty_counts = None
+    checksum_callbacks = None
 
     @staticmethod
     def get_api_object(node):
@@ -74,12 +86,171 @@ class UVInterface(object):
     def pause_viewport(*args, **kwargs):
         raise NotImplementedError
 
+    @staticmethod
+    def get_uv_count(shape):
+        raise NotImplementedError
+
+    @classmethod
+    def update_uv_data(cls, uv_data):
+        needs_updating = []
+
+        for xform in uv_data:
+            for shape in uv_data[xform]:
+                if cls.get_uv_count(shape) != len(uv_data[xform][shape][cls.uv]):
+                    needs_updating.append(xform)
+                    break
+
+        if not needs_updating:
+            return False
+
+        return cls.get_uv_data(needs_updating, uv_data=uv_data)
+
+    @staticmethod
+    def get_shapes(xform):
+        raise NotImplementedError
+
+    @classmethod
+    def get_shape_uv_data(cls, shape):
+        raise NotImplementedError
+
+    @staticmethod
+    def get_uuid(node):
+        raise NotImplementedError
+
+    @staticmethod
+    def get_shape_checksum(shape):
+        """Returns a digest of the shape's topology and UVs, cheaper to compute than get_shape_uv_data"""
+        raise NotImplementedError
+
+    @staticmethod
+    def get_shape_signature(shape):
+        """Returns values that are cheap to query and change with the shape's topology, e.g. its component counts"""
+        raise NotImplementedError
+
+    @staticmethod
+    def get_texel_weight(shape):
+        """Returns the texel density multiplier set on a shape, 1 when unset"""
+        return 1.0
+
+    @classmethod
+    def get_texel_weights(cls, shapes):
+        return {shape: cls.get_texel_weight(shape) for shape in shapes}
+
+    @staticmethod
+    def get_uv_names(shape, count):
+        """Returns what get_shape_uv_data stores under uv for a shape with count UVs"""
+        raise NotImplementedError
+
+    @classmethod
+    def set_cache(cls, cache):
+        if cls.checksum_callbacks:
+            cls.remove_callbacks(list(cls.checksum_callbacks.values()))
+        cls.checksums, cls.dirty_counts, cls.checksum_callbacks = {}, {}, {}
+        cls.cache = cache
+
+    @classmethod
+    def shape_dirtied(cls, node_uuid):
+        cls.dirty_counts[node_uuid] = cls.dirty_counts.get(node_uuid, 0) + 1
+
+    @classmethod
+    def get_cache_key(cls, shape):
+        """Returns the cache key of a shape
+
+        get_shape_checksum reads every UV, face and point, so the checksum of
+        each node is remembered and reused while its signature is unchanged
+        and no dirty callback fired for it since. Keys stay content based, so
+        entries written in an earlier session are never mistaken for edits."""
+        node_uuid = cls.get_uuid(shape)
+        if cls.dirty_callback is None:
+            return cls.cache.key(node_uuid, cls.get_shape_checksum(shape))
+        if node_uuid not in cls.checksum_callbacks:
+            cls.checksum_callbacks[node_uuid] = cls.dirty_callback(cls.get_api_object(shape),
+                                                                   lambda node, data: cls.shape_dirtied(node_uuid))
+        signature = (cls.dirty_counts.get(node_uuid, 0), cls.get_shape_signature(shape))
+        known = cls.checksums.get(node_uuid)
+        if known is None or known[0] != signature:
+            known = cls.checksums[node_uuid] = (signature, cls.get_shape_checksum(shape))
+        return cls.cache.key(node_uuid, known[1])
+
+    @classmethod
+    def get_cached_shape_uv_data(cls, shape):
+        """Loads a shape's data from the cache, falling back to get_shape_uv_data
+
+        Freshly extracted data is tagged with its cache key so the processing
+        stage can store it once its shells are known."""
+        key = cls.get_cache_key(shape)
+        entry = cls.cache.get(key)
+        if entry is None:
+            shape_uv_data = cls.get_shape_uv_data(shape)
+        else:
+            shape_uv_data = pipeline.shape_from_cache_entry(*entry, uv_key=cls.uv_coords,
+                                                            faces_key=cls.uv_faces, bbox_key=cls.bbox)
+            shape_uv_data[cls.uv] = cls.get_uv_names(shape, len(shape_uv_data[cls.uv_coords][0]))
+        shape_uv_data[pipeline.CACHE_KEY] = key
+        return shape_uv_data
+
+    @classmethod
+    def iter_uv_data(cls, xforms, chunk_size=None):
+        chunk = []
+        extract = cls.get_shape_uv_data if cls.cache is None else cls.get_cached_shape_uv_data
+        for xform in xforms:
+            for shape in cls.get_shapes(xform) or []:
+                chunk.append((xform, shape, extract(shape)))
+                if chunk_size and len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    @classmethod
+    def get_uv_data(cls, xforms, uv_data=None):
+        if uv_data is None:
+            uv_data = {}
+        total_uvs = 0
+
+        for chunk in cls.iter_uv_data(xforms):
+            for xform, shape, shape_uv_data in chunk:
+                uv_data.setdefault(xform, {})[shape] = shape_uv_data
+                total_uvs += len(shape_uv_data[cls.uv])
+        return uv_data, total_uvs
+
     @classmethod
-    def updated_uv_data(cls, uv_data):
+    def set_uv_data(cls, uv_updates):
+        """Writes {shape: (us, vs)} coordinates back as a single undoable operation"""
+        cls.undo_chunk(True)
+        cls.pause_viewport(True)
+        try:
+            for shape in uv_updates:
+                cls.set_shape_uvs(shape, *uv_updates[shape])
+        finally:
+            cls.pause_viewport(False)
+            cls.undo_chunk(False)
+
+    @staticmethod
+    def set_shape_uvs(shape, us, vs):
         raise NotImplementedError
 
+    @classmethod
+    def export_layout(cls, path, layout):
+        """Saves a Layout, recording node uuids so import can match shapes that were renamed"""
+        for record in layout.shapes:
+            record['uuid'] = cls.get_uuid(record['name'])
+        layout.meta.setdefault('dcc', cls.name)
+        return layout.save(path)
+
+    @classmethod
+    def import_layout(cls, path, uv_data):
+        """Applies a saved layout to processed uv_data without packing, as one undoable operation
+
+        Returns {xform: {shape: (us, vs)}} with the coordinates that were written"""
+        uuids = {shape: cls.get_uuid(shape) for xform in uv_data for shape in uv_data[xform]}
+        packed = Layout.load(path).apply(uv_data, uv_key=cls.uv_coords, uuids=uuids)
+        cls.set_uv_data({shape: packed[xform][shape] for xform in packed for shape in packed[xform]})
+        return packed
+
     @staticmethod
-    def get_uv_data(mesh):
+    def get_texture_paths(shape):
+        """Returns the {(u, v): path} UDIM tile textures assigned to shape"""
         raise NotImplementedError
 
     @classmethod
@@ -97,3 +268,6 @@ class UVInterface(object):
     @staticmethod
     def set_selection(objects, **kwargs):
         raise NotImplementedError
+
+
+instrument(UVInterface)
@@ -1,3 +1,7 @@
+import glob
+import re
+
+import numpy as np
 import maya.cmds as mc
 import maya.mel as mel
 from PySide2 import QtWidgets
@@ -5,10 +9,13 @@ import maya.api.OpenMaya as om
 
 from contextlib import contextmanager
 from itertools import chain
-from interface import UVInterface
+from .interface import UVInterface
+from ..cache import checksum
+from ..profiling import instrument
 
 
 component_suffixes = ['.map', '.uv', '.vtx', '.e', '.f']
+TEXEL_WEIGHT_ATTR = 'texelDensityWeight'
 
 
 class MayaInterface(UVInterface):
@@ -42,45 +49,56 @@ class MayaInterface(UVInterface):
 
     @staticmethod
     def pause_viewport(state, *args, **kwargs):
-        return MayaRuntime.undo_chunk(state, *args, **kwargs)
+        return MayaRuntime.pause_viewport(state, *args, **kwargs)
 
     @staticmethod
     def defer_eval(*args):
         return MayaRuntime.defer_eval(*args)
 
+    @staticmethod
+    def get_uv_count(shape):
+        return len(MayaNode.wrap(shape).uvs)
+
+    @staticmethod
+    def get_shapes(xform):
+        return MayaNode.wrap(xform).get_shapes()
+
     @classmethod
-    def update_uv_data(cls, uv_data):
-        needs_updating=[]
+    def get_shape_uv_data(cls, shape):
+        uvs=MayaNode.wrap(shape).uvs
+        return {cls.uv: uvs,
+                cls.bbox: mc.polyEvaluate(uvs, boundingBoxComponent2d=True),
+                cls.uv_coords: MayaRuntime.get_uv_coords(shape),
+                cls.uv_faces: MayaRuntime.get_assigned_uvs(shape),
+                cls.mesh_faces: MayaRuntime.get_mesh_faces(shape)}
 
-        for xform in uv_data:
-            for shape in uv_data[xform]:
-                data=uv_data[xform][shape]
-                if len(MayaNode.wrap(shape).uvs) != len(data[cls.uv]):
-                    needs_updating.append(xform)
-                    break
+    @staticmethod
+    def get_uuid(node):
+        return MayaRuntime.list_objects(node, uuid=True)[0]
 
-        if not needs_updating:
-            return False
+    @staticmethod
+    def get_shape_checksum(shape):
+        return MayaRuntime.get_mesh_checksum(shape)
 
-        return cls.get_uv_data(needs_updating, uv_data=uv_data)
+    @staticmethod
+    def get_shape_signature(shape):
+        return MayaRuntime.get_mesh_signature(shape)
 
-    @classmethod
-    def get_uv_data(cls, xforms, uv_data=None):
-        if uv_data is None:
-            uv_data={}
-        total_uvs=0
+    @staticmethod
+    def get_texel_weight(shape):
+        return MayaRuntime.get_texel_weight(shape)
 
-        for xform in xforms:
-            for shape in MayaNode.wrap(xform).get_shapes():
-                uv_data[xform]=uv_data.get(xform, {})
-                uv_data[xform][shape]=uv_data[xform].get(shape, {})
+    @staticmethod
+    def get_uv_names(shape, count):
+        return ['%s.map[%d]' % (shape, index) for index in range(count)]
 
-                uvs=MayaNode.wrap(shape).uvs
-                uv_data[xform][shape]={cls.uv: uvs,
-                                         cls.bbox: mc.polyEvaluate(uvs, boundingBoxComponent2d=True)}
+    @staticmethod
+    def set_shape_uvs(shape, us, vs):
+        return MayaRuntime.set_uvs(shape, us, vs)
 
-                total_uvs += len(uvs)
-        return uv_data, total_uvs
+    @staticmethod
+    def get_texture_paths(shape):
+        return MayaRuntime.get_texture_paths(shape)
 
     @classmethod
     def combine_shells(cls, uv_shells):
@@ -173,6 +191,86 @@ class MayaRuntime(object):
     def list_components(cls):
         return [cmpt for cmpt in cls.list_selection() if any(suffix in cmpt for suffix in component_suffixes)]
 
+    @staticmethod
+    def get_mesh_fn(node):
+        sel = om.MSelectionList()
+        sel.add(node)
+        return om.MFnMesh(sel.getDagPath(0))
+
+    @classmethod
+    def get_uv_coords(cls, node):
+        us, vs = cls.get_mesh_fn(node).getUVs()
+        return list(us), list(vs)
+
+    @classmethod
+    def get_assigned_uvs(cls, node):
+        uv_counts, uv_ids = cls.get_mesh_fn(node).getAssignedUVs()
+        return list(uv_counts), list(uv_ids)
+
+    @classmethod
+    def get_mesh_faces(cls, node):
+        """Returns world space points, per face vertex counts and flattened vertex ids"""
+        mesh_fn = cls.get_mesh_fn(node)
+        counts, ids = mesh_fn.getVertices()
+        return (np.array(mesh_fn.getPoints(om.MSpace.kWorld), dtype=np.float64)[:, :3],
+                np.array(counts, dtype=np.int64), np.array(ids, dtype=np.int64))
+
+    @classmethod
+    def get_mesh_checksum(cls, node):
+        mesh_fn = cls.get_mesh_fn(node)
+        us, vs = mesh_fn.getUVs()
+        uv_counts, uv_ids = mesh_fn.getAssignedUVs()
+        # World space points are included as they drive the cached shell surface areas
+        return checksum(np.array(us, dtype=np.float32), np.array(vs, dtype=np.float32),
+                        np.array(uv_counts, dtype=np.int32), np.array(uv_ids, dtype=np.int32),
+                        np.array(mesh_fn.getPoints(om.MSpace.kWorld), dtype=np.float32))
+
+    @classmethod
+    def get_mesh_signature(cls, node):
+        """Component counts of a mesh, read without copying any of its arrays"""
+        mesh_fn = cls.get_mesh_fn(node)
+        return mesh_fn.numUVs(), mesh_fn.numPolygons, mesh_fn.numFaceVertices
+
+    @staticmethod
+    def get_texel_weight(node):
+        for candidate in [node] + (mc.listRelatives(node, parent=True, fullPath=True) or []):
+            if mc.attributeQuery(TEXEL_WEIGHT_ATTR, node=candidate, exists=True):
+                return float(mc.getAttr('%s.%s' % (candidate, TEXEL_WEIGHT_ATTR)))
+        return 1.0
+
+    @classmethod
+    def set_uvs(cls, node, us, vs):
+        """Moves all UVs of node in one undoable setAttr on its uv tweaks"""
+        current_us, current_vs = cls.get_uv_coords(node)
+        if len(current_us) != len(us):
+            raise ValueError('%s has %d UVs, got %d' % (node, len(current_us), len(us)))
+        if not len(us):
+            return
+        attr = '%s.uvpt[0:%d]' % (node, len(us) - 1)
+        values = []
+        for (tweak_u, tweak_v), u, v, current_u, current_v in zip(mc.getAttr(attr), us, vs, current_us, current_vs):
+            values.extend((tweak_u + u - current_u, tweak_v + v - current_v))
+        mc.setAttr(attr, *values)
+
+    @staticmethod
+    def get_texture_paths(node):
+        textures = {}
+        for shading_engine in set(mc.listConnections(node, type='shadingEngine') or []):
+            for file_node in mc.ls(mc.listHistory(shading_engine) or [], type='file'):
+                path = mc.getAttr(file_node + '.fileTextureName')
+                if not path:
+                    continue
+                if '<UDIM>' not in path:
+                    textures.setdefault((0, 0), path)
+                    continue
+                pattern = re.compile(re.escape(path).replace(re.escape('<UDIM>'), r'(\d{4})') + '$')
+                for tile_path in glob.glob(path.replace('<UDIM>', '[0-9]' * 4)):
+                    match = pattern.search(tile_path.replace('\\', '/'))
+                    if match:
+                        udim = int(match.group(1)) - 1001
+                        textures.setdefault((udim % 10, udim // 10), tile_path)
+        return textures
+
     @staticmethod
     def get_uv_editors(*args, **kwargs):
         return list(set(mc.getPanel(sty='polyTexturePlacementPanel')) & set(mc.getPanel(vis=True)))
@@ -248,3 +346,7 @@ class MayaRuntime(object):
     @staticmethod
     def defer_eval(*args):
         return mc.evalDeferred(*args)
+
+
+instrument(MayaInterface)
+instrument(MayaRuntime)
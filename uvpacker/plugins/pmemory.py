@@ -0,0 +1,356 @@
+"""Headless in-memory UVInterface backed by NumPy arrays
+
+Meshes are loaded from OBJ files or generated procedurally, so the whole
+extraction -> shell detection -> packing pipeline can run and be profiled
+without a DCC session."""
+import itertools
+import os
+
+import numpy as np
+
+from .interface import UVInterface
+from ..cache import checksum
+from ..profiling import instrument
+
+
+class MemoryMesh(object):
+    """Polygon mesh with a single UV set
+
+    points: (num_vertices, 3) float array
+    uvs: (num_uvs, 2) float array
+    face_counts: Number of vertices per face
+    face_vertex_ids: Flattened vertex ids per face-vertex
+    face_uv_ids: Flattened UV ids per face-vertex, -1 where unmapped
+
+    Arrays are edited through MemoryScene.set_uvs, which fires the dirty
+    callbacks; serial tells meshes apart that are added under a reused name."""
+    serials = itertools.count(1)
+
+    def __init__(self, points, uvs, face_counts, face_vertex_ids, face_uv_ids=None):
+        self.serial = next(MemoryMesh.serials)
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.uvs = np.asarray(uvs, dtype=np.float64).reshape(-1, 2)
+        self.face_counts = np.asarray(face_counts, dtype=np.int64)
+        self.face_vertex_ids = np.asarray(face_vertex_ids, dtype=np.int64)
+        if face_uv_ids is None:
+            face_uv_ids = self.face_vertex_ids
+        self.face_uv_ids = np.asarray(face_uv_ids, dtype=np.int64)
+
+    @property
+    def num_uvs(self):
+        return len(self.uvs)
+
+    @property
+    def num_faces(self):
+        return len(self.face_counts)
+
+    def assigned_uvs(self):
+        """Matches MFnMesh.getAssignedUVs: per face UV counts and their ids"""
+        mapped = self.face_uv_ids >= 0
+        face_index = np.repeat(np.arange(self.num_faces), self.face_counts)
+        uv_counts = np.bincount(face_index[mapped], minlength=self.num_faces)
+        return uv_counts, self.face_uv_ids[mapped]
+
+    def uv_bbox(self):
+        if not self.num_uvs:
+            return (0.0, 0.0), (0.0, 0.0)
+        mins = self.uvs.min(axis=0)
+        maxs = self.uvs.max(axis=0)
+        return (float(mins[0]), float(maxs[0])), (float(mins[1]), float(maxs[1]))
+
+
+class MemoryScene(object):
+    def __init__(self):
+        self.transforms = {}
+        self.meshes = {}
+        self.selection = []
+        self.textures = {}
+        self.texel_weights = {}
+        self.callbacks = {}
+        self.callback_ids = itertools.count(1)
+
+    def add_mesh(self, xform, mesh, shape=None):
+        shape = shape or xform + 'Shape'
+        self.transforms.setdefault(xform, []).append(shape)
+        self.meshes[shape] = mesh
+        return shape
+
+    def delete(self, node):
+        shapes = self.transforms.pop(node, [node])
+        for shape in shapes:
+            self.meshes.pop(shape, None)
+        for xform in self.transforms:
+            if node in self.transforms[xform]:
+                self.transforms[xform].remove(node)
+        self.selection = [o for o in self.selection if o.split('.')[0] not in shapes + [node]]
+        self.emit(node, 'deleted')
+
+    def clear(self):
+        self.__init__()
+
+    def node_type(self, node):
+        if node in self.transforms:
+            return MemoryInterface.transform
+        if node in self.meshes:
+            return MemoryInterface.shape
+        raise KeyError('Object %s does not exist in the DCC %s' % (node, MemoryInterface.name))
+
+    def set_uvs(self, shape, uvs):
+        self.meshes[shape].uvs = np.asarray(uvs, dtype=np.float64).reshape(-1, 2)
+        self.emit(shape, 'dirty')
+
+    def add_callback(self, node, kind, fn):
+        callback_id = next(self.callback_ids)
+        self.callbacks[callback_id] = (node, kind, fn)
+        return callback_id
+
+    def remove_callbacks(self, callback_ids):
+        for callback_id in callback_ids:
+            self.callbacks.pop(callback_id, None)
+
+    def emit(self, node, kind):
+        related = set([node])
+        related.update(xform for xform, shapes in self.transforms.items() if node in shapes)
+        for callback_node, callback_kind, fn in list(self.callbacks.values()):
+            if callback_kind == kind and callback_node in related:
+                fn(callback_node, None)
+
+    def load_obj(self, path, prefix=None):
+        """Loads every object/group in an OBJ file as its own transform
+
+        Returns the list of created transforms"""
+        prefix = prefix or os.path.splitext(os.path.basename(path))[0]
+        points, uvs = [], []
+        objects = []
+        current = None
+
+        with open(path) as obj_file:
+            for line in obj_file:
+                parts = line.split()
+                if not parts:
+                    continue
+                tag = parts[0]
+                if tag == 'v':
+                    points.append([float(p) for p in parts[1:4]])
+                elif tag == 'vt':
+                    uvs.append([float(p) for p in parts[1:3]])
+                elif tag in ('o', 'g') and len(parts) > 1:
+                    current = [parts[1], [], [], []]
+                    objects.append(current)
+                elif tag == 'f':
+                    if current is None:
+                        current = [prefix, [], [], []]
+                        objects.append(current)
+                    current[1].append(len(parts) - 1)
+                    for corner in parts[1:]:
+                        indices = corner.split('/')
+                        current[2].append(self._obj_index(indices[0], len(points)))
+                        has_uv = len(indices) > 1 and indices[1]
+                        current[3].append(self._obj_index(indices[1], len(uvs)) if has_uv else -1)
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        uvs = np.asarray(uvs, dtype=np.float64).reshape(-1, 2)
+        xforms = []
+        for name, face_counts, vertex_ids, uv_ids in objects:
+            if not face_counts:
+                continue
+            vertex_ids = np.asarray(vertex_ids, dtype=np.int64)
+            uv_ids = np.asarray(uv_ids, dtype=np.int64)
+            used_vertices, local_vertex_ids = np.unique(vertex_ids, return_inverse=True)
+            mapped = uv_ids >= 0
+            used_uvs, local_uv_ids = np.unique(uv_ids[mapped], return_inverse=True)
+            face_uv_ids = np.full(len(uv_ids), -1, dtype=np.int64)
+            face_uv_ids[mapped] = local_uv_ids
+
+            xform = self.unique_name(name)
+            self.add_mesh(xform, MemoryMesh(points[used_vertices], uvs[used_uvs], face_counts,
+                                            local_vertex_ids, face_uv_ids))
+            xforms.append(xform)
+        return xforms
+
+    def save_obj(self, path, xforms=None):
+        with open(path, 'w') as obj_file:
+            vertex_offset = uv_offset = 1
+            for xform in xforms or sorted(self.transforms):
+                shapes = self.transforms[xform]
+                for shape in shapes:
+                    mesh = self.meshes[shape]
+                    obj_file.write('o %s\n' % (xform if len(shapes) == 1 else shape))
+                    for point in mesh.points:
+                        obj_file.write('v %.6f %.6f %.6f\n' % tuple(point))
+                    for uv in mesh.uvs:
+                        obj_file.write('vt %.6f %.6f\n' % tuple(uv))
+                    corners = 0
+                    for count in mesh.face_counts:
+                        face = []
+                        for corner in range(corners, corners + count):
+                            vertex_id = mesh.face_vertex_ids[corner] + vertex_offset
+                            uv_id = mesh.face_uv_ids[corner]
+                            face.append('%d/%d' % (vertex_id, uv_id + uv_offset) if uv_id >= 0 else '%d' % vertex_id)
+                        obj_file.write('f %s\n' % ' '.join(face))
+                        corners += count
+                    vertex_offset += len(mesh.points)
+                    uv_offset += mesh.num_uvs
+
+    def unique_name(self, name):
+        candidate = name
+        for index in itertools.count(1):
+            if candidate not in self.transforms and candidate not in self.meshes:
+                return candidate
+            candidate = '%s%d' % (name, index)
+
+    @staticmethod
+    def _obj_index(index, count):
+        index = int(index)
+        return index - 1 if index > 0 else count + index
+
+
+def generate_mesh(num_shells=16, shell_resolution=(4, 4), seed=0, overlap=None, shear=0.0):
+    """Builds a mesh made of num_shells disconnected quad grids in 0-1 UV space
+
+    shell_resolution: Number of (rows, columns) of quads per shell
+    overlap: None scatters shells at random, otherwise they are laid out one
+             per grid cell and this fraction of them is shifted half a cell
+             onto their neighbour
+    shear: Skews every shell into a parallelogram that no longer fills its bbox"""
+    rng = np.random.RandomState(seed)
+    rows, cols = shell_resolution
+    grid_v, grid_u = np.mgrid[0:rows + 1, 0:cols + 1]
+    grid = np.column_stack([grid_u.ravel() / float(cols), grid_v.ravel() / float(rows)])
+    grid[:, 0] = (grid[:, 0] + grid[:, 1] * shear - min(shear, 0.0)) / (1.0 + abs(shear))
+    verts_per_shell = len(grid)
+
+    quad_r, quad_c = np.mgrid[0:rows, 0:cols]
+    corner = (quad_r * (cols + 1) + quad_c).ravel()
+    quads = np.column_stack([corner, corner + 1, corner + cols + 2, corner + cols + 1])
+
+    if overlap is None:
+        sizes = rng.uniform(0.02, 0.2, size=(num_shells, 2))
+        offsets = rng.uniform(0.0, 1.0, size=(num_shells, 2)) * (1.0 - sizes)
+    else:
+        cells = int(np.ceil(np.sqrt(num_shells)))
+        cell = 1.0 / cells
+        sizes = rng.uniform(0.5, 0.9, size=(num_shells, 2)) * cell
+        offsets = (np.column_stack([np.arange(num_shells) % cells, np.arange(num_shells) // cells]) * cell +
+                   rng.uniform(0.0, 1.0, size=(num_shells, 2)) * (cell - sizes))
+        offsets[rng.uniform(size=num_shells) < overlap, 0] += cell * 0.5
+    uvs = (grid[None, :, :] * sizes[:, None, :] + offsets[:, None, :]).reshape(-1, 2)
+
+    heights = rng.uniform(0.0, 1.0, size=(num_shells, verts_per_shell, 1))
+    points = np.concatenate([grid[None].repeat(num_shells, axis=0) * 10.0 * sizes[:, None, :],
+                             heights], axis=2)
+    points[:, :, :2] += np.arange(num_shells)[:, None, None] * 10.0
+
+    face_ids = (quads[None, :, :] + (np.arange(num_shells) * verts_per_shell)[:, None, None]).ravel()
+    face_counts = np.full(num_shells * len(quads), 4, dtype=np.int64)
+    return MemoryMesh(points.reshape(-1, 3), uvs, face_counts, face_ids)
+
+
+class MemoryInterface(UVInterface):
+    name = 'memory'
+    transform = 'transform'
+    shape = 'mesh'
+    scene = MemoryScene()
+
+    @classmethod
+    def dirty_callback(cls, node, fn):
+        return cls.scene.add_callback(node, 'dirty', fn)
+
+    @classmethod
+    def delete_callback(cls, node, fn):
+        return cls.scene.add_callback(node, 'deleted', fn)
+
+    @classmethod
+    def remove_callbacks(cls, callback_ids):
+        return cls.scene.remove_callbacks(callback_ids)
+
+    @classmethod
+    def get_api_object(cls, node):
+        cls.scene.node_type(node)
+        return node
+
+    @staticmethod
+    def dcc_main_window(*args, **kwargs):
+        return None
+
+    @staticmethod
+    def defer_eval(*args):
+        fn = args[0]
+        return fn(*args[1:])
+
+    @staticmethod
+    def undo_chunk(state, *args, **kwargs):
+        pass
+
+    @staticmethod
+    def pause_viewport(state, *args, **kwargs):
+        pass
+
+    @classmethod
+    def get_uv_count(cls, shape):
+        return cls.scene.meshes[shape].num_uvs
+
+    @classmethod
+    def get_shapes(cls, xform):
+        return list(cls.scene.transforms.get(xform, []))
+
+    @classmethod
+    def get_shape_uv_data(cls, shape):
+        mesh = cls.scene.meshes[shape]
+        return {cls.uv: np.arange(mesh.num_uvs),
+                cls.bbox: mesh.uv_bbox(),
+                cls.uv_coords: (mesh.uvs[:, 0].copy(), mesh.uvs[:, 1].copy()),
+                cls.uv_faces: mesh.assigned_uvs(),
+                cls.mesh_faces: (mesh.points, mesh.face_counts, mesh.face_vertex_ids)}
+
+    @staticmethod
+    def get_uuid(node):
+        # In-memory nodes have no persistent ids, names are stable across OBJ round trips
+        return node
+
+    @classmethod
+    def get_shape_checksum(cls, shape):
+        mesh = cls.scene.meshes[shape]
+        return checksum(mesh.uvs, mesh.face_counts, mesh.face_uv_ids, mesh.points, mesh.face_vertex_ids)
+
+    @classmethod
+    def get_shape_signature(cls, shape):
+        mesh = cls.scene.meshes[shape]
+        return mesh.serial, mesh.num_uvs, mesh.num_faces, len(mesh.face_uv_ids)
+
+    @staticmethod
+    def get_uv_names(shape, count):
+        return np.arange(count)
+
+    @classmethod
+    def set_shape_uvs(cls, shape, us, vs):
+        cls.scene.set_uvs(shape, np.column_stack([us, vs]))
+
+    @classmethod
+    def get_texel_weight(cls, shape):
+        return cls.scene.texel_weights.get(shape, 1.0)
+
+    @classmethod
+    def get_texture_paths(cls, shape):
+        return dict(cls.scene.textures.get(shape, {}))
+
+    @staticmethod
+    def get_uv_editors(*args, **kwargs):
+        return []
+
+    @classmethod
+    def get_selection(cls, *args, **kwargs):
+        object_type = kwargs.get('type')
+        selection = cls.scene.selection
+        if object_type:
+            selection = [node for node in selection
+                         if '.' not in node and cls.scene.node_type(node) == object_type]
+        return list(selection)
+
+    @classmethod
+    def set_selection(cls, objects, *args, **kwargs):
+        cls.scene.selection = list(objects)
+
+
+instrument(MemoryInterface)
+instrument(MemoryScene)
@@ -0,0 +1,221 @@
+"""Low overhead call timers and counters for DCC calls and UI stages
+
+Instrumented callables always go through a thin wrapper that checks
+PROFILER.enabled first, so profiling can be toggled at runtime (including
+for slots that were connected before it was switched on) and costs one
+attribute lookup per call while it is off. Set UVPACKER_PROFILE=1 to start
+with profiling enabled."""
+import inspect
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import types
+from functools import wraps
+
+ENV_VAR = 'UVPACKER_PROFILE'
+HISTOGRAM_BUCKETS = 32
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+class Stat(object):
+    """Call count, timings and a log2 microsecond histogram of one instrumented name"""
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = 0.0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if self.minimum is None or elapsed < self.minimum:
+            self.minimum = elapsed
+        if elapsed > self.maximum:
+            self.maximum = elapsed
+        self.histogram[min(int(elapsed * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction):
+        """Upper bound in seconds of the histogram bucket holding the given fraction of calls"""
+        threshold = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= threshold:
+                return min(bucket_limit(bucket), self.maximum)
+        return self.maximum
+
+    def as_dict(self):
+        return {'count': self.count,
+                'total': self.total,
+                'mean': self.mean,
+                'min': self.minimum or 0.0,
+                'max': self.maximum,
+                'p50': self.percentile(0.5),
+                'p95': self.percentile(0.95),
+                'histogram': {'<%dus' % (1 << bucket): count
+                              for bucket, count in enumerate(self.histogram) if count}}
+
+
+def bucket_limit(bucket):
+    return (1 << bucket) / 1e6
+
+
+class Timer(object):
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock() if self.profiler.enabled else None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            self.profiler.record(self.name, clock() - self.start)
+
+
+class Profiler(object):
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.started = time.time()
+
+    def enable(self, state=True):
+        self.enabled = bool(state)
+
+    def record(self, name, elapsed):
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = Stat()
+            stat.add(elapsed)
+
+    def timer(self, name):
+        """Context manager timing its block under name"""
+        return Timer(self, name)
+
+    def wrap(self, fn, name):
+        """Times every call of fn under name
+
+        Calling a generator function does no work yet, so those are timed per
+        resumption instead: every item they yield, and the step finding there
+        are no more, counts as one call."""
+        if inspect.isgeneratorfunction(fn):
+            return self.wrap_generator(fn, name)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return fn(*args, **kwargs)
+            start = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(name, clock() - start)
+        wrapper.__profiled__ = fn
+        return wrapper
+
+    def wrap_generator(self, fn, name):
+        """Times fn per resumption while behaving like yield from: values sent, exceptions thrown and
+        close() reach the wrapped generator, so its finally blocks still run when the caller stops early"""
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            iterator = fn(*args, **kwargs)
+            sent, error = None, None
+            while True:
+                start = clock() if self.enabled else None
+                try:
+                    if error is not None:
+                        item = iterator.throw(error)
+                    elif sent is None:
+                        item = next(iterator)
+                    else:
+                        item = iterator.send(sent)
+                except StopIteration:
+                    return
+                finally:
+                    if start is not None:
+                        self.record(name, clock() - start)
+                sent, error = None, None
+                try:
+                    sent = yield item
+                except GeneratorExit:
+                    iterator.close()
+                    raise
+                except BaseException as e:
+                    error = e
+        wrapper.__profiled__ = fn
+        return wrapper
+
+    def timed(self, name):
+        """Decorator timing every call of the function under name"""
+        return lambda fn: self.wrap(fn, name)
+
+    def instrument(self, cls, names=None, prefix=None):
+        """Wraps the public methods of cls (or only names) in place
+
+        Static methods, class methods, plain methods and builtin callables
+        stored on the class (e.g. OpenMaya functions) are all handled.
+        Returns cls so it can be used as a class decorator."""
+        prefix = prefix or cls.__name__
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith('_') or (names is not None and attr not in names):
+                continue
+            if getattr(getattr(value, '__func__', value), '__profiled__', None) is not None:
+                continue
+            name = '%s.%s' % (prefix, attr)
+            if isinstance(value, staticmethod):
+                wrapped = staticmethod(self.wrap(value.__func__, name))
+            elif isinstance(value, classmethod):
+                wrapped = classmethod(self.wrap(value.__func__, name))
+            elif isinstance(value, types.FunctionType):
+                wrapped = self.wrap(value, name)
+            elif isinstance(value, (types.BuiltinFunctionType, types.BuiltinMethodType)):
+                wrapped = staticmethod(self.wrap(value, name))
+            else:
+                continue
+            setattr(cls, attr, wrapped)
+        return cls
+
+    def snapshot(self):
+        """Returns {name: stat dict} for everything recorded so far"""
+        with self.lock:
+            return {name: stat.as_dict() for name, stat in self.stats.items()}
+
+    def report(self):
+        return {'started': self.started,
+                'duration': time.time() - self.started,
+                'enabled': self.enabled,
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'stats': self.snapshot()}
+
+    def dump(self, path):
+        """Writes the report as JSON to path"""
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+        return path
+
+
+PROFILER = Profiler(enabled=os.environ.get(ENV_VAR, '') not in ('', '0'))
+timer = PROFILER.timer
+timed = PROFILER.timed
+instrument = PROFILER.instrument
@@ -0,0 +1,566 @@
+"""Out-of-process packing service
+
+A PackServer listens on a local socket (a Unix socket path on POSIX, a named
+pipe on Windows) and runs packing stages for any number of clients in a pool
+of worker processes, so heavy packs neither hold the DCC's GIL nor take the
+artist's session down when they crash. Only small control messages travel
+over the socket: arrays are written to memory-mapped .npy files in
+SHARED_DIR (/dev/shm where available) and mapped read-only on the other
+side. Jobs run concurrently and replies come back as soon as each finishes,
+resolving the PackFuture the client got when submitting. A worker process
+dying mid-pack fails its requests with a ServiceError instead of leaving the
+client waiting, and the pool is replaced for the requests that follow.
+Requests a client gave up on (e.g. superseded previews) are cancelled on
+the server as well: dropped while queued, stopped at the job's next
+cancellation check while running.
+
+The server needs Python 3 (concurrent.futures with start method contexts);
+the client runs anywhere the tool does.
+
+Start a server with ``uvpacker-service`` (or ``python -m uvpacker.service``)
+and point the tool at it with UVPACKER_PACK_SERVICE=<address>. Connections
+are authenticated with a per-user secret, taken from
+UVPACKER_PACK_SERVICE_KEY or generated once into KEY_FILE, which only the
+user can read, since control messages are unpickled. For tests,
+serve_in_process runs the same server on threads of the current process."""
+from __future__ import print_function
+
+import argparse
+import binascii
+import getpass
+import itertools
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import traceback
+import uuid
+from functools import partial
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from . import incremental, pipeline
+from .packing import OutOfSpaceError
+from .profiling import clock
+
+ADDRESS_ENV_VAR = 'UVPACKER_PACK_SERVICE'
+AUTHKEY_ENV_VAR = 'UVPACKER_PACK_SERVICE_KEY'
+KEY_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'uvpacker', 'service.key')
+SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+POLL_INTERVAL = 0.05
+OPERATIONS = {'pack_shells': pipeline.pack_shells,
+              'pack_instances': pipeline.pack_instances,
+              'repack_changed': incremental.repack_changed}
+
+
+class ServiceError(Exception):
+    pass
+
+
+class RequestCancelled(ServiceError):
+    pass
+
+
+def default_address():
+    if sys.platform == 'win32':
+        return r'\\.\pipe\uvpacker-%s' % getpass.getuser()
+    return os.path.join(tempfile.gettempdir(), 'uvpacker-%s.sock' % getpass.getuser())
+
+
+def default_authkey(path=KEY_FILE):
+    """Returns the per-user secret servers and clients authenticate each other with
+
+    UVPACKER_PACK_SERVICE_KEY wins when set, otherwise the key stored in path
+    is used, generated on first use with permissions for the user only."""
+    key = os.environ.get(AUTHKEY_ENV_VAR)
+    if key:
+        return key.encode('utf-8')
+    if not os.path.isfile(path):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+        handle, staging = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(binascii.hexlify(os.urandom(32)))
+            # Only the first process to get here publishes its key, the others read it
+            getattr(os, 'link', os.rename)(staging, path)
+        except OSError:
+            pass
+        finally:
+            if os.path.exists(staging):
+                os.remove(staging)
+    if os.name == 'posix' and os.stat(path).st_mode & 0o077:
+        raise ServiceError('%s must only be accessible by its owner (chmod 600)' % path)
+    with open(path, 'rb') as f:
+        return f.read().strip()
+
+
+def share(array):
+    """Copies array into a new shared .npy file and returns its path"""
+    array = np.ascontiguousarray(array)
+    path = os.path.join(SHARED_DIR, 'uvpacker-%d-%s.npy' % (os.getpid(), uuid.uuid4().hex))
+    if array.size:
+        shared = np.lib.format.open_memmap(path, mode='w+', dtype=array.dtype, shape=array.shape)
+        shared[...] = array
+        shared.flush()
+        del shared
+    else:
+        np.save(path, array)
+    return path
+
+
+def load_shared(path, copy=False):
+    """Maps a shared .npy file read-only, or copies it and removes the file"""
+    array = np.load(path, mmap_mode='r')
+    if not copy:
+        return array
+    array = np.array(array)
+    remove_shared([path])
+    return array
+
+
+def remove_shared(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def encode(value, paths):
+    """Replaces the arrays in a (nested tuple) value with references to shared copies"""
+    if isinstance(value, np.ndarray):
+        paths.append(share(value))
+        return {'shared': paths[-1]}
+    if isinstance(value, (tuple, list)):
+        return [encode(item, paths) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def decode(value, copy=False):
+    if isinstance(value, dict) and 'shared' in value:
+        return load_shared(value['shared'], copy)
+    if isinstance(value, list):
+        return tuple(decode(item, copy) for item in value)
+    return value
+
+
+class RequestJob(pipeline.NullJob):
+    """Job handle of a request on a pool worker, cancelled by the server creating its marker file"""
+
+    def __init__(self, marker=None):
+        self.marker = marker
+        self.checked = None
+
+    def check_cancelled(self):
+        now = clock()
+        if self.marker is None or (self.checked is not None and now - self.checked < POLL_INTERVAL):
+            return
+        self.checked = now
+        if os.path.exists(self.marker):
+            raise RequestCancelled('Request was cancelled by the client')
+
+
+def run_request(request):
+    """Runs one request on a pool worker and returns the reply to send back"""
+    paths = []
+    try:
+        job = RequestJob(request.get('marker'))
+        job.check_cancelled()
+        kwargs = dict((name, decode(value)) for name, value in request['kwargs'].items())
+        result = OPERATIONS[request['op']](job, **kwargs)
+        return {'id': request['id'], 'result': encode(result, paths), 'shared': paths}
+    except Exception as e:
+        remove_shared(paths)
+        return {'id': request['id'], 'error': traceback.format_exc(), 'out_of_space': isinstance(e, OutOfSpaceError),
+                'shared': []}
+
+
+class PackServer(object):
+    """Serves packing requests from any number of PackClients
+
+    address: Socket path (or pipe name on Windows), default_address() by default
+    processes: Worker processes running the jobs, defaults to the CPU count.
+               0 runs them on threads of this process instead
+    authkey: Secret clients must present, default_authkey() by default
+    threads: Size of the thread pool used when processes is 0"""
+
+    def __init__(self, address=None, processes=None, authkey=None, threads=2):
+        self.address = address or default_address()
+        self.processes = processes
+        self.threads = threads
+        self.authkey = authkey or default_authkey()
+        self.listener = None
+        self.executor = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.closed = False
+        self.connections = []
+
+    def start(self):
+        if self.address.startswith(os.sep) and os.path.exists(self.address):
+            os.remove(self.address)
+        self.listener = Listener(self.address, authkey=self.authkey)
+        if self.address.startswith(os.sep):
+            os.chmod(self.address, 0o600)
+        self.executor = self.create_executor()
+        self.thread = threading.Thread(target=self.accept_loop, name='uvpacker-service')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def create_executor(self):
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        if self.processes == 0:
+            return ThreadPoolExecutor(self.threads)
+        # Workers start once connections are open; forked ones would inherit them and keep clients from seeing EOF
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        return ProcessPoolExecutor(self.processes, mp_context=context)
+
+    def serve_forever(self):
+        self.start()
+        try:
+            while self.thread.is_alive():
+                self.thread.join(1.0)
+        finally:
+            self.close()
+
+    def accept_loop(self):
+        while not self.closed:
+            try:
+                connection = self.listener.accept()
+            except AuthenticationError:
+                continue
+            except (IOError, OSError, EOFError):
+                if self.closed:
+                    break
+                continue
+            if self.closed:
+                connection.close()
+                break
+            self.connections.append(connection)
+            thread = threading.Thread(target=self.handle, args=(connection,), name='uvpacker-service-connection')
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, connection):
+        lock = threading.Lock()
+        # {request id: (future, cancel marker)} of the requests still running or queued
+        pending = {}
+
+        def reply(message):
+            try:
+                with lock:
+                    connection.send(message)
+            except (IOError, OSError, ValueError):
+                # The client is gone, nobody will pick the results up
+                remove_shared(message.get('shared', []))
+
+        while not self.closed:
+            try:
+                request = connection.recv()
+            except (IOError, OSError, EOFError, TypeError):
+                # TypeError is what a connection closed under a blocking recv raises
+                break
+            if request.get('op') == 'close':
+                break
+            elif request.get('op') == 'cancel':
+                self.cancel(pending.get(request.get('target')))
+            elif request.get('op') == 'ping':
+                reply({'id': request['id'], 'result': 'pong', 'shared': []})
+            elif request.get('op') not in OPERATIONS:
+                reply({'id': request['id'], 'error': 'Unknown operation %s' % request.get('op'), 'shared': []})
+            else:
+                self.submit(request, reply, pending)
+        # Nobody is left to read the results of this connection's requests
+        for entry in list(pending.values()):
+            self.cancel(entry)
+        if connection in self.connections:
+            self.connections.remove(connection)
+        connection.close()
+
+    def submit(self, request, reply, pending):
+        with self.lock:
+            executor = self.executor
+        request['marker'] = os.path.join(SHARED_DIR, 'uvpacker-cancel-%s' % uuid.uuid4().hex)
+        try:
+            future = executor.submit(run_request, request)
+        except RuntimeError as e:
+            # The pool broke (or shut down) since the last request came in
+            self.replace_executor(executor)
+            reply(self.failure(request, e))
+            return
+        pending[request['id']] = (future, request['marker'])
+        future.add_done_callback(partial(self.request_done, request, reply, executor, pending))
+
+    @staticmethod
+    def cancel(entry):
+        """Drops a queued request, or tells a running one to stop at its next cancellation check"""
+        if entry is None:
+            return
+        future, marker = entry
+        if not future.cancel():
+            open(marker, 'w').close()
+            # Finishing in between means request_done may already have removed its marker, and nothing
+            # would remove this one. A future is done before its callbacks run, so this check covers it
+            if future.done():
+                remove_shared([marker])
+
+    def request_done(self, request, reply, executor, pending, future):
+        pending.pop(request['id'], None)
+        remove_shared([request['marker']])
+        if future.cancelled():
+            reply({'id': request['id'], 'error': 'Request was cancelled by the client', 'shared': []})
+            return
+        try:
+            message = future.result()
+        except Exception as e:
+            # BrokenProcessPool: a worker died (crash, OOM kill) taking every pending job with it
+            self.replace_executor(executor)
+            message = self.failure(request, e)
+        reply(message)
+
+    @staticmethod
+    def failure(request, error):
+        return {'id': request['id'], 'error': 'Packing worker failed: %s' % (error or type(error).__name__),
+                'shared': []}
+
+    def replace_executor(self, broken):
+        """Swaps a broken pool for a fresh one, once however many of its jobs report it"""
+        with self.lock:
+            if self.closed or self.executor is not broken:
+                return
+            self.executor = self.create_executor()
+        broken.shutdown(wait=False)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            # Wakes the accept loop up so it can see the server closed
+            Client(self.address, authkey=self.authkey).close()
+        except (IOError, OSError, EOFError):
+            pass
+        self.listener.close()
+        for connection in list(self.connections):
+            connection.close()
+        with self.lock:
+            stop_executor(self.executor)
+        if self.address.startswith(os.sep) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+def stop_executor(executor):
+    executor.shutdown(wait=False)
+    # Running packs cannot be interrupted, so their worker processes are terminated like Pool.terminate does
+    for process in list((getattr(executor, '_processes', None) or {}).values()):
+        process.terminate()
+
+
+class PackFuture(object):
+    """Result of a submitted request, resolved by the client's reader thread"""
+
+    def __init__(self, shared=None, cancel=None):
+        self.shared = shared or []
+        self.on_cancel = cancel
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def done(self):
+        return self.event.is_set()
+
+    def resolve(self, value=None, error=None):
+        with self.lock:
+            self.value, self.error = value, error
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, fn):
+        """Calls fn(future) once resolved, on the client's reader thread"""
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(fn)
+                return
+        fn(self)
+
+    def result(self, timeout=None):
+        if not self.event.wait(timeout):
+            raise ServiceError('Timed out waiting for the packing service')
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def cancel(self):
+        """Asks the server to drop or stop the request; the future still resolves with its reply"""
+        if self.on_cancel is not None and not self.done():
+            self.on_cancel()
+
+    def wait(self, job):
+        """Blocks a worker stage until resolved, polling job for cancellation
+
+        A cancelled job cancels the request on the server before raising"""
+        while not self.event.wait(POLL_INTERVAL):
+            try:
+                job.check_cancelled()
+            except Exception:
+                self.cancel()
+                raise
+        return self.result()
+
+
+class PackClient(object):
+    """Connection to a PackServer submitting requests and resolving their futures
+
+    Safe to share between threads."""
+
+    def __init__(self, address=None, authkey=None):
+        self.address = address or default_address()
+        try:
+            self.connection = Client(self.address, authkey=authkey or default_authkey())
+        except AuthenticationError:
+            raise ServiceError('Packing service at %s rejected the key, check %s or %s' %
+                               (self.address, AUTHKEY_ENV_VAR, KEY_FILE))
+        except (IOError, OSError, EOFError) as e:
+            raise ServiceError('Packing service at %s is unreachable: %s' % (self.address, e))
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.futures = {}
+        self.closed = False
+        self.reader = threading.Thread(target=self.read_loop, name='uvpacker-service-client')
+        self.reader.daemon = True
+        self.reader.start()
+
+    def submit(self, op, **kwargs):
+        """Sends op to the server, arrays in kwargs go through shared memory
+
+        Returns a PackFuture resolving to the operation's return value"""
+        shared = []
+        kwargs = dict((name, encode(value, shared)) for name, value in kwargs.items())
+        with self.lock:
+            if self.closed:
+                remove_shared(shared)
+                raise ServiceError('Packing service connection is closed')
+            request_id = next(self.ids)
+            future = self.futures[request_id] = PackFuture(shared, partial(self.cancel, request_id))
+            try:
+                self.connection.send({'id': request_id, 'op': op, 'kwargs': kwargs})
+            except (IOError, OSError, ValueError) as e:
+                self.futures.pop(request_id)
+                remove_shared(shared)
+                raise ServiceError('Packing service connection lost: %s' % e)
+        return future
+
+    def cancel(self, request_id):
+        with self.lock:
+            if self.closed or request_id not in self.futures:
+                return
+            try:
+                self.connection.send({'id': 0, 'op': 'cancel', 'target': request_id})
+            except (IOError, OSError, ValueError):
+                pass
+
+    def ping(self, timeout=5.0):
+        return self.submit('ping').result(timeout) == 'pong'
+
+    def pack_shells(self, job, bboxes, partial_every=0, **kwargs):
+        """pipeline.pack_shells running on the server, usable as a pack_fn
+
+        Partial layouts are not streamed back."""
+        return self.submit('pack_shells', bboxes=np.asarray(bboxes), **kwargs).wait(job)
+
+    def read_loop(self):
+        while True:
+            try:
+                reply = self.connection.recv()
+            except (IOError, OSError, EOFError, TypeError):
+                break
+            future = self.futures.pop(reply['id'], None)
+            if future is None:
+                remove_shared(reply.get('shared', []))
+                continue
+            remove_shared(future.shared)
+            if 'error' in reply:
+                error_class = OutOfSpaceError if reply.get('out_of_space') else ServiceError
+                future.resolve(error=error_class(reply['error']))
+            else:
+                future.resolve(decode(reply['result'], copy=True))
+
+        with self.lock:
+            self.closed = True
+            futures, self.futures = self.futures, {}
+        for future in futures.values():
+            remove_shared(future.shared)
+            future.resolve(error=ServiceError('Packing service connection lost'))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            try:
+                # The server hanging up is what unblocks the reader thread
+                self.connection.send({'id': 0, 'op': 'close'})
+            except (IOError, OSError, ValueError):
+                pass
+        self.reader.join(1.0)
+        self.connection.close()
+
+
+def temporary_address():
+    """Returns a fresh unique address, e.g. for servers started by tests"""
+    if hasattr(socket, 'AF_UNIX'):
+        return os.path.join(tempfile.gettempdir(), 'uvpacker-%s.sock' % uuid.uuid4().hex)
+    return r'\\.\pipe\uvpacker-%s' % uuid.uuid4().hex
+
+
+def serve_in_process(address=None, threads=2, authkey=None):
+    """Starts a PackServer running its jobs on threads of this process, for tests
+
+    authkey: Secret clients must present, a random one by default
+
+    Returns the started server, whose authkey clients connect with; call
+    close() when done"""
+    return PackServer(address or temporary_address(), processes=0, authkey=authkey or os.urandom(32),
+                      threads=threads).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='uvpacker-service', description=__doc__.splitlines()[0])
+    parser.add_argument('address', nargs='?', default=os.environ.get(ADDRESS_ENV_VAR) or default_address(),
+                        help='Socket path (named pipe on Windows) to listen on')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='Worker processes running jobs concurrently, defaults to the CPU count')
+    args = parser.parse_args(argv)
+    try:
+        authkey = default_authkey()
+    except (ServiceError, IOError, OSError) as e:
+        print('No key to authenticate clients with: %s' % e, file=sys.stderr)
+        return 1
+    server = PackServer(args.address, args.processes, authkey)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    print('Packing service listening on %s' % server.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
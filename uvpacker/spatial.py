@@ -0,0 +1,120 @@
+"""Spatial index over axis aligned rectangles for selection and framing queries"""
+import heapq
+import itertools
+from math import floor
+
+
+class GridIndex(object):
+    """Uniform grid spatial hash keeping rectangles bucketed per cell
+
+    With the cell size set to a fraction of a UDIM tile every tile maps to a
+    fixed block of cells, so rectangle queries only visit the cells they
+    overlap and their candidates instead of every stored rectangle.
+    Rectangles are (x, y, width, height) tuples and can be inserted, moved and
+    removed incrementally. Extents are tracked with lazily pruned heaps.
+
+    cell_size: Edge length of a grid cell
+    max_cells: Rectangles spanning more cells than this are kept in a small
+               overflow list that every query checks"""
+
+    def __init__(self, cell_size, max_cells=64):
+        self.cell_size = float(cell_size)
+        self.max_cells = max_cells
+        self.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def clear(self):
+        self.items = {}
+        self.cells = {}
+        self.item_cells = {}
+        self.oversized = set()
+        self.heaps = ([], [], [], [])
+        self.counter = itertools.count()
+
+    def cell_range(self, x0, y0, x1, y1):
+        size = self.cell_size
+        return int(floor(x0 / size)), int(floor(y0 / size)), int(floor(x1 / size)), int(floor(y1 / size))
+
+    def insert(self, key, rect):
+        """Adds key or moves it if it is already indexed"""
+        x, y, width, height = rect
+        bounds = (x, y, x + width, y + height)
+        if self.items.get(key) == bounds:
+            return
+        self.remove(key)
+        self.items[key] = bounds
+
+        cx0, cy0, cx1, cy1 = self.cell_range(*bounds)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > self.max_cells:
+            self.oversized.add(key)
+        else:
+            cells = [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+            for cell in cells:
+                self.cells.setdefault(cell, set()).add(key)
+            self.item_cells[key] = cells
+
+        for heap, value in zip(self.heaps, (bounds[0], bounds[1], -bounds[2], -bounds[3])):
+            heapq.heappush(heap, (value, next(self.counter), key))
+        if len(self.heaps[0]) > 4 * len(self.items) + 64:
+            self.rebuild_heaps()
+
+    def remove(self, key):
+        if self.items.pop(key, None) is None:
+            return
+        self.oversized.discard(key)
+        for cell in self.item_cells.pop(key, []):
+            bucket = self.cells[cell]
+            bucket.discard(key)
+            if not bucket:
+                del self.cells[cell]
+
+    def rebuild_heaps(self):
+        self.heaps = tuple([(sign * bounds[axis], next(self.counter), key) for key, bounds in self.items.items()]
+                           for axis, sign in enumerate((1, 1, -1, -1)))
+        for heap in self.heaps:
+            heapq.heapify(heap)
+
+    def candidates(self, x0, y0, x1, y1):
+        cx0, cy0, cx1, cy1 = self.cell_range(x0, y0, x1, y1)
+        found = set(self.oversized)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.cells):
+            for (cx, cy), bucket in self.cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    found.update(bucket)
+        else:
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    found.update(self.cells.get((cx, cy), ()))
+        return found
+
+    def query(self, rect, margin=0.0):
+        """Returns the keys of every rectangle intersecting rect"""
+        x, y, width, height = rect
+        x0, y0, x1, y1 = x - margin, y - margin, x + width + margin, y + height + margin
+        items = self.items
+        return [key for key in self.candidates(x0, y0, x1, y1)
+                if items[key][0] <= x1 and items[key][2] >= x0 and items[key][1] <= y1 and items[key][3] >= y0]
+
+    def query_point(self, x, y, margin=0.0):
+        return self.query((x, y, 0.0, 0.0), margin)
+
+    def extents(self):
+        """Returns the (x, y, width, height) union of all rectangles or None when empty"""
+        if not self.items:
+            return None
+        values = []
+        for axis, (sign, heap) in enumerate(zip((1, 1, -1, -1), self.heaps)):
+            while not self.is_current(heap[0], axis, sign):
+                heapq.heappop(heap)
+            values.append(sign * heap[0][0])
+        x0, y0, x1, y1 = values
+        return x0, y0, x1 - x0, y1 - y0
+
+    def is_current(self, entry, axis, sign):
+        bounds = self.items.get(entry[2])
+        return bounds is not None and sign * bounds[axis] == entry[0]
@@ -0,0 +1,106 @@
+from PySide2 import QtCore
+
+from .. import pipeline
+
+SORT_ROLE = QtCore.Qt.UserRole
+
+
+class UVDataModel(QtCore.QAbstractTableModel):
+    """Item model reading straight from the UI's uv_data store
+
+    Rows are transforms in insertion order. Nothing is copied into items:
+    callers report which keys were added, changed or removed and the model
+    emits the matching fine grained row signals, so an update costs
+    O(changed rows) and keeps the view's selection intact."""
+    COLUMN_NAME = 0
+    COLUMN_SHELLS = 1
+
+    def __init__(self, uv_data, headers, parent=None):
+        super(UVDataModel, self).__init__(parent)
+        self.uv_data = uv_data
+        self.headers = headers
+        self.keys = []
+        self.rows = {}
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.keys)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.headers[section]
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role not in (QtCore.Qt.DisplayRole, SORT_ROLE):
+            return None
+        key = self.keys[index.row()]
+        if index.column() == self.COLUMN_NAME:
+            return key
+        if index.column() == self.COLUMN_SHELLS:
+            shells = self.shell_count(key)
+            if role == SORT_ROLE:
+                return -1 if shells is None else shells
+            return '' if shells is None else str(shells)
+
+    def shell_count(self, key):
+        shapes = self.uv_data.get(key) or {}
+        counts = [shapes[shape].get(pipeline.SHELL_COUNT) for shape in shapes]
+        if not counts or None in counts:
+            return None
+        return sum(counts)
+
+    def key_index(self, key, column=0):
+        return self.index(self.rows[key], column)
+
+    def sync(self):
+        """Adds rows for keys new to the store and drops rows for keys that left it"""
+        self.remove_keys([key for key in self.keys if key not in self.uv_data])
+        self.insert_keys([key for key in self.uv_data if key not in self.rows])
+
+    def insert_keys(self, keys):
+        keys = [key for key in keys if key not in self.rows]
+        if not keys:
+            return
+        first = len(self.keys)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(keys) - 1)
+        for key in keys:
+            self.rows[key] = len(self.keys)
+            self.keys.append(key)
+        self.endInsertRows()
+
+    def remove_keys(self, keys):
+        rows = sorted((self.rows[key] for key in set(keys) if key in self.rows), reverse=True)
+        for first, last in self.row_ranges(rows):
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            del self.keys[first:last + 1]
+            self.endRemoveRows()
+        if rows:
+            self.rows = {key: row for row, key in enumerate(self.keys)}
+
+    def keys_changed(self, keys):
+        rows = sorted((self.rows[key] for key in set(keys) if key in self.rows), reverse=True)
+        last_column = len(self.headers) - 1
+        for first, last in self.row_ranges(rows):
+            self.dataChanged.emit(self.index(first, 0), self.index(last, last_column))
+
+    @staticmethod
+    def row_ranges(descending_rows):
+        """Groups descending row numbers into (first, last) contiguous ranges, last range first"""
+        ranges = []
+        for row in descending_rows:
+            if ranges and ranges[-1][0] == row + 1:
+                ranges[-1][0] = row
+            else:
+                ranges.append([row, row])
+        return [tuple(row_range) for row_range in ranges]
+
+
+class UVDataFilterModel(QtCore.QSortFilterProxyModel):
+    def __init__(self, parent=None):
+        super(UVDataFilterModel, self).__init__(parent)
+        self.setSortRole(SORT_ROLE)
+        self.setFilterKeyColumn(UVDataModel.COLUMN_NAME)
+        self.setFilterCaseSensitivity(QtCore.Qt.CaseInsensitive)
+        self.setDynamicSortFilter(True)
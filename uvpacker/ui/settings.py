@@ -1,4 +1,6 @@
-import uvpacker.plugins.pmaya as pmaya
+import os
+
+from uvpacker.plugins import LazyPlugin
 
 
 class Settings(object):
@@ -8,5 +10,18 @@ class Settings(object):
     HEIGHT = 30
     TOTAL_WIDTH = NUM_BLOCKS_X * WIDTH
     TOTAL_HEIGHT = NUM_BLOCKS_Y * HEIGHT
-    UV_STROKE_WIDTH = 0.01
-    PLUGIN = pmaya.MayaInterface()
+    UV_STROKE_PIXELS = 1.0
+    CHUNK_SIZE = 50
+    INDEX_CELLS_PER_TILE = 4
+    WIREFRAME_MAX_LINES = 50000
+    WIREFRAME_MIN_PIXELS = 0.75
+    UDIM_COLUMNS = 10
+    GRID_MIN_TILE_PIXELS = 4
+    GRID_LABEL_MIN_PIXELS = 48
+    TEXTURE_TILE_SIZE = 256
+    TEXTURE_CACHE_MB = 256
+    TEXTURE_THREADS = 2
+    UV_CACHE_DIR = os.environ.get('UVPACKER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'uvpacker'))
+    UV_CACHE_MB = 2048
+    PACK_SERVICE = os.environ.get('UVPACKER_PACK_SERVICE', '')
+    PLUGIN = LazyPlugin()
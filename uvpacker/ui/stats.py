@@ -0,0 +1,91 @@
+from PySide2 import QtCore, QtWidgets
+
+from ..profiling import PROFILER
+
+REFRESH_INTERVAL_MS = 1000
+
+
+class StatsPanel(QtWidgets.QWidget):
+    """Live table of the profiler's call counts and timings
+
+    Refreshes once a second while visible. Hovering a row shows its
+    duration histogram; Save writes the full report as JSON."""
+    HEADERS = ['Call', 'Count', 'Total ms', 'Mean ms', 'p95 ms', 'Max ms']
+
+    def __init__(self, parent=None):
+        super(StatsPanel, self).__init__(parent)
+        self.cb_enabled = QtWidgets.QCheckBox('Profile calls')
+        self.cb_enabled.setChecked(PROFILER.enabled)
+        self.b_reset = QtWidgets.QPushButton('Reset')
+        self.b_save = QtWidgets.QPushButton('Save JSON')
+
+        self.t_stats = QtWidgets.QTableWidget(0, len(self.HEADERS))
+        self.t_stats.setHorizontalHeaderLabels(self.HEADERS)
+        self.t_stats.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.t_stats.verticalHeader().setVisible(False)
+        self.t_stats.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addWidget(self.cb_enabled)
+        buttons.addStretch()
+        buttons.addWidget(self.b_reset)
+        buttons.addWidget(self.b_save)
+        layout = QtWidgets.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(buttons)
+        layout.addWidget(self.t_stats)
+        self.setLayout(layout)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(REFRESH_INTERVAL_MS)
+        self.timer.timeout.connect(self.refresh)
+
+        self.cb_enabled.toggled.connect(PROFILER.enable)
+        self.b_reset.clicked.connect(self.reset)
+        self.b_save.clicked.connect(self.save)
+
+    def showEvent(self, event):
+        self.cb_enabled.setChecked(PROFILER.enabled)
+        self.refresh()
+        self.timer.start()
+        super(StatsPanel, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super(StatsPanel, self).hideEvent(event)
+
+    def reset(self):
+        PROFILER.reset()
+        self.refresh()
+
+    def save(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Save profile', 'uvpacker_profile.json', 'JSON (*.json)')
+        if path:
+            PROFILER.dump(path)
+
+    def refresh(self):
+        stats = sorted(PROFILER.snapshot().items(), key=lambda item: item[1]['total'], reverse=True)
+        self.t_stats.setUpdatesEnabled(False)
+        self.t_stats.setRowCount(len(stats))
+        for row, (name, stat) in enumerate(stats):
+            values = [name, str(stat['count'])] + ['%.2f' % (stat[key] * 1e3) for key in ('total', 'mean', 'p95', 'max')]
+            tooltip = self.histogram_text(stat)
+            for column, value in enumerate(values):
+                item = self.t_stats.item(row, column)
+                if item is None:
+                    item = QtWidgets.QTableWidgetItem()
+                    self.t_stats.setItem(row, column, item)
+                item.setText(value)
+                item.setToolTip(tooltip)
+                if column:
+                    item.setTextAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        self.t_stats.setUpdatesEnabled(True)
+
+    @staticmethod
+    def histogram_text(stat, width=30):
+        """Text bar chart of a stat's histogram, one line per non empty bucket"""
+        buckets = sorted((int(label[1:-2]), count) for label, count in stat['histogram'].items())
+        peak = max([count for _, count in buckets] or [1])
+        return '\n'.join('< %8.3f ms  %s %d' % (limit / 1e3,
+                                                 '#' * max(int(round(width * count / float(peak))), 1), count)
+                         for limit, count in buckets)
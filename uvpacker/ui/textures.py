@@ -0,0 +1,277 @@
+import math
+import os
+from collections import OrderedDict
+
+from PySide2 import QtCore, QtGui
+
+from ..profiling import instrument
+from .settings import Settings
+from .workers import WorkerPool
+
+
+class LRUCache(object):
+    """Size bounded least recently used cache
+
+    max_cost: Total cost the cache may hold before evicting
+    cost: Callable returning the cost of a value"""
+
+    def __init__(self, max_cost, cost=lambda value: 1):
+        self.max_cost = max_cost
+        self.cost = cost
+        self.total_cost = 0
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        try:
+            value, cost = self.entries.pop(key)
+        except KeyError:
+            return default
+        self.entries[key] = (value, cost)
+        return value
+
+    def put(self, key, value):
+        self.discard(key)
+        cost = self.cost(value)
+        self.entries[key] = (value, cost)
+        self.total_cost += cost
+        while self.total_cost > self.max_cost and len(self.entries) > 1:
+            _, (_, evicted_cost) = self.entries.popitem(last=False)
+            self.total_cost -= evicted_cost
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_cost -= entry[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.total_cost = 0
+
+
+def pixmap_bytes(pixmap):
+    return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+
+def read_texture_tile(job, path, level, tile_x, tile_y, tile_size):
+    """Worker stage decoding one tile of one mip level of a texture
+
+    Only the clip rect is decoded, at the level's reduced size, for formats
+    whose QImageIOHandler supports it. Returns a QImage, which unlike QPixmap
+    is safe to create off the main thread."""
+    reader = QtGui.QImageReader(path)
+    size = reader.size()
+    step = tile_size << level
+    clip = QtCore.QRect(tile_x * step, tile_y * step, step, step).intersected(QtCore.QRect(QtCore.QPoint(0, 0), size))
+    job.check_cancelled()
+    reader.setClipRect(clip)
+    reader.setScaledSize(QtCore.QSize(max(clip.width() >> level, 1), max(clip.height() >> level, 1)))
+    image = reader.read()
+    if image.isNull():
+        raise IOError('Could not read %s: %s' % (path, reader.errorString()))
+    return image
+
+
+def read_texture_level(job, path, level):
+    """Worker stage decoding a whole mip level of a texture at once
+
+    Used for formats that cannot decode a clip rect (e.g. PNG), where reading
+    tile by tile would decode the full image again for every tile."""
+    reader = QtGui.QImageReader(path)
+    size = reader.size()
+    job.check_cancelled()
+    reader.setScaledSize(QtCore.QSize(max(size.width() >> level, 1), max(size.height() >> level, 1)))
+    image = reader.read()
+    if image.isNull():
+        raise IOError('Could not read %s: %s' % (path, reader.errorString()))
+    return image
+
+
+def texture_source(path):
+    """Returns the (path, mtime) pair cached pixmaps of a texture are keyed on"""
+    try:
+        return path, os.path.getmtime(path)
+    except OSError:
+        return path, None
+
+
+class TextureBackdrop(QtCore.QObject):
+    """Draws the textures assigned to UDIM tiles behind the UVs
+
+    Textures are split into Settings.TEXTURE_TILE_SIZE tiles per mip level.
+    Only the tiles covering the exposed area at the current zoom are
+    requested; they are decoded on worker threads and kept as pixmaps in an
+    LRU cache capped at Settings.TEXTURE_CACHE_MB, keyed on the texture's
+    path and mtime so a UDIM showing another texture never draws stale
+    tiles. Formats without clip rect decoding are read once per level and
+    sliced. Until a tile arrives the best coarser cached level is drawn in
+    its place."""
+    tile_ready = QtCore.Signal(QtCore.QRectF)
+
+    def __init__(self, parent=None):
+        super(TextureBackdrop, self).__init__(parent)
+        self.textures = {}
+        self.sources = {}
+        self.sizes = {}
+        self.clipped = {}
+        self.tile_size = Settings.TEXTURE_TILE_SIZE
+        self.cache = LRUCache(Settings.TEXTURE_CACHE_MB * 1024 * 1024, pixmap_bytes)
+        self.workers = WorkerPool(self, max_threads=Settings.TEXTURE_THREADS)
+        self.pending = set()
+
+    def set_textures(self, textures):
+        """Sets the {(u, v): path} UDIM tile textures to draw"""
+        if textures == self.textures:
+            return
+        sources = {tile: texture_source(path) for tile, path in textures.items()}
+        changed = set(tile for tile in set(sources) | set(self.sources) if sources.get(tile) != self.sources.get(tile))
+        for key in [key for key in self.pending if key[0] in changed]:
+            self.workers.cancel(self.job_key(key))
+            self.pending.discard(key)
+        self.textures = dict(textures)
+        self.sources = sources
+        live = set(sources.values())
+        for key in [key for key in self.cache.entries if key[0] not in live]:
+            self.cache.discard(key)
+        for tile in changed:
+            self.sizes.pop(tile, None)
+            self.clipped.pop(tile, None)
+            if tile not in sources:
+                continue
+            reader = QtGui.QImageReader(textures[tile])
+            size = reader.size()
+            if size.isValid():
+                self.sizes[tile] = size
+                self.clipped[tile] = reader.supportsOption(QtGui.QImageIOHandler.ClipRect)
+
+    def levels(self, tile):
+        size = self.sizes[tile]
+        return max(int(math.ceil(math.log(max(size.width(), size.height()) / float(self.tile_size), 2))), 0)
+
+    def level_for(self, tile, pixels_per_unit):
+        size = self.sizes[tile]
+        texels_per_pixel = max(size.width(), size.height()) / max(pixels_per_unit, 1e-6)
+        level = int(math.floor(math.log(max(texels_per_pixel, 1.0), 2)))
+        return min(level, self.levels(tile))
+
+    def tile_rects(self, tile, level):
+        """Yields (tile_x, tile_y, scene rect) for every image tile of a mip level"""
+        u, v = tile
+        size = self.sizes[tile]
+        step = self.tile_size << level
+        origin_x = u * Settings.WIDTH
+        origin_y = Settings.TOTAL_HEIGHT - (v + 1) * Settings.HEIGHT
+        scale_x = float(Settings.WIDTH) / size.width()
+        scale_y = float(Settings.HEIGHT) / size.height()
+        for tile_y in range(int(math.ceil(size.height() / float(step)))):
+            for tile_x in range(int(math.ceil(size.width() / float(step)))):
+                width = min(step, size.width() - tile_x * step)
+                height = min(step, size.height() - tile_y * step)
+                yield tile_x, tile_y, QtCore.QRectF(origin_x + tile_x * step * scale_x,
+                                                    origin_y + tile_y * step * scale_y,
+                                                    width * scale_x, height * scale_y)
+
+    def paint(self, painter, rect):
+        if not self.sizes:
+            return
+        pixels_per_unit = Settings.WIDTH * painter.worldTransform().m11()
+        wanted = set()
+        levels = {}
+        for tile in self.sizes:
+            u, v = tile
+            tile_rect = QtCore.QRectF(u * Settings.WIDTH, Settings.TOTAL_HEIGHT - (v + 1) * Settings.HEIGHT,
+                                      Settings.WIDTH, Settings.HEIGHT)
+            if not tile_rect.intersects(rect):
+                continue
+            level = levels[tile] = self.level_for(tile, pixels_per_unit)
+            for tile_x, tile_y, target in self.tile_rects(tile, level):
+                if not target.intersects(rect):
+                    continue
+                key = (tile, level, tile_x, tile_y)
+                pixmap = self.cache.get(self.cache_key(key))
+                if pixmap is None:
+                    wanted.add(key)
+                    pixmap, target = self.fallback(tile, level, tile_x, tile_y, target)
+                if pixmap is not None:
+                    painter.drawPixmap(target, pixmap, QtCore.QRectF(pixmap.rect()))
+        self.request(wanted, levels)
+
+    def fallback(self, tile, level, tile_x, tile_y, target):
+        """Finds a cached coarser level tile covering target and returns it cropped to target"""
+        for coarser in range(level + 1, self.levels(tile) + 1):
+            shift = coarser - level
+            parent = self.cache.get(self.cache_key((tile, coarser, tile_x >> shift, tile_y >> shift)))
+            if parent is None:
+                continue
+            size = self.tile_size >> shift
+            source = QtCore.QRect((tile_x - ((tile_x >> shift) << shift)) * size,
+                                  (tile_y - ((tile_y >> shift) << shift)) * size, size, size)
+            return parent.copy(source.intersected(parent.rect())), target
+        return None, target
+
+    def request(self, keys, levels):
+        """Queues missing tiles and drops pending ones made stale by a zoom level change"""
+        for key in [key for key in self.pending if key[0] in levels and key[1] != levels[key[0]]]:
+            self.workers.cancel(self.job_key(key))
+            self.pending.discard(key)
+        queued_levels = set(key[:2] for key in self.pending if not self.clipped[key[0]])
+        for key in keys - self.pending:
+            tile, level, tile_x, tile_y = key
+            self.pending.add(key)
+            source = self.sources[tile]
+            if self.clipped[tile]:
+                self.workers.submit(self.job_key(key), read_texture_tile,
+                                    args=(self.textures[tile], level, tile_x, tile_y, self.tile_size),
+                                    callback=lambda image, key=key, source=source: self.on_tile_loaded(
+                                        key, source, image),
+                                    errback=lambda error, key=key: self.pending.discard(key))
+            elif (tile, level) not in queued_levels:
+                # One decode serves every pending tile of the level
+                queued_levels.add((tile, level))
+                self.workers.submit(self.job_key(key), read_texture_level, args=(self.textures[tile], level),
+                                    callback=lambda image, tile=tile, level=level, source=source:
+                                        self.on_level_loaded(tile, level, source, image),
+                                    errback=lambda error, tile=tile, level=level: self.pending.difference_update(
+                                        [key for key in list(self.pending) if key[:2] == (tile, level)]))
+
+    def job_key(self, key):
+        (u, v), level, tile_x, tile_y = key
+        if not self.clipped.get((u, v), True):
+            return 'texture.%d.%d.%d' % (u, v, level)
+        return 'texture.%d.%d.%d.%d.%d' % (u, v, level, tile_x, tile_y)
+
+    def cache_key(self, key):
+        tile, level, tile_x, tile_y = key
+        return self.sources.get(tile), level, tile_x, tile_y
+
+    def on_tile_loaded(self, key, source, image):
+        self.pending.discard(key)
+        if self.sources.get(key[0]) != source:
+            return
+        self.store_tile(key, image)
+
+    def on_level_loaded(self, tile, level, source, image):
+        keys = [key for key in self.pending if key[:2] == (tile, level)]
+        self.pending.difference_update(keys)
+        if self.sources.get(tile) != source:
+            return
+        for key in keys:
+            _, _, tile_x, tile_y = key
+            clip = QtCore.QRect(tile_x * self.tile_size, tile_y * self.tile_size, self.tile_size, self.tile_size)
+            self.store_tile(key, image.copy(clip.intersected(image.rect())))
+
+    def store_tile(self, key, image):
+        self.cache.put(self.cache_key(key), QtGui.QPixmap.fromImage(image))
+        tile, level, tile_x, tile_y = key
+        for loaded_x, loaded_y, target in self.tile_rects(tile, level):
+            if (loaded_x, loaded_y) == (tile_x, tile_y):
+                self.tile_ready.emit(target)
+                break
+
+
+instrument(TextureBackdrop, names=('paint', 'on_tile_loaded', 'on_level_loaded'))
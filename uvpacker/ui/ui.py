@@ -1,15 +1,27 @@
 from functools import partial
 
 from maya.app.general.mayaMixin import MayaQWidgetDockableMixin
-from PySide2 import QtCore, QtGui, QtWidgets
+from PySide2 import QtCore, QtWidgets
 
+from .. import incremental, overlap, pipeline, service
+from ..cache import UVCache
+from ..layout import EXTENSION, Layout, LayoutError
+from ..profiling import instrument
 from .settings import Settings
-from .widgets import GridView, DeselectableListView
+from .models import UVDataModel, UVDataFilterModel
+from .stats import StatsPanel
+from .widgets import GridView, DeselectableTreeView
+from .workers import ChunkStream, WorkerPool
 
 dcc = Settings.PLUGIN
 
 
 class UVPackerUI(MayaQWidgetDockableMixin, QtWidgets.QWidget):
+    PROCESS_JOB = 'process_uv_data'
+    PREVIEW_JOB = 'preview_pack'
+    OVERLAP_JOB = 'find_overlaps'
+    DEDUPE_MODES = [('No instancing', None), ('Stack identical shells', 'stack'), ('Block identical shells', 'block')]
+
     def __init__(self):
         super(UVPackerUI, self).__init__()
         self.setSizePolicy(QtWidgets.QSizePolicy.Preferred,
@@ -26,12 +38,38 @@ class UVPackerUI(MayaQWidgetDockableMixin, QtWidgets.QWidget):
 
         self.callbacks = {}
         self.refresh_callbacks = [self.refresh_ui]
+        self.workers = WorkerPool(self)
+        self.extraction = ChunkStream(self)
+        self.extraction_total = 0
+        self.extracted_xforms = set()
+        self.chunk_count = 0
+        self.stream_framed = False
+        self.preview_result = None
+        self.preview_layout = None
+        self.committed_layout = None
+        self.pack_client = None
+        if Settings.UV_CACHE_DIR:
+            dcc.set_cache(UVCache(Settings.UV_CACHE_DIR, Settings.UV_CACHE_MB * 1024 * 1024))
 
         self.layout()
         self.connect()
+        self.connect_pack_service()
+
+    def connect_pack_service(self):
+        """Sends packs to the service at Settings.PACK_SERVICE, packing in process when it is unreachable"""
+        if not Settings.PACK_SERVICE:
+            return
+        try:
+            self.pack_client = service.PackClient(Settings.PACK_SERVICE)
+        except service.ServiceError as e:
+            self.pack_client = None
+            self.cb_preview.setToolTip('Packing service at %s is unavailable, packing in process: %s' %
+                                       (Settings.PACK_SERVICE, e))
+        else:
+            self.cb_preview.setToolTip('Packing through the service at %s' % Settings.PACK_SERVICE)
 
     def selected_row_labels(self):
-        return [row_index.data() for row_index in self.v_shapes_list.selectedIndexes()]
+        return [row_index.data() for row_index in self.v_shapes_list.selectionModel().selectedRows()]
     
     def selected_rows_uv_data(self):
         return {xform: self.uv_data.get(xform) for xform in self.selected_row_labels()}
@@ -54,24 +92,62 @@ class UVPackerUI(MayaQWidgetDockableMixin, QtWidgets.QWidget):
     def layout(self):
         self.g_layout = QtWidgets.QGridLayout()
 
-        self.v_shapes_list = DeselectableListView()
+        self.le_filter = QtWidgets.QLineEdit()
+        self.le_filter.setPlaceholderText('Filter shapes')
+
+        self.v_shapes_list = DeselectableTreeView()
         self.v_shapes_list.setWindowTitle('Shapes List')
         self.v_shapes_list.setMinimumSize(80, 250)
-        self.v_shapes_list.setSelectionMode(QtWidgets.QListView.MultiSelection)
+        self.v_shapes_list.setSelectionMode(QtWidgets.QAbstractItemView.MultiSelection)
 
-        self.i_transforms = QtGui.QStandardItemModel(self.v_shapes_list)
-        self.v_shapes_list.setModel(self.i_transforms)
+        self.i_transforms = UVDataModel(self.uv_data, self.headers, self.v_shapes_list)
+        self.i_transforms_filter = UVDataFilterModel(self.v_shapes_list)
+        self.i_transforms_filter.setSourceModel(self.i_transforms)
+        self.v_shapes_list.setModel(self.i_transforms_filter)
 
         self.b_get_shells = QtWidgets.QPushButton("Get UV Shells")
         self.b_update_uvs = QtWidgets.QPushButton("Get updated UVs")
+        self.cb_preview = QtWidgets.QCheckBox("Preview pack")
+        self.cmb_dedupe = QtWidgets.QComboBox()
+        for label, mode in self.DEDUPE_MODES:
+            self.cmb_dedupe.addItem(label, mode)
+        self.cb_texel_density = QtWidgets.QCheckBox("Normalize texel density")
+        self.cb_incremental = QtWidgets.QCheckBox("Keep unchanged placements")
+        self.cb_incremental.setToolTip('Only repack shells that changed since the last committed pack')
+        self.cb_incremental.setEnabled(False)
+        self.cb_texture = QtWidgets.QCheckBox("Show texture")
+        self.cb_overlaps = QtWidgets.QCheckBox("Show overlaps")
+        self.b_commit_pack = QtWidgets.QPushButton("Commit pack")
+        self.b_commit_pack.setEnabled(False)
+        self.b_export_layout = QtWidgets.QPushButton("Export layout")
+        self.b_export_layout.setEnabled(False)
+        self.b_import_layout = QtWidgets.QPushButton("Apply layout")
+        self.cb_stats = QtWidgets.QCheckBox("Show stats")
+        self.w_stats = StatsPanel()
+        self.w_stats.setVisible(False)
 
         self.pbar_progress = QtWidgets.QProgressBar()
+        self.b_cancel = QtWidgets.QPushButton("Cancel")
+        self.b_cancel.setEnabled(False)
         self.w_grid = GridView()
 
+        self.g_layout.addWidget(self.le_filter)
         self.g_layout.addWidget(self.v_shapes_list)
         self.g_layout.addWidget(self.pbar_progress)
+        self.g_layout.addWidget(self.b_cancel)
         self.g_layout.addWidget(self.b_get_shells)
         self.g_layout.addWidget(self.b_update_uvs)
+        self.g_layout.addWidget(self.cb_preview)
+        self.g_layout.addWidget(self.cmb_dedupe)
+        self.g_layout.addWidget(self.cb_texel_density)
+        self.g_layout.addWidget(self.cb_incremental)
+        self.g_layout.addWidget(self.cb_texture)
+        self.g_layout.addWidget(self.cb_overlaps)
+        self.g_layout.addWidget(self.b_commit_pack)
+        self.g_layout.addWidget(self.b_export_layout)
+        self.g_layout.addWidget(self.b_import_layout)
+        self.g_layout.addWidget(self.cb_stats)
+        self.g_layout.addWidget(self.w_stats)
 
         self.w_app = QtWidgets.QWidget()
         self.w_app.setLayout(self.g_layout)
@@ -86,10 +162,47 @@ class UVPackerUI(MayaQWidgetDockableMixin, QtWidgets.QWidget):
     def connect(self):
         self.b_get_shells.clicked.connect(self.ui_dirty)
         self.b_update_uvs.clicked.connect(self.update_changed_uvs)
+        self.b_cancel.clicked.connect(self.cancel_jobs)
+        self.le_filter.textChanged.connect(self.i_transforms_filter.setFilterFixedString)
+        self.cb_preview.toggled.connect(self.on_preview_toggled)
+        self.cmb_dedupe.currentIndexChanged.connect(self.request_preview)
+        self.cb_texel_density.toggled.connect(self.request_preview)
+        self.cb_incremental.toggled.connect(self.request_preview)
+        self.b_commit_pack.clicked.connect(self.commit_preview)
+        self.b_export_layout.clicked.connect(self.export_layout)
+        self.b_import_layout.clicked.connect(self.import_layout)
+        self.cb_stats.toggled.connect(self.w_stats.setVisible)
+        self.v_shapes_list.selectionModel().selectionChanged.connect(self.request_preview)
+        self.v_shapes_list.selectionModel().selectionChanged.connect(self.update_textures)
+        self.cb_texture.toggled.connect(self.update_textures)
+        self.v_shapes_list.selectionModel().selectionChanged.connect(self.request_overlaps)
+        self.cb_overlaps.toggled.connect(self.request_overlaps)
         self.v_shapes_list.clicked.connect(self.on_shapes_view_clicked)
         self.v_shapes_list.clear_selection.connect(
             self.w_grid.grid_scene.clear)
         self.v_shapes_list.clear_selection.connect(self.on_deselect_grid_view)
+        self.workers.progress.connect(self.on_job_progress)
+        self.workers.busy.connect(self.on_jobs_busy)
+        self.extraction.chunk.connect(self.on_extracted_chunk)
+        self.extraction.finished.connect(self.on_extraction_finished)
+        self.extraction.cancelled.connect(self.on_extraction_done)
+
+    def on_job_progress(self, key, value, maximum):
+        if self.extraction.is_running:
+            return
+        self.pbar_progress.setMaximum(maximum)
+        self.pbar_progress.setValue(value)
+
+    def on_jobs_busy(self, busy):
+        self.b_cancel.setEnabled(busy or self.extraction.is_running)
+        if not busy and not self.extraction.is_running:
+            self.pbar_progress.reset()
+
+    def cancel_jobs(self):
+        self.extraction.cancel()
+        self.workers.cancel_all()
+        self.clear_preview()
+        self.on_overlaps_found(None)
 
     def on_deselect_grid_view(self):
         self.selected_indices = []
@@ -99,17 +212,195 @@ class UVPackerUI(MayaQWidgetDockableMixin, QtWidgets.QWidget):
 
     def update_changed_uvs(self, *args):
         self.ui_dirty()
-        self.uv_data, self.uv_count = dcc.update_uv_data(self.uv_data)
-        self.w_grid.grid_scene.update_rect(self.uv_data)
-        self.w_grid.grid_scene.draw_uv_bboxes(self.selected_rows_uv_data())
-
-    def update_grid_view(self):
+        updated = dcc.update_uv_data(self.uv_data)
+        if updated:
+            self.uv_data, self.uv_count = updated
+            self.process_uv_data()
+
+    def process_uv_data(self, uv_data=None, key=None):
+        uv_data = self.uv_data if uv_data is None else uv_data
+        snapshot = {xform: {shape: dict(uv_data[xform][shape]) for shape in uv_data[xform]}
+                    for xform in uv_data}
+        self.workers.submit(key or self.PROCESS_JOB,
+                            pipeline.process_uv_data,
+                            args=(snapshot, Settings.WIDTH, Settings.TOTAL_HEIGHT),
+                            kwargs=dict(cache=dcc.cache, uv_key=dcc.uv_coords, faces_key=dcc.uv_faces,
+                                        bbox_key=dcc.bbox, mesh_key=dcc.mesh_faces),
+                            callback=self.on_uv_data_processed,
+                            errback=self.on_uv_data_failed)
+
+    @property
+    def is_streaming(self):
+        """Whether extracted chunks are still being read or processed"""
+        return self.extraction.is_running or self.workers.has_group(self.PROCESS_JOB)
+
+    def on_uv_data_processed(self, results):
+        for xform in results:
+            for shape in results[xform]:
+                try:
+                    self.uv_data[xform][shape].update(results[xform][shape])
+                except KeyError:
+                    pass
+        self.i_transforms.keys_changed(results)
+        if self.is_streaming:
+            # Chunks only redraw, the view is framed once and the selection wide jobs wait for the last chunk
+            self.update_grid_view(frame=not self.stream_framed)
+            self.stream_framed = True
+        else:
+            self.on_uv_data_settled()
+
+    def on_uv_data_failed(self, error):
+        if not self.is_streaming:
+            self.on_uv_data_settled()
+
+    def on_uv_data_settled(self):
+        self.update_grid_view()
+        self.request_preview()
+        self.request_overlaps()
+
+    def on_preview_toggled(self, enabled):
+        if enabled:
+            self.request_preview()
+        else:
+            self.workers.cancel(self.PREVIEW_JOB)
+            self.clear_preview()
+
+    def clear_preview(self):
+        self.preview_result = None
+        self.preview_layout = None
+        self.b_commit_pack.setEnabled(False)
+        self.b_export_layout.setEnabled(False)
+        self.w_grid.grid_scene.clear_preview()
+
+    def request_preview(self, *args):
+        if not self.cb_preview.isChecked():
+            return
+        self.b_commit_pack.setEnabled(False)
+        self.b_export_layout.setEnabled(False)
+        snapshot = self.selected_snapshot()
+        if not snapshot:
+            self.workers.cancel(self.PREVIEW_JOB)
+            self.clear_preview()
+            return
+        texel_density = self.cb_texel_density.isChecked()
+        weights = dcc.get_texel_weights([shape for xform in snapshot for shape in snapshot[xform]]) \
+            if texel_density else None
+        layout = self.committed_layout if self.cb_incremental.isChecked() else None
+        pack_fn = self.pack_client.pack_shells if self.pack_client else pipeline.pack_shells
+        self.workers.submit(self.PREVIEW_JOB,
+                            incremental.preview_pack,
+                            args=(snapshot, layout),
+                            kwargs=dict(uv_key=dcc.uv_coords, faces_key=dcc.uv_faces, rotations=True,
+                                        dedupe=self.cmb_dedupe.itemData(self.cmb_dedupe.currentIndex()),
+                                        texel_density=texel_density, weights=weights, pack_fn=pack_fn),
+                            callback=self.on_preview_done,
+                            errback=self.on_preview_failed,
+                            partial=self.on_preview_partial)
+
+    def selected_snapshot(self):
+        selected = self.selected_rows_uv_data()
+        return {xform: {shape: dict(selected[xform][shape]) for shape in selected[xform]}
+                for xform in selected if selected[xform]}
+
+    def request_overlaps(self, *args):
+        snapshot = self.selected_snapshot() if self.cb_overlaps.isChecked() else None
+        if not snapshot:
+            self.workers.cancel(self.OVERLAP_JOB)
+            self.on_overlaps_found(None)
+            return
+        self.workers.submit(self.OVERLAP_JOB,
+                            overlap.find_overlaps,
+                            args=(snapshot,),
+                            kwargs=dict(uv_key=dcc.uv_coords, faces_key=dcc.uv_faces),
+                            callback=self.on_overlaps_found)
+
+    def on_overlaps_found(self, result):
+        if result is None:
+            self.cb_overlaps.setText("Show overlaps")
+            self.w_grid.grid_scene.clear_overlaps()
+            return
+        shapes, bboxes, pairs, areas = result
+        self.cb_overlaps.setText("Show overlaps (%d)" % len(pairs))
+        self.cb_overlaps.setToolTip('%d overlapping shell pairs covering %.4f UV area' % (len(pairs), areas.sum()))
+        self.w_grid.grid_scene.draw_overlaps(bboxes, pairs)
+
+    def on_preview_partial(self, layout):
+        self.w_grid.grid_scene.draw_preview(*layout)
+
+    def on_preview_failed(self, error):
+        if isinstance(error, service.ServiceError) and self.pack_client is not None:
+            self.pack_client.close()
+            self.pack_client = None
+            self.cb_preview.setToolTip('Packing service failed, packing in process: %s' % error)
+            self.request_preview()
+
+    def on_preview_done(self, result):
+        bboxes, scale, offsets, packed, shapes, turns = result
+        self.w_grid.grid_scene.draw_preview(bboxes, scale, offsets)
+        self.preview_result = packed
+        self.preview_layout = (shapes, scale, offsets, turns)
+        self.b_commit_pack.setEnabled(bool(packed))
+        self.b_export_layout.setEnabled(bool(packed))
+
+    def commit_preview(self):
+        if not self.preview_result:
+            return
+        packed = self.preview_result
+        shapes, scale, offsets, turns = self.preview_layout
+        self.committed_layout = Layout.from_pack(self.uv_data, shapes, scale, offsets, turns=turns)
+        self.cb_incremental.setEnabled(True)
+        dcc.set_uv_data({shape: packed[xform][shape] for xform in packed for shape in packed[xform]})
+        self.clear_preview()
+        self.uv_data, self.uv_count = dcc.get_uv_data(list(packed), uv_data=self.uv_data)
+        self.process_uv_data()
+
+    def export_layout(self):
+        if not self.preview_layout:
+            return
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Export layout', 'layout' + EXTENSION,
+                                                        'UV layout (*%s)' % EXTENSION)
+        if path:
+            shapes, scale, offsets, turns = self.preview_layout
+            dcc.export_layout(path, Layout.from_pack(self.uv_data, shapes, scale, offsets, turns=turns))
+
+    def import_layout(self):
+        selected = {xform: shapes for xform, shapes in self.selected_rows_uv_data().items() if shapes}
+        if not selected:
+            return
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(self, 'Apply layout', '', 'UV layout (*%s)' % EXTENSION)
+        if not path:
+            return
+        try:
+            packed = dcc.import_layout(path, selected)
+        except (LayoutError, IOError) as e:
+            QtWidgets.QMessageBox.warning(self, 'Apply layout', str(e))
+            return
+        self.clear_preview()
+        self.uv_data, self.uv_count = dcc.get_uv_data(list(packed), uv_data=self.uv_data)
+        self.process_uv_data()
+
+    def update_textures(self, *args):
+        textures = {}
+        if self.cb_texture.isChecked():
+            selected = self.selected_rows_uv_data()
+            for xform in selected:
+                for shape in selected[xform] or []:
+                    for tile, path in dcc.get_texture_paths(shape).items():
+                        textures.setdefault(tile, path)
+        self.w_grid.grid_scene.set_textures(textures)
+
+    def update_grid_view(self, frame=True):
         self.w_grid.grid_scene.draw_uv_bboxes(self.selected_rows_uv_data())
-        self.w_grid.frame_items()
+        if frame:
+            self.w_grid.frame_items()
 
     def update_uv_data_from_transform(self, transform):
         self.uv_data, self.uv_count = dcc.get_uv_data([transform], uv_data=self.uv_data)
-        self.pbar_progress.reset()
+
+    def create_missing_callbacks(self, nodes):
+        for node in nodes:
+            if not self.callbacks.get(node):
+                self.create_node_callbacks(node)
 
     def register_refresh_callback(self, callback, *args, **kwargs):
         self.refresh_callbacks.append(partial(callback, *args, **kwargs))
@@ -119,19 +410,48 @@ class UVPackerUI(MayaQWidgetDockableMixin, QtWidgets.QWidget):
             callback()
 
     def refresh_ui(self):
-        for transform in dcc.get_selection(type=dcc.transform):
-            self.update_uv_data_from_transform(transform)
-        
-        self.i_transforms.clear()
-
-        for shape in self.uv_data:
-            if shape != 'uv_total':
-                item = QtGui.QStandardItem(shape)
-                self.i_transforms.appendRow(item)
-                if not self.callbacks.get(shape):
-                    self.create_node_callbacks(shape)
-
-        self.update_grid_view()
+        transforms = dcc.get_selection(type=dcc.transform)
+        self.extraction.cancel()
+        self.workers.cancel_group(self.PROCESS_JOB)
+
+        self.i_transforms.sync()
+
+        self.extraction_total = len(transforms)
+        self.extracted_xforms = set()
+        self.chunk_count = 0
+        self.stream_framed = False
+        self.pbar_progress.setMaximum(max(self.extraction_total, 1))
+        self.pbar_progress.setValue(0)
+        self.b_cancel.setEnabled(True)
+        self.extraction.start(dcc.iter_uv_data(transforms, chunk_size=Settings.CHUNK_SIZE))
+
+    def on_extracted_chunk(self, chunk):
+        chunk_data = {}
+        for xform, shape, shape_uv_data in chunk:
+            previous = self.uv_data.setdefault(xform, {}).get(shape)
+            if previous:
+                self.uv_count -= len(previous[dcc.uv])
+            self.uv_data[xform][shape] = shape_uv_data
+            self.uv_count += len(shape_uv_data[dcc.uv])
+            chunk_data.setdefault(xform, {})[shape] = shape_uv_data
+            self.extracted_xforms.add(xform)
+
+        self.i_transforms.insert_keys(chunk_data)
+        self.i_transforms.keys_changed(chunk_data)
+        self.create_missing_callbacks(chunk_data)
+
+        self.chunk_count += 1
+        self.process_uv_data(chunk_data, key='%s.%d' % (self.PROCESS_JOB, self.chunk_count))
+        self.pbar_progress.setValue(len(self.extracted_xforms))
+
+    def on_extraction_finished(self):
+        # The last chunk may already be processed, then nothing else settles the stream
+        if not self.workers.has_group(self.PROCESS_JOB):
+            self.on_uv_data_settled()
+        self.on_extraction_done()
+
+    def on_extraction_done(self):
+        self.on_jobs_busy(self.workers.is_busy)
 
     def create_node_callbacks(self, node):
         api_object = dcc.get_api_object(node)
@@ -143,11 +463,30 @@ class UVPackerUI(MayaQWidgetDockableMixin, QtWidgets.QWidget):
                                 dcc.delete_callback(api_object, deleted_callback)]
 
     def remove_node_callbacks(self, nodes):
-        dcc.remove_callbacks([callback for node in nodes for callback in self.callbacks[node]])
+        dcc.remove_callbacks([callback for node in nodes for callback in self.callbacks.pop(node, [])])
+
+    def remove_node_callback(self, node):
+        self.remove_node_callbacks([node])
+        for shape_uv_data in (self.uv_data.pop(node, None) or {}).values():
+            self.uv_count -= len(shape_uv_data[dcc.uv])
+        self.i_transforms.remove_keys([node])
+        self.update_grid_view()
 
     def closeEvent(self, event):
-        self.remove_node_callbacks(self.callbacks.keys())
+        self.cancel_jobs()
+        self.remove_node_callbacks(list(self.callbacks))
+        if self.pack_client is not None:
+            self.pack_client.close()
         try:
             super(UVPackerUI, self).closeEvent(event)
         except TypeError:
             pass
+
+
+instrument(UVPackerUI, prefix='ui', names=('update_changed_uvs', 'process_uv_data', 'on_uv_data_processed',
+                                           'request_preview', 'on_preview_partial', 'on_preview_done',
+                                           'request_overlaps', 'on_overlaps_found',
+                                           'commit_preview', 'export_layout', 'import_layout',
+                                           'update_textures', 'update_grid_view', 'update_uv_data_from_transform',
+                                           'refresh_ui', 'on_extracted_chunk', 'create_node_callbacks',
+                                           'remove_node_callback'))
@@ -1,5 +1,10 @@
+import numpy as np
 from PySide2 import QtCore, QtGui, QtWidgets
-from settings import Settings
+from .settings import Settings
+from .. import pipeline
+from ..profiling import instrument
+from ..spatial import GridIndex
+from .textures import LRUCache, TextureBackdrop
 
 dcc = Settings.PLUGIN
 
@@ -7,26 +12,311 @@ ACTIVE_FILL_COLOR = QtGui.QColor(5, 200, 10, 25)
 INACTIVE_FILL_COLOR = QtGui.QColor(200, 100, 150, 25)
 UV_STROKE_COLOR = QtGui.QColor(200, 200, 200, 80)
 GRID_STROKE_COLOR = QtGui.QColor(250, 250, 250, 40)
+WIREFRAME_STROKE_COLOR = QtGui.QColor(120, 180, 255, 120)
+GRID_LABEL_COLOR = QtGui.QColor(250, 250, 250, 140)
+OCCUPIED_TILE_COLOR = QtGui.QColor(90, 140, 220, 60)
+PREVIEW_FILL_COLOR = QtGui.QColor(255, 190, 40, 45)
+OVERLAP_FILL_COLOR = QtGui.QColor(255, 40, 40, 90)
+
+
+class RenderState(object):
+    """Pens, brushes and zoom shared by every item of a GridScene
+
+    Pens are cosmetic so strokes keep their pixel width at any zoom without
+    items being touched, and every color maps to one shared pen and brush.
+    Zooming only updates pixel_size, the scene size of a device pixel that
+    hit-testing tolerances derive from."""
+
+    def __init__(self):
+        self.stroke_pixels = Settings.UV_STROKE_PIXELS
+        self.pixel_size = 1.0
+        self.pens = {}
+        self.brushes = {}
+
+    def pen(self, color):
+        pen = self.pens.get(color.rgba())
+        if pen is None:
+            pen = self.pens[color.rgba()] = QtGui.QPen(color, self.stroke_pixels, QtCore.Qt.SolidLine)
+            pen.setCosmetic(True)
+        return pen
+
+    def brush(self, color):
+        brush = self.brushes.get(color.rgba())
+        if brush is None:
+            brush = self.brushes[color.rgba()] = QtGui.QBrush(color)
+        return brush
+
+    def set_zoom(self, transform):
+        self.pixel_size = 1.0 / max(abs(transform.m11()), 1e-12)
+
+    def hit_margin(self):
+        """Half a stroke in scene units at the current zoom"""
+        return self.stroke_pixels * 0.5 * self.pixel_size
+
+
+class QBatchedRects(QtWidgets.QGraphicsItem):
+    """Single scene item painting every UV bbox from an (n, 4) x/y/w/h array
+
+    Rows are keyed by shape name. Updates only touch the rows whose values
+    changed, painting culls to the exposed rect and issues one drawRects call
+    per fill state, and hit-testing goes through a GridIndex kept in sync
+    with the rows. Pens and brushes come from the RenderState, so neither
+    zooming nor selecting touches rows that did not change."""
+
+    def __init__(self, parent=None, fill_color=INACTIVE_FILL_COLOR, active_color=ACTIVE_FILL_COLOR,
+                 render_state=None):
+        super(QBatchedRects, self).__init__(parent)
+        self.keys = []
+        self.rows = {}
+        self.rects = np.zeros((0, 4), dtype=np.float64)
+        self.selected = np.zeros(0, dtype=bool)
+        self.qrects = []
+        self.bounds = QtCore.QRectF()
+        self.index = GridIndex(float(Settings.WIDTH) / Settings.INDEX_CELLS_PER_TILE)
+        self.tile_counts = {}
+        self.render_state = render_state or RenderState()
+        self.colors = {False: fill_color, True: active_color}
+        self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def set_rects(self, rects):
+        """Adds or updates rows from a {key: (x, y, width, height)} mapping"""
+        if not rects:
+            return
+        new_keys = [key for key in rects if key not in self.rows]
+        if new_keys:
+            for key in new_keys:
+                self.rows[key] = len(self.keys)
+                self.keys.append(key)
+                self.qrects.append(None)
+            self.rects = np.concatenate([self.rects, np.full((len(new_keys), 4), np.nan)])
+            self.selected = np.concatenate([self.selected, np.zeros(len(new_keys), dtype=bool)])
+
+        keys = list(rects)
+        rows = np.array([self.rows[key] for key in keys], dtype=np.int64)
+        values = np.array([rects[key] for key in keys], dtype=np.float64).reshape(-1, 4)
+        changed = np.any(self.rects[rows] != values, axis=1)
+        if not changed.any():
+            return
+
+        rows, values = rows[changed], values[changed]
+        self.count_tiles(self.rects[rows], -1)
+        self.count_tiles(values, 1)
+        self.rects[rows] = values
+        for row, (x, y, width, height) in zip(rows, values):
+            self.qrects[row] = QtCore.QRectF(x, y, width, height)
+            self.index.insert(self.keys[row], (x, y, width, height))
+        self.update_bounds()
+
+    def remove(self, keys):
+        rows = [self.rows[key] for key in keys if key in self.rows]
+        if not rows:
+            return
+        keep = np.ones(len(self.keys), dtype=bool)
+        keep[rows] = False
+        for row in rows:
+            self.index.remove(self.keys[row])
+        self.count_tiles(self.rects[rows], -1)
+        self.keys = [key for key, kept in zip(self.keys, keep) if kept]
+        self.qrects = [rect for rect, kept in zip(self.qrects, keep) if kept]
+        self.rects = self.rects[keep]
+        self.selected = self.selected[keep]
+        self.rows = {key: row for row, key in enumerate(self.keys)}
+        self.update_bounds()
 
-
-class QStrokeRect(QtWidgets.QGraphicsRectItem):
-    def __init__(self, parent=None):
-        super(QStrokeRect, self).__init__(parent)
-        self.strokeWidth = Settings.UV_STROKE_WIDTH
-        self.setPen(QtGui.QPen(UV_STROKE_COLOR, 0, QtCore.Qt.SolidLine))
-        self.setFlags(QtWidgets.QGraphicsItem.ItemIsSelectable)
-        self.brush = QtGui.QBrush(INACTIVE_FILL_COLOR)
-        self.setBrush(self.brush)
-
-    def setStrokeWidth(self, strokeWidth):
-        self.strokeWidth = strokeWidth
-
-    def shape(self):
-        path = QtGui.QPainterPath()
-        path.addRect(self.boundingRect())
-        pStroker = QtGui.QPainterPathStroker()
-        pStroker.setWidth(self.strokeWidth)
-        return pStroker.createStroke(path)
+    def clear(self):
+        self.remove(list(self.keys))
+
+    def count_tiles(self, rects, increment):
+        """Tracks how many rects have their centre in each (u, v) UV tile"""
+        rects = rects[~np.isnan(rects).any(axis=1)]
+        us = np.floor((rects[:, 0] + rects[:, 2] * 0.5) / Settings.WIDTH).astype(np.int64)
+        vs = np.floor((Settings.TOTAL_HEIGHT - rects[:, 1] - rects[:, 3] * 0.5) / Settings.HEIGHT).astype(np.int64)
+        for tile in zip(us.tolist(), vs.tolist()):
+            count = self.tile_counts.get(tile, 0) + increment
+            if count > 0:
+                self.tile_counts[tile] = count
+            else:
+                self.tile_counts.pop(tile, None)
+
+    def update_bounds(self):
+        self.prepareGeometryChange()
+        extents = self.extents()
+        self.bounds = extents if extents is not None else QtCore.QRectF()
+        self.update()
+
+    def extents(self):
+        extents = self.index.extents()
+        if extents is None:
+            return None
+        return QtCore.QRectF(*extents)
+
+    def keys_in_rect(self, rect, margin=0.0):
+        return self.index.query((rect.x(), rect.y(), rect.width(), rect.height()), margin)
+
+    def rows_in_rect(self, rect, margin=0.0):
+        if rect.contains(self.bounds):
+            return np.arange(len(self.keys))
+        return np.sort(np.array([self.rows[key] for key in self.keys_in_rect(rect, margin)], dtype=np.int64))
+
+    def keys_at(self, point):
+        return self.index.query_point(point.x(), point.y(), self.render_state.hit_margin())
+
+    def set_selected(self, keys):
+        """Selects exactly keys, repainting only the area of the rows that flipped"""
+        selected = np.zeros(len(self.keys), dtype=bool)
+        selected[[self.rows[key] for key in keys if key in self.rows]] = True
+        changed = self.rects[selected != self.selected]
+        self.selected = selected
+        changed = changed[~np.isnan(changed).any(axis=1)]
+        if len(changed):
+            mins = changed[:, :2].min(axis=0)
+            maxs = (changed[:, :2] + changed[:, 2:]).max(axis=0)
+            self.update(QtCore.QRectF(mins[0], mins[1], maxs[0] - mins[0], maxs[1] - mins[1]))
+
+    def boundingRect(self):
+        # Cosmetic strokes overhang by a pixel at most, which the view's exposed rect margin covers
+        return self.bounds
+
+    def paint(self, painter, option, widget=None):
+        if not len(self.keys):
+            return
+        visible = self.rows_in_rect(option.exposedRect)
+        painter.setPen(self.render_state.pen(UV_STROKE_COLOR))
+        for state in (False, True):
+            rows = visible[self.selected[visible] == state]
+            if len(rows):
+                painter.setBrush(self.render_state.brush(self.colors[state]))
+                painter.drawRects([self.qrects[row] for row in rows])
+
+
+class QUVWireframe(QtWidgets.QGraphicsItem):
+    """UV edge layer drawn with batched drawLines calls and level of detail
+
+    Per shape segment arrays are built once by the worker pipeline. They are
+    regrouped by shell and the shell bboxes go into a GridIndex, so paint only
+    gathers the segments of shells intersecting the exposed rect, and drops
+    sub-pixel edges. When that still exceeds Settings.WIREFRAME_MAX_LINES only
+    the shell outlines are drawn, then only the shell bboxes, which are always
+    drawn. Culled lines are cached per level and exposed rect."""
+
+    def __init__(self, parent=None, render_state=None):
+        super(QUVWireframe, self).__init__(parent)
+        self.shapes = {}
+        self.levels = None
+        self.bounds = QtCore.QRectF()
+        self.index = GridIndex(float(Settings.WIDTH) / Settings.INDEX_CELLS_PER_TILE)
+        self.lines = LRUCache(Settings.WIREFRAME_MAX_LINES * 4, cost=lambda entry: len(entry[1]))
+        self.render_state = render_state or RenderState()
+        self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def set_shapes(self, shapes):
+        """Sets the {shape: (wireframe, shell_bboxes)} data to draw, only rebuilding on change"""
+        if set(shapes) == set(self.shapes) and all(shapes[key][0] is self.shapes[key][0] for key in shapes):
+            return
+        self.prepareGeometryChange()
+        self.shapes = dict(shapes)
+        self.levels = None
+        self.lines.clear()
+        self.bounds = QtCore.QRectF()
+        segments = [wireframe['segments'] for wireframe, _ in self.shapes.values() if len(wireframe['segments'])]
+        if segments:
+            segments = np.concatenate(segments)
+            mins = np.minimum(segments[:, :2], segments[:, 2:]).min(axis=0)
+            maxs = np.maximum(segments[:, :2], segments[:, 2:]).max(axis=0)
+            self.bounds = QtCore.QRectF(mins[0], mins[1], maxs[0] - mins[0], maxs[1] - mins[1])
+        self.update()
+
+    def build_levels(self):
+        """Sorts each level's segments by shell, with the (n + 1) starts of every shell's rows, and indexes
+        the shell bboxes"""
+        shapes = list(self.shapes.values())
+        bboxes = [np.asarray(bboxes, dtype=np.float64).reshape(-1, 2, 2) for _, bboxes in shapes]
+        offsets = np.cumsum([0] + [len(shell_bboxes) for shell_bboxes in bboxes])
+        bboxes = np.concatenate(bboxes) if bboxes else np.zeros((0, 2, 2))
+        rects = np.column_stack([bboxes[:, 0, 0] * Settings.WIDTH,
+                                 Settings.TOTAL_HEIGHT - bboxes[:, 1, 1] * Settings.WIDTH,
+                                 (bboxes[:, 0, 1] - bboxes[:, 0, 0]) * Settings.WIDTH,
+                                 (bboxes[:, 1, 1] - bboxes[:, 1, 0]) * Settings.WIDTH])
+        levels = []
+        for segments_key, shells_key in (('segments', 'shells'), ('outline', 'outline_shells')):
+            if shapes:
+                segments = np.concatenate([wireframe[segments_key] for wireframe, _ in shapes])
+                shells = np.concatenate([np.asarray(wireframe[shells_key], dtype=np.int64) + offset
+                                         for (wireframe, _), offset in zip(shapes, offsets)])
+            else:
+                segments, shells = np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.int64)
+            order = np.argsort(shells, kind='stable')
+            levels.append((segments[order], np.searchsorted(shells[order], np.arange(len(rects) + 1))))
+        self.index.clear()
+        for shell, rect in enumerate(rects.tolist()):
+            self.index.insert(shell, rect)
+        self.levels = (levels[0], levels[1], rects)
+
+    def visible_shells(self, rect, min_length):
+        """Returns the sorted ids of the shells intersecting rect that are at least min_length across"""
+        shells = np.array(sorted(self.index.query((rect.x(), rect.y(), rect.width(), rect.height()))),
+                          dtype=np.int64)
+        if min_length and len(shells):
+            rects = self.levels[2][shells]
+            shells = shells[np.maximum(rects[:, 2], rects[:, 3]) >= min_length]
+        return shells
+
+    @staticmethod
+    def gather_segments(level, shells):
+        segments, starts = level
+        if not len(shells):
+            return segments[:0]
+        return np.concatenate([segments[start:end] for start, end in zip(starts[shells].tolist(),
+                                                                        starts[shells + 1].tolist())])
+
+    @staticmethod
+    def cull_segments(segments, rect, min_length):
+        x0, y0, x1, y1 = rect.left(), rect.top(), rect.right(), rect.bottom()
+        lo = np.minimum(segments[:, :2], segments[:, 2:])
+        hi = np.maximum(segments[:, :2], segments[:, 2:])
+        visible = (lo[:, 0] <= x1) & (hi[:, 0] >= x0) & (lo[:, 1] <= y1) & (hi[:, 1] >= y0)
+        if min_length:
+            visible &= (hi - lo).max(axis=1) >= min_length
+        return segments[visible]
+
+    def boundingRect(self):
+        return self.bounds
+
+    def paint(self, painter, option, widget=None):
+        if not self.shapes:
+            return
+        if self.levels is None:
+            self.build_levels()
+        segments, outline, rects = self.levels
+
+        lod = option.levelOfDetailFromTransform(painter.worldTransform())
+        min_length = Settings.WIREFRAME_MIN_PIXELS / lod if lod else 0
+        exposed = option.exposedRect
+        painter.setPen(self.render_state.pen(WIREFRAME_STROKE_COLOR))
+        painter.setBrush(QtCore.Qt.NoBrush)
+
+        shells = None
+        view_key = (exposed.x(), exposed.y(), exposed.width(), exposed.height(), min_length)
+        for level_id, level in enumerate((segments, outline)):
+            entry = self.lines.get((level_id,) + view_key)
+            if entry is None:
+                if shells is None:
+                    shells = self.visible_shells(exposed, min_length)
+                lines = self.cull_segments(self.gather_segments(level, shells), exposed, min_length)
+                fits = len(lines) <= Settings.WIREFRAME_MAX_LINES
+                entry = (fits, [QtCore.QLineF(*line) for line in lines.tolist()] if fits else [])
+                self.lines.put((level_id,) + view_key, entry)
+            fits, lines = entry
+            if fits:
+                painter.drawLines(lines)
+                return
+
+        if shells is None:
+            shells = self.visible_shells(exposed, min_length)
+        painter.drawRects([QtCore.QRectF(*rect) for rect in rects[shells].tolist()])
 
 
 class GridView(QtWidgets.QGraphicsView):
@@ -43,7 +333,6 @@ class GridView(QtWidgets.QGraphicsView):
         self.setScene(self.grid_scene)
         self.setFixedSize(Settings.WIDTH * Settings.NUM_BLOCKS_X,
                           Settings.HEIGHT * Settings.NUM_BLOCKS_Y)
-        self.setSceneRect(0, 0, Settings.TOTAL_WIDTH, Settings.TOTAL_HEIGHT)
         self.origin = None
         self.canZoom = True
         self.canPan = True
@@ -63,11 +352,16 @@ class GridView(QtWidgets.QGraphicsView):
 
     def resizeEvent(self, event):
         if self.initial_fit:
-            self.fitInView(self.grid_scene.sceneRect(),
+            self.fitInView(self.grid_scene.default_rect(),
                            QtCore.Qt.KeepAspectRatio)
             self.initial_fit = False
+            self.sync_zoom()
         super(GridView, self).resizeEvent(event)
 
+    def sync_zoom(self):
+        """Hands the current zoom to the scene's RenderState, the only per zoom update"""
+        self.grid_scene.render_state.set_zoom(self.transform())
+
     @property
     def alt_pressed(self):
         modifiers = QtWidgets.QApplication.keyboardModifiers()
@@ -86,6 +380,7 @@ class GridView(QtWidgets.QGraphicsView):
         adjustment = Settings.TOTAL_HEIGHT / Settings.NUM_BLOCKS_X
         items_rect.adjust(-adjustment, -adjustment, adjustment, adjustment)
         self.fitInView(items_rect, self.aspectRatioMode)
+        self.sync_zoom()
 
     def mousePressEvent(self, event):
         if self.alt_pressed:
@@ -121,20 +416,14 @@ class GridView(QtWidgets.QGraphicsView):
 
     def updateViewer(self):
         if len(self.zoomStack) and self.sceneRect().contains(self.zoomStack[-1]):
-            previous_viewport_size = self.visibleRect
             # Show zoomed rect (ignore aspect ratio).
             self.fitInView(self.zoomStack[-1], self.aspectRatioMode)
-            if self.grid_scene.rects:
-                adjusted_viewport_size = self.visibleRect
-                scale_value = adjusted_viewport_size.width() / previous_viewport_size.width()
-                self.grid_scene.set_rect_widths(
-                    self.grid_scene.get_rect_widths() * scale_value)
-
         else:
             # Clear the zoom stack (in case we got here because of an invalid zoom).
             self.zoomStack = []
             # Show entire image (use current aspect ratio mode).
-            self.fitInView(self.sceneRect(), self.aspectRatioMode)
+            self.fitInView(self.grid_scene.default_rect(), self.aspectRatioMode)
+        self.sync_zoom()
 
     def zoom_press(self, press_event):
         scene_pos = self.mapToScene(press_event.pos())
@@ -173,28 +462,20 @@ class GridView(QtWidgets.QGraphicsView):
         self.rubber_band.setGeometry(QtCore.QRect(self.origin, QtCore.QSize()))
         self.rubber_band.show()
 
-    def toggle_rects(self, rects, select=True):
-        color = INACTIVE_FILL_COLOR
-        if select:
-            color = ACTIVE_FILL_COLOR
-
-        for rect in rects:
-            rect.setBrush(QtGui.QBrush(color))
-            rect.update()
+    def toggle_rects(self, shapes):
+        self.grid_scene.bbox_item.set_selected(shapes)
 
     def rubberband_release(self, release_event):
         if self.rubber_band.isVisible():
             self.rubber_band.hide()
-            self.toggle_rects(self.grid_scene.rects, select=False)
-            rect = self.mapToScene(
-                self.rubber_band.geometry()).boundingRect().toRect()
-
-            selected_shapes = [shape for shape in self.grid_scene.bboxes if rect.intersects(
-                self.grid_scene.bboxes[shape].sceneBoundingRect().toRect())]
+            selected_shapes = self.rubberband_shapes()
 
             dcc.set_selection([shape+'.map[:]' for shape in selected_shapes])
-            self.toggle_rects([self.grid_scene.rects.bboxes[shape]
-                               for shape in selected_shapes])
+            self.toggle_rects(selected_shapes)
+
+    def rubberband_shapes(self):
+        rect = self.mapToScene(self.rubber_band.geometry()).boundingRect()
+        return self.grid_scene.bbox_item.keys_in_rect(rect)
 
     def rubberband_move(self, move_event):
         if self.rubber_band.isVisible():
@@ -208,121 +489,214 @@ class GridView(QtWidgets.QGraphicsView):
             selection_rect.setHeight(abs(point.y() - self.origin.y()))
 
             self.rubber_band.setGeometry(selection_rect)
+            self.toggle_rects(self.rubberband_shapes())
             move_event.accept()
         return QtWidgets.QGraphicsView.mouseMoveEvent(self, move_event)
 
 
 class GridScene(QtWidgets.QGraphicsScene):
-    RECT = 'RECT'
-
     def __init__(self, *args, **kwargs):
         super(GridScene, self).__init__(*args, **kwargs)
-        self.lines = []
-        self.bboxes = {}
+        self.grid_visible = True
+        self.grid_opacity = 1.0
+        self.render_state = RenderState()
+        self.backdrop = TextureBackdrop(self)
+        self.backdrop.tile_ready.connect(self.refresh_grid)
+        self.bbox_item = QBatchedRects(render_state=self.render_state)
+        self.wireframe_item = QUVWireframe(render_state=self.render_state)
+        self.preview_item = QBatchedRects(fill_color=PREVIEW_FILL_COLOR, active_color=PREVIEW_FILL_COLOR,
+                                          render_state=self.render_state)
+        self.preview_item.setZValue(1)
+        self.overlap_item = QBatchedRects(fill_color=OVERLAP_FILL_COLOR, active_color=OVERLAP_FILL_COLOR,
+                                          render_state=self.render_state)
+        self.overlap_item.setZValue(2)
         self.draw_grid()
         self.set_opacity(0.3)
-
-    @property
-    def rects(self):
-        return [self.bboxes[bbox] for bbox in self.bboxes]
+        self.addItem(self.bbox_item)
+        self.addItem(self.wireframe_item)
+        self.addItem(self.preview_item)
+        self.addItem(self.overlap_item)
 
     def focus_rect(self):
-        bbox_y_max = 0
-        bbox_x_max = 0
-        bbox_y_min = Settings.TOTAL_HEIGHT
-        bbox_x_min = Settings.TOTAL_WIDTH
-
-        for rect in self.rects:
-            bbox = rect.sceneBoundingRect()
-            bbox_x_min = min(bbox_x_min, bbox.x())
-            bbox_y_min = min(bbox_y_min, bbox.y())
-            bbox_x_max = max(bbox_x_max, bbox.x() + bbox.width())
-            bbox_y_max = max(bbox_y_max, bbox.y() + bbox.height())
-        items_rect = QtCore.QRectF(
-            bbox_x_min, bbox_y_min, bbox_x_max - bbox_x_min, bbox_y_max - bbox_y_min)
-        return items_rect
+        extents = self.bbox_item.extents()
+        if extents is None:
+            return self.default_rect()
+        return extents
+
+    @staticmethod
+    def default_rect():
+        return QtCore.QRectF(0, 0, Settings.TOTAL_WIDTH, Settings.TOTAL_HEIGHT)
+
+    @staticmethod
+    def tile_rect(u, v):
+        return QtCore.QRectF(u * Settings.WIDTH, Settings.TOTAL_HEIGHT - (v + 1) * Settings.HEIGHT,
+                             Settings.WIDTH, Settings.HEIGHT)
+
+    @staticmethod
+    def udim(u, v):
+        if 0 <= u < Settings.UDIM_COLUMNS and v >= 0:
+            return 1001 + u + v * Settings.UDIM_COLUMNS
+        return None
 
     def draw_grid(self):
-        width = Settings.NUM_BLOCKS_X * Settings.WIDTH
-        height = Settings.NUM_BLOCKS_Y * Settings.HEIGHT
-        self.setSceneRect(0, 0, width, height)
         self.setItemIndexMethod(QtWidgets.QGraphicsScene.NoIndex)
-
-        pen = QtGui.QPen(GRID_STROKE_COLOR, 1, QtCore.Qt.SolidLine)
-
-        for x in range(0, Settings.NUM_BLOCKS_X + 1):
-            xc = x * Settings.WIDTH
-            self.lines.append(self.addLine(xc, 0, xc, height, pen))
-
-        for y in range(0, Settings.NUM_BLOCKS_Y + 1):
-            yc = y * Settings.HEIGHT
-            self.lines.append(self.addLine(0, yc, width, yc, pen))
-
-    def set_rect_widths(self, value):
-        for rect in self.rects:
-            rect.setStrokeWidth(value)
-
-    def get_rect_widths(self):
-        for rect in self.rects:
-            return rect.strokeWidth
+        self.update_scene_rect()
+
+    def update_scene_rect(self):
+        """Grows the scene to the UDIM columns and every occupied tile row, plus a margin tile"""
+        rect = self.default_rect().united(self.tile_rect(Settings.UDIM_COLUMNS - 1, 0))
+        extents = self.bbox_item.extents()
+        if extents is not None:
+            rect = rect.united(extents)
+        rect.adjust(-Settings.WIDTH, -Settings.HEIGHT, Settings.WIDTH, Settings.HEIGHT)
+        if rect != self.sceneRect():
+            self.setSceneRect(rect)
+
+    def drawBackground(self, painter, rect):
+        super(GridScene, self).drawBackground(painter, rect)
+        self.backdrop.paint(painter, rect)
+        if not self.grid_visible:
+            return
+
+        u0 = int(np.floor(rect.left() / Settings.WIDTH))
+        u1 = int(np.ceil(rect.right() / Settings.WIDTH))
+        v0 = int(np.floor((Settings.TOTAL_HEIGHT - rect.bottom()) / Settings.HEIGHT))
+        v1 = int(np.ceil((Settings.TOTAL_HEIGHT - rect.top()) / Settings.HEIGHT))
+        tile_pixels = Settings.WIDTH * painter.worldTransform().m11()
+        if tile_pixels < Settings.GRID_MIN_TILE_PIXELS:
+            return
+
+        painter.save()
+        painter.setOpacity(self.grid_opacity)
+
+        counts = self.bbox_item.tile_counts
+        occupied = [(u, v) for (u, v) in counts if u0 <= u <= u1 and v0 <= v <= v1]
+        if occupied:
+            most = float(max(counts[tile] for tile in occupied))
+            painter.setPen(QtCore.Qt.NoPen)
+            for u, v in occupied:
+                color = QtGui.QColor(OCCUPIED_TILE_COLOR)
+                color.setAlphaF(color.alphaF() * (0.25 + 0.75 * counts[(u, v)] / most))
+                painter.fillRect(self.tile_rect(u, v), color)
+
+        painter.setPen(self.render_state.pen(GRID_STROKE_COLOR))
+        top = Settings.TOTAL_HEIGHT - (v1 + 1) * Settings.HEIGHT
+        bottom = Settings.TOTAL_HEIGHT - (v0 - 1) * Settings.HEIGHT
+        lines = [QtCore.QLineF(u * Settings.WIDTH, top, u * Settings.WIDTH, bottom) for u in range(u0, u1 + 1)]
+        lines.extend(QtCore.QLineF(u0 * Settings.WIDTH, Settings.TOTAL_HEIGHT - v * Settings.HEIGHT,
+                                   u1 * Settings.WIDTH, Settings.TOTAL_HEIGHT - v * Settings.HEIGHT)
+                     for v in range(v0, v1 + 1))
+        painter.drawLines(lines)
+
+        if tile_pixels >= Settings.GRID_LABEL_MIN_PIXELS:
+            font = painter.font()
+            font.setPointSizeF(Settings.HEIGHT * 0.12)
+            painter.setFont(font)
+            painter.setPen(GRID_LABEL_COLOR)
+            for u in range(u0, u1 + 1):
+                for v in range(v0, v1 + 1):
+                    udim = self.udim(u, v)
+                    if udim is None:
+                        continue
+                    label = str(udim)
+                    if (u, v) in counts:
+                        label += '\n%d' % counts[(u, v)]
+                    tile = self.tile_rect(u, v).adjusted(1, 1, -1, -1)
+                    painter.drawText(tile, QtCore.Qt.AlignLeft | QtCore.Qt.AlignTop, label)
+        painter.restore()
+
+    def refresh_grid(self, rect=None):
+        self.invalidate(rect or self.sceneRect(), QtWidgets.QGraphicsScene.BackgroundLayer)
+
+    def set_textures(self, textures):
+        self.backdrop.set_textures(textures)
+        self.refresh_grid()
 
     def set_visible(self, visible=True):
-        for line in self.lines:
-            line.setVisible(visible)
+        self.grid_visible = visible
+        self.refresh_grid()
 
     def delete_grid(self):
-        for line in self.lines:
-            self.removeItem(line)
-        del self.lines[:]
+        self.set_visible(False)
 
     def set_opacity(self, opacity):
-        for line in self.lines:
-            line.setOpacity(opacity)
+        self.grid_opacity = opacity
+        self.refresh_grid()
 
     def clear(self):
-        for rect in self.rects:
-            self.removeItem(rect)
+        self.bbox_item.clear()
+        self.wireframe_item.set_shapes({})
 
     def update_rect(self, uv_data):
-        scale_x = Settings.WIDTH * Settings.NUM_BLOCKS_X
-        scale_y = Settings.HEIGHT * Settings.NUM_BLOCKS_Y
-
+        rects = {}
         for xform in uv_data:
             for shape in uv_data[xform]:
                 shape_uv_data = uv_data[xform][shape]
 
-                bbox = shape_uv_data.get(dcc.bbox, (0, 0, 0, 0))
-                x_minmax, y_minmax = bbox
-                min_x, max_x = x_minmax
-                min_y, max_y = y_minmax
-                width = max_x - min_x
-                height = max_y - min_y
-
-                rect_values = [
-                    val * Settings.WIDTH for val in [min_x, max_y, width, height]]
-                rect_values[1] = scale_y - rect_values[1]
-                x, y, width, height = rect_values
-
-                if shape_uv_data.get(self.RECT):
-                    self.removeItem(shape_uv_data[self.RECT])
-
-                rect = QStrokeRect(QtCore.QRectF(x, y, width, height))
-                shape_uv_data[self.RECT] = rect
-                self.bboxes[shape] = rect
+                rect_values = shape_uv_data.get(pipeline.RECT_VALUES)
+                if rect_values is None:
+                    bbox = shape_uv_data.get(dcc.bbox, ((0, 0), (0, 0)))
+                    rect_values = pipeline.bbox_to_rect(bbox, Settings.WIDTH, Settings.TOTAL_HEIGHT)
+                rects[shape] = rect_values
+        self.bbox_item.set_rects(rects)
+        return rects
+
+    def draw_preview(self, bboxes, scale, offsets, indices=None):
+        """Shows packed shell placements as ghost rects keyed by shell index"""
+        rects = pipeline.layout_rects(bboxes, scale, offsets, Settings.WIDTH, Settings.TOTAL_HEIGHT)
+        if indices is None:
+            indices = range(len(rects))
+        rects = dict(zip([int(index) for index in indices], rects.tolist()))
+        self.preview_item.remove([key for key in self.preview_item.keys if key not in rects])
+        self.preview_item.set_rects(rects)
+
+    def clear_preview(self):
+        self.preview_item.clear()
+
+    def draw_overlaps(self, bboxes, pairs):
+        """Highlights the bboxes of every shell taking part in an overlapping pair"""
+        shells = np.unique(np.asarray(pairs, dtype=np.int64))
+        shell_bboxes = np.asarray(bboxes).reshape(-1, 2, 2)[shells]
+        rects = pipeline.layout_rects(shell_bboxes, 1.0, shell_bboxes[:, :, 0], Settings.WIDTH, Settings.TOTAL_HEIGHT)
+        rects = dict(zip(shells.tolist(), rects.tolist()))
+        self.overlap_item.remove([key for key in self.overlap_item.keys if key not in rects])
+        self.overlap_item.set_rects(rects)
+
+    def clear_overlaps(self):
+        self.overlap_item.clear()
 
     def draw_uv_bboxes(self, uv_data):
-        self.clear()
+        uv_data = {xform: uv_data[xform] for xform in uv_data if uv_data[xform]}
+        shapes = set(shape for xform in uv_data for shape in uv_data[xform])
+        self.bbox_item.remove([shape for shape in self.bbox_item.keys if shape not in shapes])
         self.update_rect(uv_data)
-
-        for uv_entry in uv_data:
-            self.addItem(uv_data[uv_entry].get(self.RECT))
+        self.update_scene_rect()
+        self.refresh_grid()
+        self.wireframe_item.set_shapes({shape: (uv_data[xform][shape][pipeline.WIREFRAME],
+                                                uv_data[xform][shape][pipeline.SHELL_BBOXES])
+                                        for xform in uv_data for shape in uv_data[xform]
+                                        if uv_data[xform][shape].get(pipeline.WIREFRAME)})
 
 
-class DeselectableListView(QtWidgets.QListView):
+class DeselectableTreeView(QtWidgets.QTreeView):
     clear_selection = QtCore.Signal(bool)
 
+    def __init__(self, *args, **kwargs):
+        super(DeselectableTreeView, self).__init__(*args, **kwargs)
+        self.setRootIsDecorated(False)
+        self.setUniformRowHeights(True)
+        self.setAllColumnsShowFocus(True)
+        self.setSortingEnabled(True)
+        self.sortByColumn(0, QtCore.Qt.AscendingOrder)
+
     def mousePressEvent(self, event):
         if not self.indexAt(event.pos()).isValid():
             self.clearSelection()
             self.clear_selection.emit(True)
-        super(DeselectableListView, self).mousePressEvent(event)
+        super(DeselectableTreeView, self).mousePressEvent(event)
+
+
+instrument(QBatchedRects, names=('paint', 'set_rects', 'set_selected'))
+instrument(QUVWireframe, names=('paint', 'set_shapes'))
+instrument(GridView, names=('updateViewer', 'rubberband_release', 'frame_items'))
+instrument(GridScene, names=('drawBackground', 'draw_uv_bboxes', 'draw_preview', 'draw_overlaps'))
@@ -0,0 +1,222 @@
+from PySide2 import QtCore
+
+from ..profiling import PROFILER
+
+
+class CancelledError(Exception):
+    pass
+
+
+class WorkerSignals(QtCore.QObject):
+    progress = QtCore.Signal(int, int)
+    partial = QtCore.Signal(object)
+    finished = QtCore.Signal(object)
+    errored = QtCore.Signal(object)
+    cancelled = QtCore.Signal()
+
+
+class Worker(QtCore.QRunnable):
+    """Runs a pure-Python stage on a QThreadPool thread
+
+    The stage is called as fn(worker, *args, **kwargs) so it can poll
+    check_cancelled() and call report_progress() or report_partial() while it
+    works. Results are marshalled back to the main thread through the
+    worker's signals."""
+
+    def __init__(self, key, generation, fn, *args, **kwargs):
+        super(Worker, self).__init__()
+        self.key = key
+        self.generation = generation
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self._cancelled = False
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        self._cancelled = True
+
+    def check_cancelled(self):
+        if self._cancelled:
+            raise CancelledError('Job %s was cancelled' % self.key)
+
+    def report_progress(self, value, maximum):
+        if not self._cancelled:
+            self.signals.progress.emit(value, maximum)
+
+    def report_partial(self, value):
+        if not self._cancelled:
+            self.signals.partial.emit(value)
+
+    def run(self):
+        try:
+            self.check_cancelled()
+            with PROFILER.timer('job.%s' % self.key.split('.')[0]):
+                result = self.fn(self, *self.args, **self.kwargs)
+            self.check_cancelled()
+        except CancelledError:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.errored.emit(e)
+        else:
+            self.signals.finished.emit(result)
+
+
+class WorkerPool(QtCore.QObject):
+    """Keyed job queue on top of QThreadPool
+
+    Only one job per key is considered current: submitting a new job under an
+    existing key cancels the running one and any result it still produces is
+    dropped, so callbacks only ever see the output of the newest input."""
+    progress = QtCore.Signal(str, int, int)
+    errored = QtCore.Signal(str, object)
+    busy = QtCore.Signal(bool)
+
+    def __init__(self, parent=None, max_threads=None):
+        super(WorkerPool, self).__init__(parent)
+        self.pool = QtCore.QThreadPool()
+        if max_threads:
+            self.pool.setMaxThreadCount(max_threads)
+        self.jobs = {}
+        self.running = set()
+        self.generations = {}
+
+    @property
+    def is_busy(self):
+        return bool(self.jobs)
+
+    def is_current(self, worker):
+        return self.generations.get(worker.key) == worker.generation
+
+    def submit(self, key, fn, args=(), kwargs=None, callback=None, errback=None, partial=None):
+        # The superseded job is dropped silently so busy does not flicker off and on
+        was_busy = self.is_busy
+        self.discard(key)
+        generation = self.generations.get(key, 0) + 1
+        self.generations[key] = generation
+
+        worker = Worker(key, generation, fn, *args, **(kwargs or {}))
+        worker.setAutoDelete(False)
+        worker.signals.progress.connect(lambda value, maximum: self.on_progress(worker, value, maximum))
+        worker.signals.partial.connect(lambda value: self.on_partial(worker, value, partial))
+        worker.signals.finished.connect(lambda result: self.on_finished(worker, result, callback))
+        worker.signals.errored.connect(lambda error: self.on_errored(worker, error, errback))
+        worker.signals.cancelled.connect(lambda: self.on_cancelled(worker))
+
+        self.jobs[key] = worker
+        self.running.add(worker)
+        if not was_busy:
+            self.busy.emit(True)
+        self.pool.start(worker)
+        return worker
+
+    def discard(self, key):
+        """Cancels the job under key without signalling busy, returns whether there was one"""
+        worker = self.jobs.pop(key, None)
+        if worker is not None:
+            worker.cancel()
+        return worker is not None
+
+    def cancel(self, key):
+        if self.discard(key) and not self.is_busy:
+            self.busy.emit(False)
+
+    def has_group(self, prefix):
+        return any(key.startswith(prefix) for key in self.jobs)
+
+    def cancel_group(self, prefix):
+        for key in [key for key in self.jobs if key.startswith(prefix)]:
+            self.cancel(key)
+
+    def cancel_all(self):
+        for key in list(self.jobs):
+            self.cancel(key)
+
+    def wait(self, msecs=-1):
+        return self.pool.waitForDone(msecs)
+
+    def on_progress(self, worker, value, maximum):
+        if self.is_current(worker):
+            self.progress.emit(worker.key, value, maximum)
+
+    def on_partial(self, worker, value, partial):
+        if partial is not None and self.is_current(worker) and not worker.cancelled:
+            partial(value)
+
+    def on_finished(self, worker, result, callback):
+        self.running.discard(worker)
+        if self.is_current(worker) and not worker.cancelled:
+            self.on_done(worker)
+            if callback is not None:
+                callback(result)
+
+    def on_errored(self, worker, error, errback):
+        self.running.discard(worker)
+        if self.is_current(worker) and not worker.cancelled:
+            self.on_done(worker)
+            self.errored.emit(worker.key, error)
+            if errback is not None:
+                errback(error)
+
+    def on_cancelled(self, worker):
+        self.running.discard(worker)
+        self.on_done(worker)
+
+    def on_done(self, worker):
+        if self.jobs.get(worker.key) is worker:
+            del self.jobs[worker.key]
+            if not self.is_busy:
+                self.busy.emit(False)
+
+
+class ChunkStream(QtCore.QObject):
+    """Drains a chunk generator on the main thread, one chunk per event loop pass
+
+    Used for DCC reads, which cannot leave the main thread but should still
+    let the UI repaint, report progress and be cancelled between chunks."""
+    chunk = QtCore.Signal(object)
+    finished = QtCore.Signal()
+    cancelled = QtCore.Signal()
+
+    def __init__(self, parent=None):
+        super(ChunkStream, self).__init__(parent)
+        self.generator = None
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.step)
+
+    @property
+    def is_running(self):
+        return self.generator is not None
+
+    def start(self, generator):
+        self.cancel()
+        self.generator = generator
+        self.timer.start()
+
+    def cancel(self):
+        if self.is_running:
+            self.stop()
+            self.cancelled.emit()
+
+    def stop(self):
+        self.timer.stop()
+        if self.generator is not None:
+            self.generator.close()
+        self.generator = None
+
+    def step(self):
+        try:
+            chunk = next(self.generator)
+        except StopIteration:
+            self.stop()
+            self.finished.emit()
+        except Exception:
+            self.stop()
+            raise
+        else:
+            self.chunk.emit(chunk)